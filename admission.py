@@ -0,0 +1,184 @@
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+
+from metrics import ADMISSION_REJECTED, ADMISSION_WAIT_SECONDS
+
+# =========== ADMISSION CONTROL ===========
+# The CPU runs one forward pass (or one per worker process) at a time, and
+# every feed, upload scan and /detect request competes for it. Without a
+# gate the newest arrival just queues behind everyone, so a big upload being
+# scanned slows the live cameras down with it. Work comes in three classes,
+# highest first:
+#
+#   live      cameras and live streams (RTSP / HTTP / a camera index)
+#   offline   video files and uploads being scanned
+#   preview   single images and /detect requests
+#
+# Three things keep the higher classes at their frame rate:
+#
+#   - slot(): inference calls take one of `slots` slots, and waiting calls
+#     get them highest class first (oldest first within a class).
+#   - slowdown(): once the slots are busy most of the time, or live work is
+#     queuing, lower classes stretch their frame interval (up to
+#     degrade_factor times), so they ask for fewer slots.
+#   - admit(): new work is turned away with Overloaded (a 503 with
+#     Retry-After) when its class already runs max_feeds feeds. Offline
+#     work is also turned away once max_queue calls wait for a slot, and
+#     previews as soon as the gate is saturated. Live work is only capped
+#     by its feed limit.
+
+LIVE = 'live'
+OFFLINE = 'offline'
+PREVIEW = 'preview'
+PRIORITIES = (LIVE, OFFLINE, PREVIEW)
+
+
+class Overloaded(Exception):
+    """New work turned away; retry_after is the suggested wait in seconds"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Priority gate in front of the net, plus load shedding and degradation of lower classes"""
+
+    def __init__(self, slots=1, max_feeds=None, max_queue=8, retry_after=5,
+                 high_water=0.8, degrade_factor=4.0, sample_interval=1.0):
+        self.slots = max(1, int(slots))
+        # Concurrent feeds per class; a missing or None entry means no limit
+        self.max_feeds = dict(max_feeds or {})
+        self.max_queue = max(1, int(max_queue))
+        self.retry_after = int(retry_after)
+        self.high_water = float(high_water)
+        self.degrade_factor = max(1.0, float(degrade_factor))
+        self.sample_interval = sample_interval
+        self.cond = threading.Condition()
+        self.queue = []
+        self.seq = itertools.count()
+        self.waiting = dict.fromkeys(PRIORITIES, 0)
+        self.running = {}
+        self.busy_seconds = 0.0
+        self.sampled_at = time.perf_counter()
+        self.sampled_busy = 0.0
+        self.utilization = 0.0
+        self.admitted = dict.fromkeys(PRIORITIES, 0)
+        self.rejected = dict.fromkeys(PRIORITIES, 0)
+
+    @contextlib.contextmanager
+    def slot(self, priority=OFFLINE):
+        """Hold one inference slot; slots are handed out highest class first"""
+        ticket = self._acquire(priority if priority in PRIORITIES else OFFLINE)
+        try:
+            yield
+        finally:
+            self._release(ticket)
+
+    def _acquire(self, priority):
+        queued = time.perf_counter()
+        with self.cond:
+            ticket = (PRIORITIES.index(priority), next(self.seq))
+            heapq.heappush(self.queue, ticket)
+            self.waiting[priority] += 1
+            while len(self.running) >= self.slots or self.queue[0] != ticket:
+                self.cond.wait()
+            heapq.heappop(self.queue)
+            self.waiting[priority] -= 1
+            started = time.perf_counter()
+            self.running[ticket] = started
+            # The next in line may fit in another free slot
+            self.cond.notify_all()
+        ADMISSION_WAIT_SECONDS.observe(started - queued, priority)
+        return ticket
+
+    def _release(self, ticket):
+        with self.cond:
+            self.busy_seconds += time.perf_counter() - self.running.pop(ticket)
+            self.cond.notify_all()
+
+    def queue_depth(self):
+        with self.cond:
+            return len(self.queue)
+
+    def load(self):
+        """Share of slot time in use, smoothed over sample_interval windows (0..1)"""
+        now = time.perf_counter()
+        with self.cond:
+            elapsed = now - self.sampled_at
+            if elapsed >= self.sample_interval:
+                # Calls still running count up to now
+                busy = self.busy_seconds + sum(now - started for started in self.running.values())
+                current = min(1.0, (busy - self.sampled_busy) / (elapsed * self.slots))
+                self.utilization = (self.utilization + current) / 2
+                self.sampled_at, self.sampled_busy = now, busy
+            return self.utilization
+
+    def pressure(self, priority):
+        """How hard a class should back off (0..1) once load is past high_water
+
+        Full pressure while a higher class is queuing for a slot, else rising
+        with the load from high_water to fully busy.
+        """
+        if priority == LIVE:
+            return 0.0
+        load = self.load()
+        if load <= self.high_water:
+            return 0.0
+        with self.cond:
+            if any(self.waiting[p] for p in PRIORITIES[:PRIORITIES.index(priority)]):
+                return 1.0
+        return min(1.0, (load - self.high_water) / max(1.0 - self.high_water, 1e-6))
+
+    def saturated(self, queued=0):
+        """True when the slot queue is full, or calls queue while the slots are busy past high_water"""
+        depth = self.queue_depth() + queued
+        return depth >= self.max_queue or (depth > 0 and self.load() > self.high_water)
+
+    def slowdown(self, priority):
+        """Factor to stretch a class's frame interval by; 1.0 for live work and an idle CPU"""
+        return 1.0 + (self.degrade_factor - 1.0) * self.pressure(priority)
+
+    def admit(self, priority, running_feeds=0, queued=0):
+        """Raise Overloaded when new work of this class should be turned away now
+
+        running_feeds is how many feeds of the class already run; queued adds
+        work waiting elsewhere (e.g. in the /detect batcher) to the slot queue.
+        """
+        limit = self.max_feeds.get(priority)
+        if limit is not None and running_feeds >= limit:
+            self._reject(priority, f"Too many {priority} feeds running ({limit} max)")
+        if priority == OFFLINE and self.queue_depth() + queued >= self.max_queue:
+            self._reject(priority, 'Inference queue is full')
+        if priority == PREVIEW and self.saturated(queued):
+            self._reject(priority, 'Server busy with higher-priority work')
+        with self.cond:
+            self.admitted[priority] += 1
+
+    def _reject(self, priority, message):
+        with self.cond:
+            self.rejected[priority] += 1
+        ADMISSION_REJECTED.inc(1, priority)
+        raise Overloaded(message, self.retry_after)
+
+    def stats(self):
+        load = self.load()
+        slowdown = {priority: round(self.slowdown(priority), 2) for priority in PRIORITIES}
+        saturated = self.saturated()
+        with self.cond:
+            return {
+                'slots': self.slots,
+                'busy_slots': len(self.running),
+                'utilization': round(load, 3),
+                'queue_depth': len(self.queue),
+                'max_queue': self.max_queue,
+                'waiting': dict(self.waiting),
+                'slowdown': slowdown,
+                'admitted': dict(self.admitted),
+                'rejected': dict(self.rejected),
+                'saturated': saturated,
+            }
+
@@ -0,0 +1,224 @@
+"""Headless batch analysis of recorded footage
+
+Splits a video into frame ranges, runs each range on its own worker process
+with its own copy of the network, and writes a merged detection timeline.
+Nothing is drawn or JPEG-encoded, so it runs as fast as the CPU allows.
+
+    python analyze.py footage.mp4 -o timeline.jsonl --workers 8
+    python analyze.py footage.mp4 -o timeline.csv --all-frames
+    python analyze.py footage.mp4 --sample hz=2,start=600,end=900
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import cv2
+
+from decoding import CONFIDENCE_THRESHOLD, NMS_THRESHOLD, decode_batch
+from backends import BACKENDS, create_backend
+from preprocess import BlobBuilder
+from sampling import SamplingPolicy, VideoSource, scan_keyframes
+
+DEFAULT_CONFIG = "yolov3_testing.cfg"
+DEFAULT_WEIGHTS = "yolov3_training_2000.weights"
+
+# Per-process worker state, set up once by init_worker
+worker = {}
+
+
+def init_worker(config_path, weights_path, threads, options):
+    """Load a private copy of the network in each pool process"""
+    cv2.setNumThreads(threads)
+    worker['backend'] = create_backend(options['backend'], config_path=config_path,
+                                       weights_path=weights_path,
+                                       onnx_model_path=options['onnx_model'],
+                                       int8_model_path=options['int8_model'],
+                                       threads=threads)
+    worker['options'] = options
+    worker['blob_builder'] = BlobBuilder()
+
+
+def infer_batch(frames):
+    options = worker['options']
+    size = options['input_size']
+    blob, layouts = worker['blob_builder'].build(frames, size)
+    outs = worker['backend'].forward(blob)
+    target_sizes = [(frame.shape[1], frame.shape[0]) for frame in frames]
+    return decode_batch(outs, layouts, size, target_sizes, options['confidence'], options['nms'])
+
+
+def analyze_range(job):
+    """Detect objects on the sampled frames of [start, end) of a video and return their records"""
+    video_path, start, end, fps, keyframes = job
+    options = worker['options']
+    source = VideoSource(video_path, options['sample'], start, end, keyframes)
+
+    records = []
+    pending = []
+
+    def flush():
+        for (index, _), (boxes, confidences, class_ids) in zip(pending, infer_batch([f for _, f in pending])):
+            if len(boxes) == 0 and not options['all_frames']:
+                continue
+            records.append({
+                'frame': index,
+                'timestamp': round(index / fps, 3) if fps > 0 else None,
+                'boxes': boxes.tolist(),
+                'confidences': [round(c, 4) for c in confidences.tolist()],
+                'class_ids': class_ids.tolist(),
+            })
+        pending.clear()
+
+    for frame_index, _, frame in source:
+        pending.append((frame_index, frame))
+        if len(pending) >= options['batch_size']:
+            flush()
+    if pending:
+        flush()
+
+    source.release()
+    return start, source.stats(), records
+
+
+def plan_ranges(frame_count, shards):
+    """Split [0, frame_count) into contiguous ranges; the last one runs to EOF"""
+    if frame_count <= 0:
+        return [(0, None)]
+    shards = max(1, min(shards, frame_count))
+    step = -(-frame_count // shards)
+    ranges = [(start, start + step) for start in range(0, frame_count, step)]
+    # Container frame counts are estimates, so let the last shard read to the end
+    ranges[-1] = (ranges[-1][0], None)
+    return ranges
+
+
+def write_jsonl(path, records):
+    with open(path, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+def write_csv(path, records):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['frame', 'timestamp', 'x', 'y', 'w', 'h', 'confidence', 'class_id'])
+        for record in records:
+            if not record['boxes']:
+                writer.writerow([record['frame'], record['timestamp'], '', '', '', '', '', ''])
+            for box, confidence, class_id in zip(record['boxes'], record['confidences'], record['class_ids']):
+                writer.writerow([record['frame'], record['timestamp'], *box, confidence, class_id])
+
+
+def parse_args(argv=None):
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Headless batch weapon detection over a video file")
+    parser.add_argument('video', help="Video file to analyze")
+    parser.add_argument('-o', '--output', default=None,
+                        help="Timeline file (.jsonl or .csv); defaults to <video>.jsonl")
+    parser.add_argument('--format', choices=['jsonl', 'csv'], default=None,
+                        help="Output format; guessed from the output extension by default")
+    parser.add_argument('--workers', type=int, default=cpus, help="Worker processes")
+    parser.add_argument('--threads-per-worker', type=int, default=None,
+                        help="OpenCV threads per worker (default: cores / workers)")
+    parser.add_argument('--shards-per-worker', type=int, default=4,
+                        help="Frame ranges per worker, for load balancing")
+    parser.add_argument('--batch-size', type=int, default=4, help="Frames per forward pass")
+    parser.add_argument('--input-size', type=int, default=416, help="Network input size (multiple of 32)")
+    parser.add_argument('--confidence', type=float, default=CONFIDENCE_THRESHOLD)
+    parser.add_argument('--nms', type=float, default=NMS_THRESHOLD)
+    parser.add_argument('--all-frames', action='store_true',
+                        help="Also write frames without detections")
+    parser.add_argument('--sample', default='all',
+                        help="Frames to analyze: all, every=K, hz=H or keyframes, "
+                             "plus optional start=/end= seconds (e.g. hz=2,start=60)")
+    parser.add_argument('--config', default=DEFAULT_CONFIG, help="Darknet cfg file")
+    parser.add_argument('--weights', default=DEFAULT_WEIGHTS, help="Darknet weights file")
+    parser.add_argument('--backend', choices=BACKENDS, default='opencv', help="Inference backend")
+    parser.add_argument('--onnx-model', default=None, help="Exported ONNX model (onnxruntime / onnx_int8)")
+    parser.add_argument('--int8-model', default=None,
+                        help="INT8 ONNX model; created from --onnx-model if missing")
+    args = parser.parse_args(argv)
+
+    if args.input_size % 32 != 0:
+        parser.error("--input-size must be a multiple of 32")
+    try:
+        args.sample = SamplingPolicy.parse(args.sample)
+    except ValueError as e:
+        parser.error(f"--sample: {e}")
+    args.workers = max(1, args.workers)
+    if args.threads_per_worker is None:
+        args.threads_per_worker = max(1, cpus // args.workers)
+    if args.output is None:
+        args.output = os.path.splitext(args.video)[0] + '.jsonl'
+    if args.format is None:
+        args.format = 'csv' if args.output.lower().endswith('.csv') else 'jsonl'
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.video):
+        sys.exit(f"[ERROR] Video not found: {args.video}")
+
+    cap = cv2.VideoCapture(args.video)
+    if not cap.isOpened():
+        sys.exit(f"[ERROR] Cannot open video: {args.video}")
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+    cap.release()
+
+    ranges = plan_ranges(frame_count, args.workers * args.shards_per_worker)
+    # One pass over the packets (no decoding) tells every worker where it can seek:
+    # the keyframes policy needs it, and so do shards that start mid-file
+    keyframes = None
+    if args.sample.needs_keyframes or len(ranges) > 1:
+        keyframes = scan_keyframes(args.video)
+    jobs = [(args.video, start, end, fps, keyframes) for start, end in ranges]
+    options = {
+        'input_size': args.input_size,
+        'confidence': args.confidence,
+        'nms': args.nms,
+        'batch_size': max(1, args.batch_size),
+        'all_frames': args.all_frames,
+        'sample': str(args.sample),
+        'backend': args.backend,
+        'onnx_model': args.onnx_model and os.path.abspath(args.onnx_model),
+        'int8_model': args.int8_model and os.path.abspath(args.int8_model),
+    }
+    print(f"[ANALYZE] {args.video}: ~{frame_count} frames @ {fps:.1f} fps, sampling {args.sample}, "
+          f"{len(jobs)} ranges on {args.workers} workers x {args.threads_per_worker} threads")
+
+    started = time.time()
+    records = []
+    decode = {}
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(args.workers, initializer=init_worker,
+                  initargs=(os.path.abspath(args.config), os.path.abspath(args.weights),
+                            args.threads_per_worker, options)) as pool:
+        # imap keeps the ranges in order, so the timeline comes out sorted
+        for start, range_stats, range_records in pool.imap(analyze_range, jobs):
+            records.extend(range_records)
+            for key in ('frames_sampled', 'frames_grabbed', 'frames_seeked_over', 'seeks', 'decode_seconds'):
+                decode[key] = decode.get(key, 0) + range_stats[key]
+
+    if args.format == 'csv':
+        write_csv(args.output, records)
+    else:
+        write_jsonl(args.output, records)
+
+    elapsed = time.time() - started
+    hits = sum(1 for record in records if record['boxes'])
+    frames_done = decode.get('frames_sampled', 0)
+    print(f"[DONE] {frames_done} frames in {elapsed:.1f}s ({frames_done / max(elapsed, 1e-6):.1f} fps), "
+          f"{hits} frames with detections -> {args.output}")
+    print(f"[DECODE] {args.sample}: {decode.get('frames_grabbed', 0)} frames grabbed without retrieve, "
+          f"{decode.get('frames_seeked_over', 0)} skipped in {decode.get('seeks', 0)} seeks, "
+          f"{1000 * decode.get('decode_seconds', 0) / max(frames_done, 1):.2f} ms decode per analyzed frame")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,8 @@
+import atexit
+import hashlib
+import itertools
+import json
+import math
 import cv2
 import numpy as np
 import time
@@ -5,18 +10,36 @@ import random
 import threading
 import os
 from datetime import datetime
-from flask import Flask, render_template, Response, request, jsonify
+from flask import Flask, render_template_string, Response, request, jsonify
 from werkzeug.utils import secure_filename
 
-# =========== NEURAL NET INITIALIZATION ===========
-print("[INITIALIZING] NightCity Security Protocol v2.077")
+from admission import LIVE, OFFLINE, PREVIEW, PRIORITIES, AdmissionController, Overloaded
+from backends import create_backend
+from batching import MicroBatcher
+from cache import ResultCache, file_digest, pack_detections, perceptual_hash, remember_digest, unpack_detections
+from decoding import CONFIDENCE_THRESHOLD, NMS_THRESHOLD, decode_batch
+from clips import ClipBuffer, ClipWriter
+from events import EventStore
+from hub import HubRegistry, multipart_chunk
+from metrics import ALERTS, BATCH_SIZE, CONTENT_TYPE, REGISTRY, STAGE_SECONDS, MetricFamily
+from motion import MotionGate
+from pipeline import LivePipeline
+from preprocess import BlobBuilder
+from resolution import ResolutionController
+from sampling import VideoSource
+from session import DetectionSession, Overlay, SessionRegistry
+from streams import StreamRegistry, is_live_source
+from tracing import TRACER
+from tracker import KeyframeTracker
+from uploads import UploadStore, UploadTooLarge
+from workers import InferencePool
+from zones import ZoneSet, infer_in_zones
 
-config_path = os.path.abspath("yolov3_testing.cfg")
-weights_path = os.path.abspath("yolov3_training_2000.weights")
+# =========== NEURAL NET INITIALIZATION ===========
+# Nothing is loaded here: the model is read on first use (get_backend) or by
+# the warmup that servers start before reporting ready (start_warmup).
 
-net = cv2.dnn.readNetFromDarknet(config_path, weights_path)
 classes = ["Threat-Object"]
-output_layer_names = net.getUnconnectedOutLayersNames()
 
 # Cyberpunk color scheme - neon colors
 NEON_COLORS = [
@@ -28,13 +51,6 @@ NEON_COLORS = [
 ]
 colors = np.array(NEON_COLORS)
 
-# Global variables
-detection_active = False
-scan_line_pos = 0
-threat_count = 0
-last_detection_time = 0
-cap = None
-
 # Fixed dimensions for video display
 DISPLAY_WIDTH = 640
 DISPLAY_HEIGHT = 480
@@ -42,11 +58,131 @@ DISPLAY_HEIGHT = 480
 # Create Flask app
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max per request; bigger files go to /uploads in chunks
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'mp4', 'avi'}
 
-# Ensure the upload folder exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Chunked, resumable uploads; stored files are deduplicated by content and expire
+app.config['UPLOAD_CHUNK_SIZE'] = 8 * 1024 * 1024  # suggested to clients; must fit MAX_CONTENT_LENGTH
+app.config['UPLOAD_MAX_FILE_BYTES'] = None  # None = no limit on a chunked upload
+app.config['UPLOAD_MAX_TOTAL_BYTES'] = 10 * 1024 * 1024 * 1024  # oldest files go first past this
+app.config['UPLOAD_RETENTION'] = 24 * 3600  # seconds since a file was last uploaded or played
+app.config['UPLOAD_SESSION_TIMEOUT'] = 3600  # idle seconds before an unfinished upload is dropped
+app.config['UPLOAD_PROGRESS_BYTES'] = 1024 * 1024  # new bytes to wait for before decoding more of a growing video
+
+# Model files, relative to the working directory unless absolute
+app.config['MODEL_CONFIG_PATH'] = os.environ.get('MODEL_CONFIG', 'yolov3_testing.cfg')
+app.config['MODEL_WEIGHTS_PATH'] = os.environ.get('MODEL_WEIGHTS', 'yolov3_training_2000.weights')
+app.config['WARMUP_ON_START'] = True  # load and run one forward pass before /ready says ready
+app.config['WARMUP_INPUT_SIZE'] = None  # None = INPUT_SIZE
+
+# Inference backend: 'opencv', 'onnxruntime', 'onnx_int8' or 'stub' (no weights needed)
+app.config['INFERENCE_BACKEND'] = os.environ.get('INFERENCE_BACKEND', 'opencv')
+app.config['DNN_BACKEND'] = 'default'  # opencv backend: default / opencv / openvino / cuda
+app.config['DNN_TARGET'] = 'cpu'  # cpu / cpu_fp16 / opencl / opencl_fp16 / cuda / cuda_fp16
+app.config['INFERENCE_THREADS'] = 0  # 0 keeps the library default
+app.config['ONNX_MODEL_PATH'] = os.environ.get('ONNX_MODEL', 'yolov3_training_2000.onnx')
+app.config['ONNX_INT8_MODEL_PATH'] = os.environ.get('ONNX_INT8_MODEL', 'yolov3_training_2000.int8.onnx')
+
+# Inference worker processes, fed through a shared-memory frame ring (0 = in-process)
+app.config['INFERENCE_WORKERS'] = int(os.environ.get('INFERENCE_WORKERS', 0))
+app.config['WORKER_THREADS'] = 0  # cores per worker; 0 splits the cores evenly
+app.config['WORKER_RING_SLOTS'] = 0  # 0 = 4 per worker
+app.config['WORKER_MAX_FRAME'] = (1080, 1920)  # bigger frames are downscaled into the ring
+app.config['WORKER_TIMEOUT'] = 30.0  # seconds a batch may take in a worker before the call fails and the worker is restarted
+
+# Network input size; adaptive mode moves between the levels to meet the budget
+app.config['INPUT_SIZE'] = 416
+app.config['ADAPTIVE_RESOLUTION'] = False
+app.config['RESOLUTION_LEVELS'] = (256, 320, 416, 608)
+app.config['LATENCY_BUDGET'] = 0.2  # seconds of inference per frame
+
+# The blob is built from the native frame; the display copy is a separate resize
+app.config['DISPLAY_RESIZE'] = True  # False renders on the native frame
+app.config['LETTERBOX'] = False  # keep aspect ratio in the blob instead of stretching
+
+# Which frames of a video file get analyzed: 'all', 'every=5', 'hz=2' or 'keyframes',
+# optionally limited to a window with ',start=60,end=120' (seconds). See sampling.py.
+app.config['VIDEO_SAMPLING'] = os.environ.get('VIDEO_SAMPLING', 'all')
+
+# Regions of interest: only crops around a source's zones go through the net (see zones.py)
+app.config['ROI_ZONES'] = json.loads(os.environ.get('ROI_ZONES') or '{}')  # source id ('camera', a video path, a stream id) -> zones
+app.config['ROI_CROP_MODE'] = 'union'  # 'union' = one crop around all zones, 'zones' = one crop per zone
+app.config['ROI_CROP_MARGIN'] = 0.05  # fraction of the frame kept around each crop
+app.config['ROI_SCALE_INPUT'] = False  # shrink the input size with the crop: faster, same detail as full frame
+
+# Live camera runs capture / inference / encode on separate threads
+app.config['LIVE_PIPELINE'] = True
+app.config['CAPTURE_QUEUE_SIZE'] = 1  # 1 = inference always takes the newest frame
+app.config['ENCODE_QUEUE_SIZE'] = 1
+app.config['OUTPUT_QUEUE_SIZE'] = 2
+
+# MJPEG viewers of one source share a hub; each picks the nearest tier
+app.config['STREAM_QUALITIES'] = (50, 70, 95)  # JPEG quality tiers; the top one is the default
+app.config['STREAM_WIDTHS'] = (320, 480, DISPLAY_WIDTH)  # viewer widths; the top one is the default
+app.config['HUB_IDLE_TIMEOUT'] = 5.0  # seconds a source keeps running with no viewers
+
+# Multi-stream engine: frames from different streams share one forward pass
+app.config['STREAM_MAX_BATCH'] = 4
+app.config['STREAM_DEFAULT_FPS'] = 10.0
+
+# /detect: images from concurrent requests are coalesced into shared forward passes
+app.config['DETECT_MAX_BATCH'] = 8  # images per coalesced forward pass
+app.config['DETECT_MAX_WAIT'] = 0.005  # seconds the oldest image waits for others to join it
+app.config['DETECT_MAX_IMAGES'] = 32  # images per request
+
+# Admission control: live cameras before offline scans before previews, with 503s past saturation
+app.config['ADMISSION_CONTROL'] = True
+app.config['ADMISSION_SLOTS'] = 0  # inference calls at once; 0 = one per worker process (1 in-process)
+app.config['ADMISSION_MAX_FEEDS'] = {'live': 8, 'offline': 4}  # concurrent feeds per class; missing = no limit
+app.config['ADMISSION_MAX_QUEUE'] = 8  # inference calls waiting for a slot before offline work gets a 503
+app.config['ADMISSION_RETRY_AFTER'] = 5  # seconds, sent as Retry-After with a 503
+app.config['ADMISSION_HIGH_WATER'] = 0.8  # slot utilization where lower classes start backing off
+app.config['ADMISSION_DEGRADE_FACTOR'] = 4.0  # most a lower class's frame interval is stretched
+
+# Frame tracing: /trace records a window of per-frame spans as Chrome trace JSON
+app.config['TRACE_SECONDS'] = 5.0  # default window
+app.config['TRACE_MAX_SECONDS'] = 60.0
+app.config['TRACE_MAX_EVENTS'] = 200000  # spans kept per window; a full window ends early
+
+# Detection results cached by content hash (memory LRU + disk tier)
+app.config['RESULT_CACHE'] = True
+app.config['RESULT_CACHE_ENTRIES'] = 256
+app.config['RESULT_CACHE_BYTES'] = 64 * 1024 * 1024
+app.config['RESULT_CACHE_DIR'] = 'cache'
+app.config['RESULT_CACHE_DISK_BYTES'] = 1024 * 1024 * 1024  # oldest entries go first past this
+app.config['RESULT_CACHE_MAX_AGE'] = 7 * 24 * 3600  # seconds since an entry was last written or read
+app.config['PHASH_MAX_DISTANCE'] = 0  # bits of a 64-bit dHash a near-duplicate image may differ by; 0 = off
+
+# Skip the forward pass on frames where nothing moved
+app.config['MOTION_GATE'] = True
+app.config['MOTION_METHOD'] = 'diff'  # 'diff' or 'mog2'
+app.config['MOTION_PIXEL_THRESHOLD'] = 25
+app.config['MOTION_MIN_CHANGED_RATIO'] = 0.005
+app.config['MOTION_MAX_INTERVAL'] = 2.0  # seconds between forced re-checks
+
+# Every frame with detections is logged to SQLite, written in batches off the frame loop
+app.config['EVENT_STORE'] = True
+app.config['EVENT_DB_PATH'] = os.environ.get('EVENT_DB', 'events.db')
+app.config['EVENT_BATCH_SIZE'] = 200
+app.config['EVENT_FLUSH_INTERVAL'] = 0.5  # seconds
+app.config['EVENT_QUEUE_SIZE'] = 10000  # events waiting for the writer before new ones are dropped
+
+# Alert clips, cut from a ring of the JPEGs each live source's hub already encoded
+app.config['CLIP_CAPTURE'] = True
+app.config['CLIP_DIR'] = os.environ.get('CLIP_DIR', 'clips')
+app.config['CLIP_PRE_SECONDS'] = 5.0  # kept before the first alert
+app.config['CLIP_POST_SECONDS'] = 5.0  # kept after the last alert
+app.config['CLIP_MAX_SECONDS'] = 60.0  # longest single clip
+app.config['CLIP_BUFFER_BYTES'] = 32 * 1024 * 1024  # ring memory per source; caps the pre-alert window
+app.config['CLIP_MAX_BYTES'] = 64 * 1024 * 1024  # JPEG data of the clip being captured; a full clip is cut there
+app.config['CLIP_WRITER_BYTES'] = 256 * 1024 * 1024  # finished clips waiting for the disk; more are dropped
+
+# Run the net only on keyframes and track boxes in between
+app.config['KEYFRAME_TRACKING'] = False
+app.config['KEYFRAME_INTERVAL'] = 5
+app.config['KEYFRAME_ADAPTIVE'] = True
+app.config['KEYFRAME_MAX_INTERVAL'] = 15
+app.config['TRACKER_PROPAGATION'] = 'flow'  # 'flow' or 'kalman'
 
 def allowed_file(filename):
     """Check if the file has an allowed extension"""
@@ -54,13 +190,306 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
 # =========== DETECTION ENGINE ===========
-def detect_objects(image):
-    global threat_count, last_detection_time, scan_line_pos
+def model_options():
+    """Keyword arguments of backends.create_backend, from app.config"""
+    return {
+        'name': app.config['INFERENCE_BACKEND'],
+        'config_path': os.path.abspath(app.config['MODEL_CONFIG_PATH']),
+        'weights_path': os.path.abspath(app.config['MODEL_WEIGHTS_PATH']),
+        'onnx_model_path': os.path.abspath(app.config['ONNX_MODEL_PATH']),
+        'int8_model_path': os.path.abspath(app.config['ONNX_INT8_MODEL_PATH']),
+        'dnn_backend': app.config['DNN_BACKEND'],
+        'dnn_target': app.config['DNN_TARGET'],
+        'threads': app.config['INFERENCE_THREADS']
+    }
+
+# Either one in-process backend shared by every request thread and the
+# stream scheduler, or a pool of worker processes that each load their own
+backend = None
+backend_lock = threading.Lock()
+blob_builder = BlobBuilder(letterbox=app.config['LETTERBOX'])
+
+def get_backend():
+    """The in-process backend, loaded by whichever thread needs it first"""
+    global backend
+    if backend is None:
+        with backend_lock:
+            if backend is None:
+                print("[INITIALIZING] NightCity Security Protocol v2.077")
+                backend = create_backend(**model_options())
+    return backend
+
+inference_pool = None
+inference_pool_lock = threading.Lock()
+
+def get_inference_pool():
+    """Start the worker pool on first use (never at import, which spawned workers repeat)"""
+    global inference_pool
+    with inference_pool_lock:
+        if inference_pool is None:
+            print("[INITIALIZING] NightCity Security Protocol v2.077")
+            inference_pool = InferencePool(model_options(),
+                                           workers=app.config['INFERENCE_WORKERS'],
+                                           threads_per_worker=app.config['WORKER_THREADS'],
+                                           slots=app.config['WORKER_RING_SLOTS'],
+                                           max_frame=app.config['WORKER_MAX_FRAME'],
+                                           letterbox=app.config['LETTERBOX'],
+                                           task_timeout=app.config['WORKER_TIMEOUT'],
+                                           slot_timeout=app.config['WORKER_TIMEOUT'])
+            atexit.register(inference_pool.close)
+        return inference_pool
+
+admission = None
+admission_lock = threading.Lock()
+
+def get_admission():
+    """The admission controller, created on first use; None when admission control is off"""
+    global admission
+    if admission is None and app.config['ADMISSION_CONTROL']:
+        with admission_lock:
+            if admission is None:
+                admission = AdmissionController(
+                    slots=app.config['ADMISSION_SLOTS'] or max(1, app.config['INFERENCE_WORKERS']),
+                    max_feeds=app.config['ADMISSION_MAX_FEEDS'],
+                    max_queue=app.config['ADMISSION_MAX_QUEUE'],
+                    retry_after=app.config['ADMISSION_RETRY_AFTER'],
+                    high_water=app.config['ADMISSION_HIGH_WATER'],
+                    degrade_factor=app.config['ADMISSION_DEGRADE_FACTOR'])
+    return admission
+
+def run_inference(images, input_size=None, target_sizes=None, priority=None, timings=None):
+    """Run one forward pass over a batch of frames and decode the boxes of each
+
+    Boxes come back in pixels of target_sizes[i] (width, height), or of the
+    frame itself when no target size is given. With admission control the
+    call first waits for an inference slot, behind any higher priority class.
+    timings, if given, gets the seconds of the pass itself appended, without
+    that wait (what a resolution controller should learn from).
+    """
+    size = input_size or app.config['INPUT_SIZE']
+    if target_sizes is None:
+        target_sizes = [(image.shape[1], image.shape[0]) for image in images]
+    controller = get_admission()
+    if controller is None:
+        return timed_forward_batch(images, size, target_sizes, timings)
+    waiting = time.perf_counter()
+    with controller.slot(priority or OFFLINE):
+        TRACER.record('slot_wait', waiting, priority=priority or OFFLINE)
+        return timed_forward_batch(images, size, target_sizes, timings)
+
+def timed_forward_batch(images, size, target_sizes, timings=None):
+    """forward_batch, with its duration appended to timings"""
+    started = time.perf_counter()
+    results = forward_batch(images, size, target_sizes)
+    if timings is not None:
+        timings.append(time.perf_counter() - started)
+    return results
+
+def forward_batch(images, size, target_sizes):
+    """The forward pass and decoding of run_inference, on the worker pool or in process"""
+    started = time.perf_counter()
+    if app.config['INFERENCE_WORKERS']:
+        pool = get_inference_pool()
+        # Batches bigger than the frame ring (zone crops, coalesced /detect requests) go in parts
+        futures = [pool.submit(images[i:i + pool.slots], size, target_sizes[i:i + pool.slots])
+                   for i in range(0, len(images), pool.slots)]
+        results = [result for future in futures for result in future.result(app.config['WORKER_TIMEOUT'])]
+        # Blob, forward and decoding happen in the worker; this is the round trip
+        TRACER.record('worker_inference', started, batch=len(images), size=size)
+        return results
     
-    # Resize image to fixed display size
-    image = cv2.resize(image, (DISPLAY_WIDTH, DISPLAY_HEIGHT))
+    blob, layouts = blob_builder.build(images, size)
+    preprocessed = time.perf_counter()
+    outs = get_backend().forward(blob)
+    forwarded = time.perf_counter()
+    TRACER.record('blob', started, preprocessed, batch=len(images), size=size)
+    TRACER.record('forward', preprocessed, forwarded, batch=len(images), size=size)
+    results = decode_batch(outs, layouts, size, target_sizes)
+    STAGE_SECONDS.observe(preprocessed - started, 'preprocess')
+    STAGE_SECONDS.observe(forwarded - preprocessed, 'forward')
+    STAGE_SECONDS.observe(time.perf_counter() - forwarded, 'postprocess')
+    BATCH_SIZE.observe(len(images))
+    return results
+
+# =========== WARMUP AND READINESS ===========
+model_ready = threading.Event()
+model_error = None
+warmup_seconds = None
+warmup_thread = None
+warmup_lock = threading.Lock()
+
+def warmup(input_size=None):
+    """Load the model and run one forward pass so the first real frame isn't slow"""
+    global model_error, warmup_seconds
+    size = input_size or app.config['WARMUP_INPUT_SIZE'] or app.config['INPUT_SIZE']
+    started = time.perf_counter()
+    try:
+        run_inference([np.zeros((DISPLAY_HEIGHT, DISPLAY_WIDTH, 3), dtype=np.uint8)], size, priority=LIVE)
+    except Exception as e:
+        model_error = str(e)
+        print(f"[ERROR] Model warmup failed: {e}")
+        return False
+    warmup_seconds = time.perf_counter() - started
+    model_error = None
+    model_ready.set()
+    print(f"[READY] Model warmed up at {size}x{size} in {warmup_seconds:.2f}s")
+    return True
+
+def start_warmup():
+    """Run warmup() on a background thread, once; /ready reports 503 until it's done"""
+    global warmup_thread
+    with warmup_lock:
+        if warmup_thread is None or (not warmup_thread.is_alive() and model_error is not None):
+            warmup_thread = threading.Thread(target=warmup, name='model-warmup', daemon=True)
+            warmup_thread.start()
+        return warmup_thread
+
+def readiness():
+    """(response body, HTTP status) of the readiness check"""
+    if model_ready.is_set():
+        return {'status': 'ready', 'warmup_ms': round(warmup_seconds * 1000, 1)}, 200
+    # Servers that never called start_warmup() (e.g. gunicorn) start it on the first probe
+    if app.config['WARMUP_ON_START']:
+        start_warmup()
+    if model_error is not None:
+        return {'status': 'error', 'message': model_error}, 503
+    return {'status': 'loading'}, 503
+
+def infer_frame(image, controller=None, target_size=None, zones=None, priority=None):
+    """Detections for a single frame, at the controller's input size if there is one
+
+    With zones, only their crops go through the net and boxes outside them are dropped.
+    """
+    level = input_size = controller.input_size if controller is not None else None
+    timings = []
+    if zones is not None:
+        input_size = zone_input_size([image], [zones], input_size)
+        result = infer_in_zones(lambda images, sizes: run_inference(images, input_size, sizes, priority, timings),
+                                [image], [zones], [target_size])[0]
+    else:
+        result = run_inference([image], input_size, [target_size] if target_size is not None else None,
+                               priority, timings)[0]
+    if controller is not None:
+        controller.record(sum(timings), level)
+    return result
+
+def to_display(frame):
+    """The copy of a frame that gets drawn on and encoded"""
+    if not app.config['DISPLAY_RESIZE']:
+        return frame
+    started = time.perf_counter()
+    image = cv2.resize(frame, (DISPLAY_WIDTH, DISPLAY_HEIGHT))
+    TRACER.record('resize', started, display=True)
+    return image
+
+def new_resolution_controller(target_fps=None):
+    """Input size controller configured from app.config, or None when it's off"""
+    if not app.config['ADAPTIVE_RESOLUTION']:
+        return None
+    if target_fps:
+        return ResolutionController(levels=app.config['RESOLUTION_LEVELS'],
+                                    initial=app.config['INPUT_SIZE'],
+                                    target_fps=target_fps)
+    return ResolutionController(levels=app.config['RESOLUTION_LEVELS'],
+                                initial=app.config['INPUT_SIZE'],
+                                target_latency=app.config['LATENCY_BUDGET'])
+
+def new_motion_gate():
+    """Motion gate configured from app.config, or None when gating is off"""
+    if not app.config['MOTION_GATE']:
+        return None
+    return MotionGate(method=app.config['MOTION_METHOD'],
+                      pixel_threshold=app.config['MOTION_PIXEL_THRESHOLD'],
+                      min_changed_ratio=app.config['MOTION_MIN_CHANGED_RATIO'],
+                      max_interval=app.config['MOTION_MAX_INTERVAL'])
+
+def new_tracker():
+    """Keyframe tracker configured from app.config, or None when tracking is off"""
+    if not app.config['KEYFRAME_TRACKING']:
+        return None
+    return KeyframeTracker(interval=app.config['KEYFRAME_INTERVAL'],
+                           adaptive=app.config['KEYFRAME_ADAPTIVE'],
+                           max_interval=app.config['KEYFRAME_MAX_INTERVAL'],
+                           propagation=app.config['TRACKER_PROPAGATION'])
+
+def new_zone_set(zones):
+    """ZoneSet for a list of zones with the configured crop mode, or None for the whole frame"""
+    return ZoneSet.parse(zones, app.config['ROI_CROP_MODE'], app.config['ROI_CROP_MARGIN'])
+
+def zone_input_size(frames, zone_sets, input_size=None):
+    """Input size for a batch of frames with zones; smaller only with ROI_SCALE_INPUT"""
+    size = input_size or app.config['INPUT_SIZE']
+    if not app.config['ROI_SCALE_INPUT']:
+        return size
+    # A shared blob must fit the frame that needs the most detail
+    return max(zones.scaled_input_size(frame.shape[1], frame.shape[0], size) if zones is not None else size
+               for frame, zones in zip(frames, zone_sets))
+
+def source_zones(source_id):
+    """The ZoneSet configured in ROI_ZONES for a source, or None"""
+    return new_zone_set(app.config['ROI_ZONES'].get(source_id))
+
+def make_infer(gate=None, controller=None, zones=None, priority=None):
+    """infer_frame for one stream, behind its motion gate and resolution controller"""
+    if gate is None:
+        return lambda frame, target_size=None: infer_frame(frame, controller, target_size, zones, priority)
+    return lambda frame, target_size=None: gate.detect(
+        frame, lambda f: infer_frame(f, controller, target_size, zones, priority))
+
+def slowdown(priority):
+    """How many times its usual frame interval a class should wait under the current load"""
+    controller = get_admission()
+    return controller.slowdown(priority) if controller is not None else 1.0
+
+def running_feeds(priority):
+    """Camera / video sessions and registered streams of a priority class"""
+    return (sum(1 for session in sessions.list() if session.priority == priority)
+            + sum(1 for stream in stream_registry.list() if stream.priority == priority))
+
+def admit_feed(priority, source_id=None, queued=0):
+    """None when new work of a class may start, else the 503 (response body, HTTP status)
+
+    Joining the running feed of source_id adds no inference, so it always passes.
+    """
+    controller = get_admission()
+    if controller is None or (source_id is not None and live_hubs.get(source_id) is not None):
+        return None
+    try:
+        controller.admit(priority, running_feeds(priority), queued)
+    except Overloaded as e:
+        return {'status': 'error', 'message': str(e), 'retry_after': e.retry_after}, 503
+    return None
+
+def retry_after_headers(body):
+    return {'Retry-After': str(body['retry_after'])} if 'retry_after' in body else {}
+
+def detect_objects(frame, infer=None, tracker=None, source=None, frame_index=None, overlay=None):
+    # Display copy is made separately; the net works from the native frame
+    image = to_display(frame)
+    display_size = (image.shape[1], image.shape[0])
+    infer = infer or infer_frame
+    
+    # Detecting objects (through the stream's gate / tracker when it has them)
+    if tracker is not None:
+        boxes, confidences, class_ids, track_ids, new_tracks = tracker.update(
+            image, lambda _: infer(frame, target_size=display_size))
+        record_detections(source, boxes, confidences, class_ids, frame_index)
+        return render_detections(image, boxes, confidences, new_threats=new_tracks, overlay=overlay)
+    boxes, confidences, class_ids = infer(frame, target_size=display_size)
+    record_detections(source, boxes, confidences, class_ids, frame_index)
+    return render_detections(image, boxes, confidences, overlay=overlay)
+
+def render_detections(image, boxes, confidences, new_threats=None, overlay=None):
+    """Draw the cyberpunk overlay and targeting boxes for one frame's detections
+
+    overlay is the source's Overlay (scan line, threat counter); a single
+    image gets a fresh one. new_threats is how many threats this frame adds
+    to its counter; by default any frame with detections counts as one
+    (tracked streams pass new tracks).
+    """
+    overlay = overlay or Overlay()
+    started = time.perf_counter()
     height, width, channels = image.shape
-    original = image.copy()
 
     # Add cyberpunk overlay - grid lines
     for x in range(0, width, 50):
@@ -69,43 +498,16 @@ def detect_objects(image):
         cv2.line(image, (0, y), (width, y), (20, 20, 20), 1)
     
     # Add scanning effect
-    scan_line_pos = (scan_line_pos + 5) % height
+    scan_line_pos = overlay.advance_scan_line(height)
     cv2.line(image, (0, scan_line_pos), (width, scan_line_pos), (0, 255, 255), 1)
-    
-    # Detecting objects
-    blob = cv2.dnn.blobFromImage(original, 0.00392, (416, 416), (0, 0, 0), True, crop=False)
-    net.setInput(blob)
-    outs = net.forward(output_layer_names)
 
     # Information analysis
-    class_ids = []
-    confidences = []
-    boxes = []
-    for out in outs:
-        for detection in out:
-            scores = detection[5:]
-            class_id = np.argmax(scores)
-            confidence = scores[class_id]
-            if confidence > 0.5:
-                # Object detected
-                center_x = int(detection[0] * width)
-                center_y = int(detection[1] * height)
-                w = int(detection[2] * width)
-                h = int(detection[3] * height)
-
-                # Rectangle coordinates
-                x = int(center_x - w / 2)
-                y = int(center_y - h / 2)
-
-                boxes.append([x, y, w, h])
-                confidences.append(float(confidence))
-                class_ids.append(class_id)
-
-    indexes = cv2.dnn.NMSBoxes(boxes, confidences, 0.5, 0.4)
-    if len(indexes) > 0:
-        threat_count += 1
-        last_detection_time = time.time()
+    if new_threats is None:
+        new_threats = 1 if len(boxes) > 0 else 0
+    if new_threats > 0:
+        ALERTS.inc()
         print("[ALERT] Threat object detected | Confidence level: HIGH")
+    threat_count, since_detection = overlay.record(new_threats, len(boxes) > 0)
         
     # Draw current time
     current_time = datetime.now().strftime("%H:%M:%S")
@@ -117,46 +519,45 @@ def detect_objects(image):
     # Draw targeting boxes
     font = cv2.FONT_HERSHEY_SIMPLEX
     for i in range(len(boxes)):
-        if i in indexes:
-            x, y, w, h = boxes[i]
-            color_index = random.randint(0, len(NEON_COLORS)-1)
-            color = NEON_COLORS[color_index]
-            confidence_text = f"{confidences[i]:.2f}"
-            
-            # Draw main box with glitch effect
-            cv2.rectangle(image, (x, y), (x + w, y + h), color, 2)
-            
-            # Draw corner brackets
-            bracket_length = 20
-            # Top-left
-            cv2.line(image, (x, y), (x + bracket_length, y), color, 2)
-            cv2.line(image, (x, y), (x, y + bracket_length), color, 2)
-            # Top-right
-            cv2.line(image, (x + w, y), (x + w - bracket_length, y), color, 2)
-            cv2.line(image, (x + w, y), (x + w, y + bracket_length), color, 2)
-            # Bottom-left
-            cv2.line(image, (x, y + h), (x + bracket_length, y + h), color, 2)
-            cv2.line(image, (x, y + h), (x, y + h - bracket_length), color, 2)
-            # Bottom-right
-            cv2.line(image, (x + w, y + h), (x + w - bracket_length, y + h), color, 2)
-            cv2.line(image, (x + w, y + h), (x + w, y + h - bracket_length), color, 2)
-            
-            # Add targeting data
-            cv2.putText(image, f"THREAT", (x, y - 10), font, 0.7, color, 2)
-            cv2.putText(image, f"CFD: {confidence_text}", (x, y + h + 25), font, 0.6, color, 2)
-            
-            # Add glitch effect near the detected object
-            if random.random() < 0.2:  # 20% chance of glitch
-                glitch_x = x + random.randint(-20, 20)
-                glitch_y = y + random.randint(-20, 20)
-                glitch_w = random.randint(5, 20)
-                glitch_h = random.randint(5, 10)
-                cv2.rectangle(image, (glitch_x, glitch_y), 
-                             (glitch_x + glitch_w, glitch_y + glitch_h), 
-                             color, -1)
+        x, y, w, h = boxes[i].tolist()
+        color_index = random.randint(0, len(NEON_COLORS)-1)
+        color = NEON_COLORS[color_index]
+        confidence_text = f"{confidences[i]:.2f}"
+        
+        # Draw main box with glitch effect
+        cv2.rectangle(image, (x, y), (x + w, y + h), color, 2)
+        
+        # Draw corner brackets
+        bracket_length = 20
+        # Top-left
+        cv2.line(image, (x, y), (x + bracket_length, y), color, 2)
+        cv2.line(image, (x, y), (x, y + bracket_length), color, 2)
+        # Top-right
+        cv2.line(image, (x + w, y), (x + w - bracket_length, y), color, 2)
+        cv2.line(image, (x + w, y), (x + w, y + bracket_length), color, 2)
+        # Bottom-left
+        cv2.line(image, (x, y + h), (x + bracket_length, y + h), color, 2)
+        cv2.line(image, (x, y + h), (x, y + h - bracket_length), color, 2)
+        # Bottom-right
+        cv2.line(image, (x + w, y + h), (x + w - bracket_length, y + h), color, 2)
+        cv2.line(image, (x + w, y + h), (x + w, y + h - bracket_length), color, 2)
+        
+        # Add targeting data
+        cv2.putText(image, f"THREAT", (x, y - 10), font, 0.7, color, 2)
+        cv2.putText(image, f"CFD: {confidence_text}", (x, y + h + 25), font, 0.6, color, 2)
+        
+        # Add glitch effect near the detected object
+        if random.random() < 0.2:  # 20% chance of glitch
+            glitch_x = x + random.randint(-20, 20)
+            glitch_y = y + random.randint(-20, 20)
+            glitch_w = random.randint(5, 20)
+            glitch_h = random.randint(5, 10)
+            cv2.rectangle(image, (glitch_x, glitch_y), 
+                         (glitch_x + glitch_w, glitch_y + glitch_h), 
+                         color, -1)
     
     # Add threat warning
-    if time.time() - last_detection_time < 3:  # Show warning for 3 seconds after detection
+    if since_detection < 3:  # Show warning for 3 seconds after detection
         warning_text = "! THREAT DETECTED !"
         text_size = cv2.getTextSize(warning_text, font, 1, 2)[0]
         text_x = (width - text_size[0]) // 2
@@ -170,8 +571,137 @@ def detect_objects(image):
             cv2.rectangle(overlay, (0, 0), (width, height), (40, 0, 0), -1)
             cv2.addWeighted(overlay, 0.2, image, 0.8, 0, image)
     
+    STAGE_SECONDS.observe(time.perf_counter() - started, 'render')
+    TRACER.record('draw', started, boxes=len(boxes))
     return image
 
+# =========== EVENT STORE ===========
+event_store = None
+event_store_lock = threading.Lock()
+
+def get_event_store():
+    """The detection event log, opened on first use"""
+    global event_store
+    if event_store is None:
+        with event_store_lock:
+            if event_store is None:
+                event_store = EventStore(app.config['EVENT_DB_PATH'],
+                                         batch_size=app.config['EVENT_BATCH_SIZE'],
+                                         flush_interval=app.config['EVENT_FLUSH_INTERVAL'],
+                                         max_queue=app.config['EVENT_QUEUE_SIZE'])
+                atexit.register(event_store.close)
+    return event_store
+
+def record_detections(source, boxes, confidences, class_ids, frame_index=None, snapshot=None, clip_source=None):
+    """Queue a detection event for source (a no-op for frames without boxes)
+
+    On a live source this also starts (or extends) its alert clip, and the
+    clip's path becomes the event's snapshot. clip_source is the source's hub
+    id when it differs from the event's stream name.
+    """
+    if source is None or len(boxes) == 0:
+        return
+    if snapshot is None:
+        snapshot = trigger_clip(source if clip_source is None else clip_source)
+    if app.config['EVENT_STORE']:
+        get_event_store().record(source, boxes, confidences, class_ids, frame_index, snapshot)
+
+def parse_time(value):
+    """Epoch seconds or an ISO 8601 timestamp from a query string, or None"""
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def query_events(args):
+    """Paginated events for the filters in args; returns (response body, HTTP status)"""
+    try:
+        filters = {
+            'stream': args.get('stream') or None,
+            'start': parse_time(args.get('start')),
+            'end': parse_time(args.get('end')),
+            'min_confidence': float(args['min_confidence']) if args.get('min_confidence') else None,
+        }
+        limit = int(args.get('limit', 100))
+        bucket = int(args.get('bucket', 3600))
+        if args.get('summary'):
+            return get_event_store().aggregate(bucket, **filters), 200
+        return get_event_store().query(limit=limit, cursor=args.get('cursor'), **filters), 200
+    except ValueError as e:
+        return {'status': 'error', 'message': f"Bad query parameter: {e}"}, 400
+
+# =========== RESULT CACHE ===========
+result_cache = None
+if app.config['RESULT_CACHE']:
+    result_cache = ResultCache(max_entries=app.config['RESULT_CACHE_ENTRIES'],
+                               max_bytes=app.config['RESULT_CACHE_BYTES'],
+                               disk_dir=app.config['RESULT_CACHE_DIR'],
+                               max_disk_bytes=app.config['RESULT_CACHE_DISK_BYTES'],
+                               max_age=app.config['RESULT_CACHE_MAX_AGE'])
+
+def result_fingerprint():
+    """Short hash of every setting cached detections depend on"""
+    settings = model_options()
+    del settings['threads']
+    # A model file replaced in place changes the results too
+    settings['model_files'] = [(os.path.getsize(path), os.path.getmtime(path))
+                               for path in (settings['config_path'], settings['weights_path'],
+                                            settings['onnx_model_path'], settings['int8_model_path'])
+                               if os.path.exists(path)]
+    settings.update(input_size=app.config['INPUT_SIZE'],
+                    confidence_threshold=CONFIDENCE_THRESHOLD,
+                    nms_threshold=NMS_THRESHOLD,
+                    letterbox=app.config['LETTERBOX'],
+                    # Boxes are stored in display pixels
+                    display=(DISPLAY_WIDTH, DISPLAY_HEIGHT) if app.config['DISPLAY_RESIZE'] else None)
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+def cache_key(content_hash):
+    """Result cache key of a file's content under the current settings"""
+    return f"{content_hash}-{result_fingerprint()}"
+
+def summarize_detections(frames):
+    """Short summary of packed per-frame detections, returned by upload_file"""
+    confidences = [c for frame in frames for c in frame['confidences']]
+    return {
+        'frames': len(frames),
+        'frames_with_threats': sum(1 for frame in frames if frame['boxes']),
+        'max_confidence': max(confidences) if confidences else 0.0
+    }
+
+def detect_image_cached(image, content_hash=None, display_size=None, priority=None):
+    """Detections for an image in display_size pixels, from the result cache when known"""
+    if result_cache is None:
+        return infer_frame(image, target_size=display_size, priority=priority)
+    
+    key = cache_key(content_hash) if content_hash is not None else None
+    if key is not None:
+        entry = result_cache.get(key)
+        if entry is not None and entry['kind'] == 'image':
+            return unpack_detections(entry['detections'])
+    
+    # Near-duplicate of an image we've already scanned (re-encoded, resized...).
+    # The verdict is borrowed for this answer only, never stored under this file's hash.
+    phash = perceptual_hash(image)
+    if app.config['PHASH_MAX_DISTANCE'] > 0:
+        _, entry = result_cache.find_similar(phash, app.config['PHASH_MAX_DISTANCE'],
+                                             f"-{result_fingerprint()}")
+        if entry is not None and entry['kind'] == 'image':
+            return unpack_detections(entry['detections'])
+    
+    detections = infer_frame(image, target_size=display_size, priority=priority)
+    if key is not None:
+        packed = pack_detections(*detections)
+        result_cache.put(key, {
+            'kind': 'image',
+            'phash': phash,
+            'detections': packed,
+            'summary': summarize_detections([packed])
+        })
+    return detections
+
 # =========== VIDEO STREAMING FUNCTIONS ===========
 def gen_empty_frame():
     """Generate an empty initialization frame"""
@@ -189,65 +719,220 @@ def gen_empty_frame():
                 cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
     
     ret, buffer = cv2.imencode('.jpg', empty_image)
-    frame = buffer.tobytes()
-    return (b'--frame\r\n'
-            b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+    return multipart_chunk(buffer.tobytes())
 
-def gen_camera_frames():
-    """Generate camera frames for streaming"""
-    global cap, detection_active
+def encode_frame(image):
+    """JPEG-encode a processed frame as one multipart chunk"""
+    started = time.perf_counter()
+    ret, buffer = cv2.imencode('.jpg', image)
+    STAGE_SECONDS.observe(time.perf_counter() - started, 'encode')
+    TRACER.record('imencode', started)
+    return multipart_chunk(buffer.tobytes())
+
+def read_frame(capture):
+    """cap.read() with its decode time recorded"""
+    started = time.perf_counter()
+    success, frame = capture.read()
+    if success:
+        STAGE_SECONDS.observe(time.perf_counter() - started, 'capture')
+        TRACER.record('capture', started)
+    return success, frame
+
+def snap_tier(quality=None, width=None):
+    """Snap a requested (quality, width) to the configured tiers"""
+    def nearest(value, tiers):
+        if value is None:
+            return max(tiers)
+        return min(tiers, key=lambda tier: abs(tier - value))
+    return nearest(quality, app.config['STREAM_QUALITIES']), nearest(width, app.config['STREAM_WIDTHS'])
+
+# =========== ALERT CLIPS ===========
+clip_writer = None
+clip_writer_lock = threading.Lock()
+
+def get_clip_writer():
+    """The background clip writer, started on first use"""
+    global clip_writer
+    if clip_writer is None:
+        with clip_writer_lock:
+            if clip_writer is None:
+                clip_writer = ClipWriter(max_pending_bytes=app.config['CLIP_WRITER_BYTES'])
+                atexit.register(clip_writer.close)
+    return clip_writer
+
+def new_clip_buffer(source_id):
+    """Recorder for a newly started hub, or None with clip capture off"""
+    if not app.config['CLIP_CAPTURE']:
+        return None
+    return ClipBuffer(source_id, app.config['CLIP_DIR'], get_clip_writer(),
+                      pre_seconds=app.config['CLIP_PRE_SECONDS'],
+                      post_seconds=app.config['CLIP_POST_SECONDS'],
+                      max_bytes=app.config['CLIP_BUFFER_BYTES'],
+                      max_clip_seconds=app.config['CLIP_MAX_SECONDS'],
+                      max_clip_bytes=app.config['CLIP_MAX_BYTES'])
+
+def trigger_clip(source_id):
+    """Start or extend the alert clip of a running hub; returns the clip path, or None"""
+    hub = live_hubs.get(source_id) or stream_hubs.get(source_id)
+    if hub is None or hub.recorder is None:
+        return None
+    return hub.recorder.trigger()
+
+# The camera, every video file and every registered stream are produced
+# once per source; viewers subscribe to the source's hub. Camera and video
+# feeds each run as their own session (see session.py), so they run side by
+# side. Hubs record at the default viewer tier, so default viewers share
+# that encode.
+sessions = SessionRegistry()
+live_hubs = HubRegistry(idle_timeout=app.config['HUB_IDLE_TIMEOUT'],
+                        recorder_factory=new_clip_buffer, record_tier=snap_tier())
+stream_hubs = HubRegistry(idle_timeout=app.config['HUB_IDLE_TIMEOUT'],
+                          recorder_factory=new_clip_buffer, record_tier=snap_tier())
+
+def viewer_tier():
+    """(quality, width) requested by the viewer, snapped to the configured tiers"""
+    return snap_tier(request.args.get('quality', type=int), request.args.get('width', type=int))
+
+def start_session(source_id, produce, zones=None, priority=None):
+    """Open a session for a source and yield produce(session)'s frames on the hub's thread"""
+    session = sessions.add(DetectionSession(source_id,
+                                            motion_gate=new_motion_gate(),
+                                            tracker=new_tracker(),
+                                            controller=new_resolution_controller(),
+                                            zones=zones,
+                                            priority=priority))
+    try:
+        yield from session.run(produce(session))
+    finally:
+        sessions.discard(session)
+
+def camera_frames(session):
+    """Rendered camera frames for the camera hub"""
+    capture = session.open(cv2.VideoCapture(0))
+    infer = make_infer(session.motion_gate, session.controller, session.zones, session.priority)
     
-    # Initialize camera
-    cap = cv2.VideoCapture(0)
-    detection_active = True
+    if app.config['LIVE_PIPELINE']:
+        yield from pipelined_frames(session, infer)
+        return
     
-    while detection_active:
-        success, frame = cap.read()
+    frame_index = 0
+    while session.active:
+        success, frame = read_frame(capture)
         if not success:
             break
-        else:
-            # Process the frame
-            processed_frame = detect_objects(frame)
-            ret, buffer = cv2.imencode('.jpg', processed_frame)
-            frame = buffer.tobytes()
-            yield (b'--frame\r\n'
-                  b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-    
-    # Clean up
-    if cap is not None:
-        cap.release()
-
-def gen_video_frames(video_path):
-    """Generate video frames for streaming from a file"""
-    global cap, detection_active
+        # Process the frame
+        yield detect_objects(frame, infer, session.tracker, session.source_id, frame_index, session.overlay)
+        frame_index += 1
+
+def camera_hub():
+    return live_hubs.get_or_start('camera', lambda: start_session('camera', camera_frames, source_zones('camera'),
+                                                                  LIVE))
+
+def gen_camera_frames(quality=None, width=None):
+    """Generate camera frames for streaming"""
+    yield from camera_hub().subscribe(quality, width)
+
+def pipelined_frames(session, infer=None):
+    """Run a session's capture through the capture / inference pipeline
+
+    Encoding is left to the hub (per viewer tier), so the pipeline's last
+    stage only hands the rendered frame through.
+    """
+    frame_numbers = itertools.count()
+    
+    def process(frame):
+        return detect_objects(frame, infer, session.tracker, session.source_id, next(frame_numbers),
+                              session.overlay)
     
+    pipeline = session.pipeline = LivePipeline(session.capture, process, lambda image: image,
+                            capture_queue_size=app.config['CAPTURE_QUEUE_SIZE'],
+                            encode_queue_size=app.config['ENCODE_QUEUE_SIZE'],
+                            output_queue_size=app.config['OUTPUT_QUEUE_SIZE'],
+                            source_id=session.source_id).start()
+    try:
+        for frame in pipeline.frames():
+            if not session.active:
+                break
+            yield frame
+    finally:
+        # Joins the capture thread, so the session can release the capture after this
+        pipeline.stop()
+
+def video_frames(session, video_path):
+    """Rendered frames of a video file for its hub, sampled per VIDEO_SAMPLING"""
     # Initialize video file
-    cap = cv2.VideoCapture(video_path)
-    detection_active = True
+    source = session.video_source = session.open(VideoSource(video_path, app.config['VIDEO_SAMPLING']))
+    full_scan = (source.policy.mode == 'all' and source.first == 0 and source.last is None
+                 and session.zones is None)
     
-    while detection_active:
-        success, frame = cap.read()
-        if not success:
-            # End of video
-            detection_active = False
+    # Reuse the per-frame detections of a previous full scan of the same file
+    key = cache_key(file_digest(video_path)) if result_cache is not None and full_scan else None
+    entry = result_cache.get(key) if key is not None else None
+    cached_frames = entry['frames'] if entry is not None and entry['kind'] == 'video' else None
+    scanned_frames = []
+    # Only a scan that ran the net on every frame, at one input size, is stored
+    exact = session.tracker is None and session.controller is None
+    skipped = session.motion_gate.inferences_skipped if session.motion_gate is not None else 0
+    
+    tracker = session.tracker
+    infer = make_infer(session.motion_gate, session.controller, session.zones, session.priority)
+    seen_tracks = set()
+    
+    for frame_index, _, frame in source:
+        if not session.active:
             break
+        # Process the frame
+        image = to_display(frame)
+        display_size = (image.shape[1], image.shape[0])
+        scan_index = len(scanned_frames)
+        if cached_frames is not None and scan_index < len(cached_frames):
+            packed = cached_frames[scan_index]
+            boxes, confidences, class_ids = unpack_detections(packed)
+        elif tracker is not None:
+            boxes, confidences, class_ids, track_ids, _ = tracker.update(
+                image, lambda _: infer(frame, target_size=display_size))
+            packed = pack_detections(boxes, confidences, class_ids)
+            packed['track_ids'] = track_ids.tolist()
         else:
-            # Process the frame
-            processed_frame = detect_objects(frame)
-            ret, buffer = cv2.imencode('.jpg', processed_frame)
-            frame = buffer.tobytes()
-            yield (b'--frame\r\n'
-                  b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-            time.sleep(0.04)  # Control frame rate to roughly 25 fps
-    
-    # Clean up
-    if cap is not None:
-        cap.release()
+            boxes, confidences, class_ids = infer(frame, target_size=display_size)
+            packed = pack_detections(boxes, confidences, class_ids)
+        scanned_frames.append(packed)
+        if cached_frames is None or scan_index >= len(cached_frames):
+            record_detections(video_path, boxes, confidences, class_ids, frame_index,
+                              clip_source=session.source_id)
+    
+        # Tracked scans (live or replayed) count each track once
+        new_threats = None
+        if 'track_ids' in packed:
+            new_threats = len(set(packed['track_ids']) - seen_tracks)
+            seen_tracks.update(packed['track_ids'])
+    
+        yield render_detections(image, boxes, confidences, new_threats, session.overlay)
+        # Control frame rate to roughly 25 fps, less while live feeds need the CPU; a stop wakes it at once
+        if session.wait(0.04 * slowdown(session.priority)):
+            break
+    else:
+        # End of video
+        if session.motion_gate is not None and session.motion_gate.inferences_skipped != skipped:
+            exact = False
+        if key is not None and exact and cached_frames is None and scanned_frames:
+            result_cache.put(key, {
+                'kind': 'video',
+                'frames': scanned_frames,
+                'summary': summarize_detections(scanned_frames)
+            })
+
+def video_hub(video_path):
+    source_id = f"video:{video_path}"
+    return live_hubs.get_or_start(source_id, lambda: start_session(
+        source_id, lambda session: video_frames(session, video_path), source_zones(video_path), OFFLINE))
+
+def gen_video_frames(video_path, quality=None, width=None):
+    """Generate video frames for streaming from a file"""
+    yield from video_hub(video_path).subscribe(quality, width)
 
 def gen_image_frame(image_path):
     """Generate a single processed image frame"""
-    global detection_active
-    
     image = cv2.imread(image_path)
     if image is None:
         # Create an error frame
@@ -256,18 +941,25 @@ def gen_image_frame(image_path):
                     cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
     else:
         # Process the image
-        image = detect_objects(image)
+        display = to_display(image)
+        content_hash = file_digest(image_path) if result_cache is not None else None
+        boxes, confidences, class_ids = detect_image_cached(
+            image, content_hash, (display.shape[1], display.shape[0]), PREVIEW)
+        record_detections(image_path, boxes, confidences, class_ids, 0)
+        image = render_detections(display, boxes, confidences)
     
-    ret, buffer = cv2.imencode('.jpg', image)
-    frame = buffer.tobytes()
-    return (b'--frame\r\n'
-            b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+    return encode_frame(image)
 
 # =========== FLASK ROUTES ===========
+def rejection_response(rejected):
+    """Flask response for an admit_feed() rejection, with its Retry-After header"""
+    body, status = rejected
+    return jsonify(body), status, retry_after_headers(body)
+
 @app.route('/')
 def index():
     """Render the main page"""
-    return render_template('index.html')
+    return render_template_string(HTML_TEMPLATE)
 
 @app.route('/video_feed')
 def video_feed():
@@ -277,10 +969,11 @@ def video_feed():
 
 @app.route('/start_camera')
 def start_camera():
-    """Start camera streaming"""
-    # First ensure any existing stream is stopped
-    stop_detection()
-    return Response(gen_camera_frames(),
+    """Start camera streaming (or join the running camera feed)"""
+    rejected = admit_feed(LIVE, 'camera')
+    if rejected is not None:
+        return rejection_response(rejected)
+    return Response(gen_camera_frames(*viewer_tier()),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/upload_file', methods=['POST'])
@@ -295,22 +988,43 @@ def upload_file():
     
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-        
-        # Determine if it's an image or video based on extension
-        ext = filename.rsplit('.', 1)[1].lower()
-        file_type = 'image' if ext in ['png', 'jpg', 'jpeg'] else 'video'
-        
-        return jsonify({
-            'status': 'success', 
-            'message': 'File uploaded successfully',
-            'file_path': file_path,
-            'file_type': file_type
-        })
+        part_path = get_upload_store().new_part_path()
+        file.save(part_path)
+        file_path = store_upload(filename, part_path)
+        return jsonify(describe_upload(filename, file_path))
     
     return jsonify({'status': 'error', 'message': 'File type not allowed'})
 
+def store_upload(filename, saved_path):
+    """Move a file saved in one request into the upload store; returns its stored path"""
+    digest = file_digest(saved_path)
+    file_path = get_upload_store().store_file(saved_path, filename.rsplit('.', 1)[1].lower(), digest)
+    remember_digest(file_path, digest)
+    return file_path
+
+def describe_upload(filename, file_path):
+    """Upload response for a saved file, with cached results when known"""
+    # Determine if it's an image or video based on extension
+    ext = filename.rsplit('.', 1)[1].lower()
+    file_type = 'image' if ext in ['png', 'jpg', 'jpeg'] else 'video'
+    
+    response = {
+        'status': 'success', 
+        'message': 'File uploaded successfully',
+        'file_path': file_path,
+        'file_type': file_type
+    }
+    
+    # Known content can be answered straight from the result cache
+    if result_cache is not None:
+        content_hash = file_digest(file_path)
+        entry = result_cache.get(cache_key(content_hash))
+        response['content_hash'] = content_hash
+        response['cached'] = entry is not None
+        if entry is not None:
+            response['summary'] = entry['summary']
+    return response
+
 @app.route('/process_image')
 def process_image():
     """Process and stream a single image"""
@@ -319,48 +1033,683 @@ def process_image():
         return Response(gen_empty_frame(),
                         mimetype='multipart/x-mixed-replace; boundary=frame')
     
+    rejected = admit_feed(PREVIEW)
+    if rejected is not None:
+        return rejection_response(rejected)
+    touch_upload(file_path)
     return Response(gen_image_frame(file_path),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/process_video')
 def process_video():
-    """Process and stream a video file"""
-    # First ensure any existing stream is stopped
-    stop_detection()
-    
+    """Process and stream a video file (or join its running feed)"""
     file_path = request.args.get('file_path')
     if not file_path or not os.path.exists(file_path):
         return Response(gen_empty_frame(),
                         mimetype='multipart/x-mixed-replace; boundary=frame')
     
-    return Response(gen_video_frames(file_path),
+    rejected = admit_feed(OFFLINE, f"video:{file_path}")
+    if rejected is not None:
+        return rejection_response(rejected)
+    touch_upload(file_path)
+    return Response(gen_video_frames(file_path, *viewer_tier()),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
-@app.route('/stop_detection')
-def stop_detection():
-    """Stop any active detection and release resources"""
-    global detection_active, cap
-    detection_active = False
-    
-    # Wait a bit to ensure the streaming loop has time to exit
-    time.sleep(0.1)
+# =========== CHUNKED UPLOADS ===========
+upload_store = None
+upload_store_lock = threading.Lock()
+
+def get_upload_store():
+    """The upload folder's store, created on first use"""
+    global upload_store
+    if upload_store is None:
+        with upload_store_lock:
+            if upload_store is None:
+                upload_store = UploadStore(app.config['UPLOAD_FOLDER'],
+                                           max_total_bytes=app.config['UPLOAD_MAX_TOTAL_BYTES'],
+                                           retention_seconds=app.config['UPLOAD_RETENTION'],
+                                           session_timeout=app.config['UPLOAD_SESSION_TIMEOUT'],
+                                           max_file_bytes=app.config['UPLOAD_MAX_FILE_BYTES'],
+                                           in_use=files_in_use)
+    return upload_store
+
+def files_in_use():
+    """Video files with a running feed; retention leaves them alone"""
+    return [hub['source'][len('video:'):] for hub in live_hubs.stats() if hub['source'].startswith('video:')]
+
+def touch_upload(file_path):
+    """Keep a stored upload from expiring while it's being used"""
+    digest = get_upload_store().touch(file_path)
+    if digest is not None:
+        # Stored files are named by their hash; don't re-hash them because the mtime moved
+        remember_digest(file_path, digest)
+
+def upload_status(session):
+    """Response body for an upload session; a finished one is described like /upload_file"""
+    body = dict(session.describe(), status='success', chunk_size=app.config['UPLOAD_CHUNK_SIZE'])
+    if session.complete:
+        remember_digest(session.file_path, session.digest)
+        body.update(describe_upload(session.filename, session.file_path))
+    return body
+
+def start_upload(data):
+    """Open an upload session from request data; returns (response body, HTTP status)"""
+    filename = secure_filename(data.get('filename') or '')
+    if not filename or not allowed_file(filename):
+        return {'status': 'error', 'message': 'File type not allowed'}, 400
+    try:
+        size = int(data['size']) if data.get('size') not in (None, '') else None
+        session = get_upload_store().create(filename, size, data.get('sha256'))
+    except UploadTooLarge as e:
+        return {'status': 'error', 'message': str(e)}, 413
+    except ValueError:
+        return {'status': 'error', 'message': 'Invalid size'}, 400
+    return upload_status(session), 200
+
+def append_upload(upload_id, args, stream):
+    """Write one chunk of an upload; returns (response body, HTTP status)"""
+    session = get_upload_store().get(upload_id)
+    if session is None:
+        return {'status': 'error', 'message': 'Unknown upload'}, 404
+    try:
+        offset = int(args.get('offset'))
+    except (TypeError, ValueError):
+        return dict(session.describe(), status='error', message='offset is required'), 400
+    final = str(args.get('final', '')).lower() in ('1', 'true', 'yes')
+    try:
+        get_upload_store().append(session, offset, stream, final)
+    except UploadTooLarge as e:
+        return dict(session.describe(), status='error', message=str(e)), 413
+    except ValueError as e:
+        # Wrong offset (e.g. a retried chunk): the client resumes from the offset returned
+        return dict(session.describe(), status='error', message=str(e)), 409
+    return upload_status(session), 200
+
+def detection_line(frame_index, packed, **extra):
+    return json.dumps(dict(frame=frame_index, **packed, **extra)) + '\n'
+
+def progressive_detections(session):
+    """Detections of an upload as its bytes arrive, one JSON line per frame
+
+    A video is decoded from the received prefix and re-opened as more
+    arrives, so results start while the upload is still running. That needs
+    a container readable front to back (AVI, fragmented or "faststart" MP4);
+    a plain MP4 keeps its index at the end and only opens once complete.
+    A finished scan goes to the result cache, so /process_video replays it.
+    """
+    source = f"upload:{session.upload_id}"
+    frames = []
     
-    if cap is not None:
-        cap.release()
-        cap = None
+    if session.ext in ('png', 'jpg', 'jpeg'):
+        while not (session.complete or session.closed):
+            session.wait_for(session.received, 1.0)
+        image = cv2.imread(session.file_path) if session.complete else None
+        if image is not None:
+            display = to_display(image)
+            detections = detect_image_cached(image, session.digest, (display.shape[1], display.shape[0]),
+                                             OFFLINE)
+            record_detections(source, *detections, 0)
+            frames.append(pack_detections(*detections))
+            yield detection_line(0, frames[0])
+    else:
+        entry = None
+        if result_cache is not None and session.complete:
+            entry = result_cache.get(cache_key(session.digest))
+        if entry is not None and entry['kind'] == 'video':
+            frames = entry['frames']
+            for frame_index, packed in enumerate(frames):
+                yield detection_line(frame_index, packed)
+        else:
+            # No motion gate: every frame goes through the net, so the scan can be cached as a full one
+            controller = new_resolution_controller()
+            infer = make_infer(None, controller, priority=OFFLINE)
+            capture = None
+            try:
+                while True:
+                    if capture is None:
+                        received, complete = session.received, session.complete
+                        capture = cv2.VideoCapture(session.path)
+                        if not capture.isOpened():
+                            capture.release()
+                            capture = None
+                        elif frames:
+                            capture.set(cv2.CAP_PROP_POS_FRAMES, len(frames))
+                    if capture is not None:
+                        success, frame = read_frame(capture)
+                        if success:
+                            image = to_display(frame)
+                            started = time.perf_counter()
+                            boxes, confidences, class_ids = infer(frame, target_size=(image.shape[1], image.shape[0]))
+                            # Under load, idle so the scan takes 1 / slowdown of the net's time
+                            backoff = (slowdown(OFFLINE) - 1) * (time.perf_counter() - started)
+                            record_detections(source, boxes, confidences, class_ids, len(frames))
+                            frames.append(pack_detections(boxes, confidences, class_ids))
+                            yield detection_line(len(frames) - 1, frames[-1], received=received)
+                            if backoff > 0:
+                                time.sleep(backoff)
+                            continue
+                        # End of what has arrived so far
+                        capture.release()
+                        capture = None
+                    if complete or session.closed:
+                        break
+                    # Try again once enough new bytes are in, or the upload finished
+                    while not (session.complete or session.closed) and \
+                            session.received < received + app.config['UPLOAD_PROGRESS_BYTES']:
+                        session.wait_for(session.received, 1.0)
+            finally:
+                if capture is not None:
+                    capture.release()
+            # With adaptive resolution the frames ran at varying sizes: not a reusable full scan
+            if result_cache is not None and session.complete and frames and controller is None:
+                result_cache.put(cache_key(session.digest), {
+                    'kind': 'video',
+                    'frames': frames,
+                    'summary': summarize_detections(frames)
+                })
     
-    return jsonify({'status': 'success', 'message': 'Detection stopped'})
+    yield json.dumps({
+        'done': True,
+        'complete': session.complete,
+        'file_path': session.file_path,
+        'content_hash': session.digest,
+        'summary': summarize_detections(frames)
+    }) + '\n'
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """Start a chunked upload: {"filename": ..., "size": bytes, "sha256": optional}"""
+    body, status = start_upload(request.get_json(silent=True) or request.form)
+    return jsonify(body), status
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def upload_progress(upload_id):
+    """Where an upload stands; resume it from the returned offset"""
+    session = get_upload_store().get(upload_id)
+    if session is None:
+        return jsonify({'status': 'error', 'message': 'Unknown upload'}), 404
+    return jsonify(upload_status(session))
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """Append the request body at ?offset=; the upload finishes at its size or with &final=1"""
+    body, status = append_upload(upload_id, request.args, request.stream)
+    return jsonify(body), status
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    """Abandon an upload and delete what was received"""
+    session = get_upload_store().get(upload_id)
+    if session is None:
+        return jsonify({'status': 'error', 'message': 'Unknown upload'}), 404
+    get_upload_store().abort(session)
+    return jsonify({'status': 'success', 'message': 'Upload cancelled'})
+
+@app.route('/uploads/<upload_id>/detections')
+def upload_detections(upload_id):
+    """Detections streamed as JSON lines while the upload is still arriving"""
+    session = get_upload_store().get(upload_id)
+    if session is None:
+        return jsonify({'status': 'error', 'message': 'Unknown upload'}), 404
+    rejected = admit_feed(OFFLINE)
+    if rejected is not None:
+        return rejection_response(rejected)
+    return Response(progressive_detections(session), mimetype='application/x-ndjson')
+
+# =========== JSON DETECTION API ===========
+detect_batcher = None
+detect_batcher_lock = threading.Lock()
+
+def get_detect_batcher():
+    """The /detect request coalescer, started on first use"""
+    global detect_batcher
+    if detect_batcher is None:
+        with detect_batcher_lock:
+            if detect_batcher is None:
+                # One batch in flight per worker process; the in-process net runs one at a time
+                detect_batcher = MicroBatcher(lambda images: run_inference(images, priority=PREVIEW),
+                                              max_batch=app.config['DETECT_MAX_BATCH'],
+                                              max_wait=app.config['DETECT_MAX_WAIT'],
+                                              concurrency=max(1, app.config['INFERENCE_WORKERS']))
+                atexit.register(detect_batcher.close)
+    return detect_batcher
+
+def admit_detect():
+    """admit_feed() for a /detect request, counting the batches already waiting in the batcher"""
+    waiting = detect_batcher.stats()['queue_depth'] if detect_batcher is not None else 0
+    return admit_feed(PREVIEW, queued=-(-waiting // app.config['DETECT_MAX_BATCH']))
+
+def queue_detections(uploads):
+    """Decode (name, bytes) pairs and queue each image for coalesced inference
+
+    Returns (name, image, future) per upload; an image that can't be decoded
+    has no future. Raises ValueError when there are no images or too many.
+    """
+    if not uploads:
+        raise ValueError('No image given')
+    if len(uploads) > app.config['DETECT_MAX_IMAGES']:
+        raise ValueError(f"At most {app.config['DETECT_MAX_IMAGES']} images per request")
+    batcher = get_detect_batcher()
+    queued = []
+    for name, data in uploads:
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR) if data else None
+        queued.append((name, image, batcher.submit(image) if image is not None else None))
+    return queued
+
+def detect_response(queued, results):
+    """/detect body and HTTP status from the queued images and their detections"""
+    images = []
+    for (name, image, _), detections in zip(queued, results):
+        if detections is None:
+            images.append({'name': name, 'status': 'error', 'message': 'Cannot decode image'})
+            continue
+        boxes, confidences, class_ids = detections
+        images.append({
+            'name': name,
+            'status': 'success',
+            'width': image.shape[1],
+            'height': image.shape[0],
+            'detections': [{
+                'box': [int(v) for v in box],
+                'confidence': round(float(confidence), 4),
+                'class_id': int(class_id),
+                'class': classes[class_id] if 0 <= class_id < len(classes) else str(class_id)
+            } for box, confidence, class_id in zip(boxes, confidences, class_ids)]
+        })
+    if all(image['status'] == 'error' for image in images):
+        return {'status': 'error', 'message': 'Cannot decode image', 'images': images}, 400
+    return {'status': 'success', 'images': images}, 200
+
+@app.route('/detect', methods=['POST'])
+def detect():
+    """Boxes, confidences and classes of one or more images as JSON; nothing is drawn or encoded
+
+    Send images as multipart files (any field name, repeated for several)
+    or a single image as the raw request body. Boxes are [x, y, w, h] in
+    pixels of each image.
+    """
+    rejected = admit_detect()
+    if rejected is not None:
+        return rejection_response(rejected)
+    uploads = [(file.filename or field, file.read()) for field, file in request.files.items(multi=True)]
+    if not uploads and not request.form:
+        data = request.get_data()
+        uploads = [('image', data)] if data else []
+    try:
+        queued = queue_detections(uploads)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    try:
+        results = [future.result() if future is not None else None for _, _, future in queued]
+    except Exception as e:
+        print(f"[ERROR] Detection failed: {e}")
+        return jsonify({'status': 'error', 'message': 'Detection failed'}), 500
+    body, status = detect_response(queued, results)
+    return jsonify(body), status
+
+@app.route('/stop_detection')
+def stop_detection():
+    """Stop one feed (?source=camera, ?source=video:<path>) or, without a source, all of them"""
+    body, status = stop_feeds(request.args.get('source'))
+    return jsonify(body), status
+
+def stop_feeds(source_id=None):
+    """Stop a feed by source id, or every feed; returns (response body, HTTP status)"""
+    if source_id is None:
+        stop_live_feeds()
+        return {'status': 'success', 'message': 'Detection stopped'}, 200
+    if not stop_source(source_id):
+        return {'status': 'error', 'message': 'Unknown source'}, 404
+    return {'status': 'success', 'message': 'Detection stopped', 'source': source_id}, 200
+
+def stop_source(source_id):
+    """Stop one feed: its session's loop is joined and its capture released, then viewers see it end"""
+    found = sessions.stop(source_id)
+    hub = live_hubs.get(source_id)
+    live_hubs.stop(source_id)
+    return found or hub is not None
+
+def stop_live_feeds():
+    """Stop every camera / video feed and release their captures"""
+    sessions.stop_all()
+    live_hubs.stop_all()
 
 @app.route('/get_stats')
 def get_stats():
-    """Get current threat detection stats"""
-    return jsonify({
-        'threat_count': threat_count,
-        'detection_active': detection_active,
+    """Get current threat detection stats; ?source= adds the stats of that feed"""
+    return jsonify(collect_stats(request.args.get('source')))
+
+@app.route('/events')
+def events():
+    """Detection events, newest first: ?stream=&start=&end=&min_confidence=&limit=&cursor=
+
+    start / end are epoch seconds or ISO 8601. Pass the returned next_cursor
+    as cursor to get the next page.
+    """
+    body, status = query_events(request.args)
+    return jsonify(body), status
+
+@app.route('/events/summary')
+def events_summary():
+    """Event counts per stream and time bucket: ?bucket=<seconds> plus the /events filters"""
+    body, status = query_events(dict(request.args.items(), summary=True))
+    return jsonify(body), status
+
+@app.route('/ready')
+def ready():
+    """Readiness probe: 200 once the model is loaded and warmed up, 503 before"""
+    body, status = readiness()
+    return jsonify(body), status
+
+def collect_stats(source_id=None):
+    running = sessions.list()
+    stats = {
+        'threat_count': (sum(session.overlay.threat_count for session in running)
+                         + sum(stream.overlay.threat_count for stream in stream_registry.list())),
+        'detection_active': any(session.active for session in running),
+        'model_ready': model_ready.is_set(),
         'time': datetime.now().strftime("%H:%M:%S")
-    })
+    }
+    stats['sessions'] = [session.stats() for session in running]
+    session = sessions.get(source_id) if source_id is not None else None
+    if session is not None:
+        stats.update(session.stats())
+    if inference_pool is not None:
+        stats['inference_pool'] = inference_pool.stats()
+    if event_store is not None:
+        stats.update(event_store.stats())
+    if clip_writer is not None:
+        stats['clips_written'] = clip_writer.clips_written
+        stats['clips_dropped'] = clip_writer.clips_dropped
+    if upload_store is not None:
+        stats.update(upload_store.stats())
+    if detect_batcher is not None:
+        stats['detect_batching'] = detect_batcher.stats()
+    if admission is not None:
+        stats['load'] = admission.stats()
+    stats['hubs'] = live_hubs.stats() + stream_hubs.stats()
+    stats['tracing'] = TRACER.stats()
+    return stats
+
+@app.route('/metrics')
+def metrics():
+    """Stage latencies, FPS, drops, queue depths and skips in Prometheus format"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+def collect_metrics():
+    """Scrape-time view of the counters the engine already keeps"""
+    fps = MetricFamily('nexus_stream_fps', 'gauge', 'Frames processed per second')
+    frames = MetricFamily('nexus_frames_total', 'counter', 'Frames handled per source and stage')
+    dropped = MetricFamily('nexus_frames_dropped_total', 'counter', 'Frames dropped per source and queue')
+    depth = MetricFamily('nexus_queue_depth', 'gauge', 'Items waiting per source and queue')
+    skipped = MetricFamily('nexus_inferences_skipped_total', 'counter', 'Frames served without a forward pass')
+    input_size = MetricFamily('nexus_input_size', 'gauge', 'Current network input size')
+    viewers = MetricFamily('nexus_hub_subscribers', 'gauge', 'MJPEG viewers per source')
+    threats = MetricFamily('nexus_threats_total', 'counter', 'Threats identified per source')
+    clip_buffer = MetricFamily('nexus_clip_buffer_bytes', 'gauge', 'Encoded frames held for alert clips per source')
+    clips = MetricFamily('nexus_clips_written_total', 'counter', 'Alert clips written to disk')
+    clips_dropped = MetricFamily('nexus_clips_dropped_total', 'counter', 'Alert clips dropped because the writer fell behind')
+    utilization = MetricFamily('nexus_inference_utilization', 'gauge', 'Share of inference slot time in use')
+    
+    # Camera and video file feeds
+    for session in sessions.list():
+        source = session.source_id
+        threats.add(session.overlay.threat_count, source=source)
+        pipeline = session.pipeline
+        if pipeline is not None and pipeline.running:
+            pipeline_stats = pipeline.stats()
+            for stage in ('captured', 'processed'):
+                frames.add(pipeline_stats[f'frames_{stage}'], source=source, stage=stage)
+            for queue in ('capture', 'encode', 'output'):
+                dropped.add(pipeline_stats[f'dropped_{queue}'], source=source, queue=queue)
+                depth.add(pipeline_stats[f'{queue}_queue_depth'], source=source, queue=queue)
+        if session.motion_gate is not None:
+            skipped.add(session.motion_gate.inferences_skipped, source=source, reason='motion')
+        if session.tracker is not None:
+            skipped.add(session.tracker.tracked_frames, source=source, reason='tracker')
+        if session.controller is not None:
+            input_size.add(session.controller.input_size, source=source)
+    
+    # Registered streams
+    for stream in stream_registry.list():
+        stream_stats = stream.stats()
+        source = stream.stream_id
+        threats.add(stream_stats['threat_count'], source=source)
+        fps.add(stream_stats['fps'], source=source)
+        for stage in ('captured', 'processed', 'inferred'):
+            frames.add(stream_stats[f'frames_{stage}'], source=source, stage=stage)
+        dropped.add(stream_stats['dropped_capture'], source=source, queue='capture')
+        dropped.add(stream_stats['dropped_render'], source=source, queue='render')
+        dropped.add(stream_stats['dropped_output'], source=source, queue='output')
+        depth.add(stream_stats['render_queue_depth'], source=source, queue='render')
+        depth.add(stream_stats['output_queue_depth'], source=source, queue='output')
+        if 'inferences_skipped' in stream_stats:
+            skipped.add(stream_stats['inferences_skipped'], source=source, reason='motion')
+        if 'input_size' in stream_stats:
+            input_size.add(stream_stats['input_size'], source=source)
+    
+    # Viewers: frames a slow viewer never got count as drops
+    for hub_stats in live_hubs.stats() + stream_hubs.stats():
+        viewers.add(hub_stats['subscribers'], source=hub_stats['source'])
+        dropped.add(hub_stats['frames_skipped'], source=hub_stats['source'], queue='viewer')
+        frames.add(hub_stats['frames_encoded'], source=hub_stats['source'], stage='encoded')
+        if 'clip_buffer' in hub_stats:
+            clip_buffer.add(hub_stats['clip_buffer']['buffered_bytes'], source=hub_stats['source'])
+    if clip_writer is not None:
+        clips.add(clip_writer.clips_written)
+        clips_dropped.add(clip_writer.clips_dropped)
+    
+    if inference_pool is not None:
+        pool_stats = inference_pool.stats()
+        depth.add(pool_stats['ring_slots_in_use'], source='inference_pool', queue='ring')
+    if detect_batcher is not None:
+        depth.add(detect_batcher.stats()['queue_depth'], source='detect', queue='batcher')
+    if admission is not None:
+        admission_stats = admission.stats()
+        utilization.add(admission_stats['utilization'])
+        for priority, waiting in admission_stats['waiting'].items():
+            depth.add(waiting, source='admission', queue=priority)
+    
+    events_written = MetricFamily('nexus_events_written_total', 'counter', 'Detection events committed to the store')
+    if event_store is not None:
+        event_stats = event_store.stats()
+        events_written.add(event_stats['events_written'])
+        dropped.add(event_stats['events_dropped'], source='event_store', queue='events')
+        depth.add(event_stats['event_queue_depth'], source='event_store', queue='events')
+    return [fps, frames, dropped, depth, skipped, input_size, viewers, threats, events_written, clip_buffer, clips,
+            clips_dropped, utilization]
+
+# =========== FRAME TRACING ===========
+@app.route('/trace')
+def trace():
+    """Record per-frame spans for ?seconds= and download them as Chrome trace JSON
+
+    Open the file in https://ui.perfetto.dev or chrome://tracing. Only one
+    window records at a time; the request returns when it closes.
+    """
+    try:
+        seconds = parse_trace_seconds(request.args.get('seconds'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    seconds = start_trace(seconds)
+    if seconds is None:
+        return jsonify({'status': 'error', 'message': 'A trace is already being recorded'}), 409
+    TRACER.wait(seconds)
+    return Response(json.dumps(TRACER.stop()), mimetype='application/json',
+                    headers={'Content-Disposition': 'attachment; filename=trace.json'})
+
+def parse_trace_seconds(value):
+    """?seconds= as a window length; None if not given, ValueError unless positive and finite"""
+    if value in (None, ''):
+        return None
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        seconds = float('nan')
+    if not math.isfinite(seconds) or seconds <= 0:
+        raise ValueError('seconds must be a positive number')
+    return seconds
+
+def start_trace(seconds=None):
+    """Open a recording window; returns its length in seconds, or None if one is already open"""
+    seconds = min(seconds or app.config['TRACE_SECONDS'], app.config['TRACE_MAX_SECONDS'])
+    if not TRACER.start(seconds, app.config['TRACE_MAX_EVENTS']):
+        return None
+    return seconds
+
+def write_trace(path, seconds=None, delay=0.0):
+    """Record one window, delay seconds from now, into a trace file (python app.py --trace)"""
+    time.sleep(delay)
+    seconds = start_trace(seconds)
+    if seconds is None:
+        print("[ERROR] A trace is already being recorded")
+        return
+    print(f"[INFO] Recording a {seconds:g}s trace")
+    TRACER.wait(seconds)
+    with open(path, 'w') as f:
+        json.dump(TRACER.stop(), f)
+    print(f"[INFO] Trace written to {path}")
+
+# =========== MULTI-STREAM ENGINE ===========
+def render_stream_result(stream, frame, result, frame_index=None):
+    """Render one batched detection result into its stream's output"""
+    boxes, confidences, class_ids = result
+    if len(boxes) > 0:
+        record_detections(stream.stream_id, boxes, confidences, class_ids, frame_index)
+    image = to_display(frame)
+    stream.output.put(render_detections(image, boxes, confidences, overlay=stream.overlay))
+
+def infer_stream_batch(frames, input_size=None, zones=None, priorities=None, timings=None):
+    """Batched inference for the stream scheduler, with boxes in display pixels
+
+    Streams with zones contribute their crops to the same batch, which waits
+    for its slot at the highest priority class among its streams.
+    """
+    target_sizes = [(DISPLAY_WIDTH, DISPLAY_HEIGHT)] * len(frames) if app.config['DISPLAY_RESIZE'] else None
+    priority = min((p for p in priorities or () if p in PRIORITIES), key=PRIORITIES.index, default=None)
+    if not any(zone_set is not None for zone_set in zones or ()):
+        return run_inference(frames, input_size, target_sizes, priority, timings)
+    input_size = zone_input_size(frames, zones, input_size)
+    return infer_in_zones(lambda images, sizes: run_inference(images, input_size, sizes, priority, timings),
+                          frames, zones, target_sizes)
+
+stream_registry = StreamRegistry(infer_stream_batch, render_stream_result,
+                                 max_batch=app.config['STREAM_MAX_BATCH'],
+                                 pacing=lambda stream: slowdown(stream.priority))
+REGISTRY.add_collector(collect_metrics)
+
+def stream_frames(stream):
+    """Rendered output of a registered stream, for its hub"""
+    while True:
+        frame = stream.output.get(timeout=0.5)
+        if frame is None:
+            if stream.output.closed:
+                break
+            continue
+        yield frame
+
+def stream_hub(stream):
+    # With clip capture on, a stream keeps recording while nobody watches
+    return stream_hubs.get_or_start(stream.stream_id, lambda: stream_frames(stream),
+                                    keep_alive=app.config['CLIP_CAPTURE'])
+
+def gen_stream_frames(stream, quality=None, width=None):
+    """Stream the rendered output of a registered stream"""
+    yield from stream_hub(stream).subscribe(quality, width)
+
+@app.route('/streams', methods=['GET'])
+def list_streams():
+    """List registered streams and scheduler stats"""
+    return jsonify(stream_registry.stats())
+
+@app.route('/streams', methods=['POST'])
+def add_stream():
+    """Register a camera index, video file or RTSP URL as a new stream"""
+    body, status = register_stream(request.get_json(silent=True) or request.form)
+    return jsonify(body), status, retry_after_headers(body)
+
+def register_stream(data):
+    """Add a stream from request data; returns (response body, HTTP status)"""
+    source = data.get('source')
+    if source is None or source == '':
+        return {'status': 'error', 'message': 'No source given'}, 400
+    
+    stream_id = data.get('stream_id') or stream_registry.new_id()
+    try:
+        target_fps = float(data.get('target_fps', app.config['STREAM_DEFAULT_FPS']))
+    except (TypeError, ValueError):
+        target_fps = float('nan')
+    if not math.isfinite(target_fps) or target_fps <= 0:
+        return {'status': 'error', 'message': 'target_fps must be a positive number'}, 400
+    priority = data.get('priority') or (LIVE if is_live_source(source) else OFFLINE)
+    if priority not in PRIORITIES:
+        return {'status': 'error', 'message': f"Unknown priority: {priority}"}, 400
+    try:
+        zones = new_zone_set(data.get('zones', app.config['ROI_ZONES'].get(stream_id)))
+    except ValueError as e:
+        return {'status': 'error', 'message': f"Invalid zones: {e}"}, 400
+    rejected = admit_feed(priority)
+    if rejected is not None:
+        return rejected
+    try:
+        stream = stream_registry.add(stream_id, source, target_fps,
+                                     motion_gate=new_motion_gate(),
+                                     controller=new_resolution_controller(target_fps),
+                                     zones=zones,
+                                     priority=priority)
+    except ValueError as e:
+        return {'status': 'error', 'message': str(e)}, 409
+    if app.config['CLIP_CAPTURE']:
+        stream_hub(stream)
+    
+    return {
+        'status': 'success',
+        'stream_id': stream.stream_id,
+        'feed_url': f"/streams/{stream.stream_id}/feed"
+    }, 200
 
-# HTML template in a string - will be saved to templates folder
+@app.route('/streams/<stream_id>', methods=['DELETE'])
+def remove_stream(stream_id):
+    """Stop a stream and release its source"""
+    if not unregister_stream(stream_id):
+        return jsonify({'status': 'error', 'message': 'Unknown stream'}), 404
+    return jsonify({'status': 'success', 'message': 'Stream stopped'})
+
+@app.route('/streams/<stream_id>/zones', methods=['PUT'])
+def update_stream_zones(stream_id):
+    """Replace a stream's ROI zones: {"zones": [...]}; an empty list watches the whole frame"""
+    body, status = set_stream_zones(stream_id, request.get_json(silent=True) or {})
+    return jsonify(body), status
+
+def set_stream_zones(stream_id, data):
+    """Swap the zones of a running stream; returns (response body, HTTP status)"""
+    stream = stream_registry.get(stream_id)
+    if stream is None:
+        return {'status': 'error', 'message': 'Unknown stream'}, 404
+    try:
+        stream.zones = new_zone_set(data.get('zones'))
+    except ValueError as e:
+        return {'status': 'error', 'message': f"Invalid zones: {e}"}, 400
+    return {'status': 'success', 'stream_id': stream_id,
+            'zones': stream.zones.describe() if stream.zones is not None else None}, 200
+
+def unregister_stream(stream_id):
+    if not stream_registry.remove(stream_id):
+        return False
+    stream_hubs.stop(stream_id)
+    return True
+
+@app.route('/streams/<stream_id>/feed')
+def stream_feed(stream_id):
+    """MJPEG feed of a registered stream"""
+    stream = stream_registry.get(stream_id)
+    if stream is None:
+        return Response(gen_empty_frame(),
+                        mimetype='multipart/x-mixed-replace; boundary=frame')
+    return Response(gen_stream_frames(stream, *viewer_tier()),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+# HTML template in a string - served by index()
 HTML_TEMPLATE = """
 <!DOCTYPE html>
 <html lang="en">
@@ -616,26 +1965,39 @@ HTML_TEMPLATE = """
             document.getElementById('status-bar').textContent = status;
         }
         
-        // Function to upload a file
+        // Function to upload a file in chunks (resumes from the server's offset)
         async function uploadFile(file, type) {
-            const formData = new FormData();
-            formData.append('file', file);
-            
             showLoading(`UPLOADING ${type.toUpperCase()}...`);
             
             try {
-                const response = await fetch('/upload_file', {
+                const response = await fetch('/uploads', {
                     method: 'POST',
-                    body: formData
+                    headers: {'Content-Type': 'application/json'},
+                    body: JSON.stringify({filename: file.name, size: file.size})
                 });
                 
-                const data = await response.json();
-                
-                if (data.status === 'success') {
-                    return data;
-                } else {
+                let data = await response.json();
+                if (data.status !== 'success') {
                     throw new Error(data.message);
                 }
+                
+                while (!data.complete) {
+                    const end = Math.min(data.offset + data.chunk_size, file.size);
+                    const chunkResponse = await fetch(`/uploads/${data.upload_id}?offset=${data.offset}`, {
+                        method: 'PUT',
+                        body: file.slice(data.offset, end)
+                    });
+                    const chunkData = await chunkResponse.json();
+                    // 409: the server has a different offset; carry on from there
+                    if (chunkData.status !== 'success' &&
+                        (chunkResponse.status !== 409 || chunkData.offset === data.offset)) {
+                        throw new Error(chunkData.message);
+                    }
+                    data = Object.assign(data, chunkData);
+                    showLoading(`UPLOADING ${type.toUpperCase()}... ${Math.floor(100 * data.offset / Math.max(file.size, 1))}%`);
+                }
+                
+                return data;
             } catch (error) {
                 updateStatus(`[ERROR] ${error.message}`);
                 hideLoading();
@@ -727,25 +2089,19 @@ HTML_TEMPLATE = """
                 
                 updateStatus("[STOPPING] Ending detection...");
                 
-                try {
-                    await fetch('/stop_detection');
-                    const videoFeed = document.getElementById('video-feed');
-                    videoFeed.src = "{{ url_for('video_feed') }}";
-                    currentMode = 'standby';
-                    updateStatus("[STANDBY] System idle");
-                } catch (error) {
-                    updateStatus("[ERROR] Failed to stop detection");
-                }
+                // Leaving the feed is enough: a source nobody watches stops by itself,
+                // and other viewers of the same source keep theirs
+                const videoFeed = document.getElementById('video-feed');
+                videoFeed.src = "{{ url_for('video_feed') }}";
+                currentMode = 'standby';
+                updateStatus("[STANDBY] System idle");
             });
             
             // Terminate button handler
             document.getElementById('terminate-button').addEventListener('click', async function() {
                 if (currentMode !== 'standby') {
-                    try {
-                        await fetch('/stop_detection');
-                    } catch (error) {
-                        console.error("Failed to stop detection:", error);
-                    }
+                    document.getElementById('video-feed').src = "{{ url_for('video_feed') }}";
+                    currentMode = 'standby';
                 }
                 
                 updateStatus("[SHUTDOWN] Terminating system...");
@@ -776,13 +2132,21 @@ HTML_TEMPLATE = """
 </html>
 """
 
-# Ensure the templates directory exists
-os.makedirs('templates', exist_ok=True)
-
-# Write the HTML template to a file
-with open('templates/index.html', 'w') as f:
-    f.write(HTML_TEMPLATE)
-
 if __name__ == '__main__':
-    # Run the Flask app
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='NEXUS-77 threat detection server')
+    parser.add_argument('--trace', metavar='PATH', help='record a window of per-frame spans to PATH (Chrome trace JSON)')
+    parser.add_argument('--trace-seconds', type=float, default=None, help='length of the trace window')
+    parser.add_argument('--trace-delay', type=float, default=0.0, help='seconds to wait before recording')
+    args = parser.parse_args()
+    if args.trace_seconds is not None and not (math.isfinite(args.trace_seconds) and args.trace_seconds > 0):
+        parser.error('--trace-seconds must be a positive number')
+    
+    if app.config['WARMUP_ON_START']:
+        start_warmup()
+    if args.trace:
+        threading.Thread(target=write_trace, args=(args.trace, args.trace_seconds, args.trace_delay),
+                         name='trace-writer', daemon=True).start()
+    # Run the Flask app (the reloader would run the trace in a second process)
+    app.run(debug=True, host='0.0.0.0', port=5000, use_reloader=not args.trace)
\ No newline at end of file
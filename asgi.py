@@ -0,0 +1,358 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import jinja2
+from starlette.applications import Starlette
+from starlette.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.utils import secure_filename
+
+import app as engine
+from metrics import CONTENT_TYPE, REGISTRY
+
+# =========== ASYNC SERVING MODE ===========
+# Same routes as the Flask app, served by an asyncio server (uvicorn,
+# hypercorn). A viewer is a coroutine subscribed to its source's hub rather
+# than a thread blocked in a generator, so hundreds of feeds and stats polls
+# cost hundreds of sockets, not hundreds of threads. Anything that blocks
+# (inference, capture setup, file I/O, hashing) runs on the executors below.
+#
+#   uvicorn asgi:asgi_app --host 0.0.0.0 --port 5000
+
+MJPEG = 'multipart/x-mixed-replace; boundary=frame'
+
+config = engine.app.config
+config.setdefault('ASGI_INFERENCE_THREADS', 2)  # image inference and stop/start of sources
+config.setdefault('ASGI_ENCODE_THREADS', 4)  # per-tier JPEG encoding for hub viewers
+
+inference_executor = ThreadPoolExecutor(config['ASGI_INFERENCE_THREADS'], thread_name_prefix='asgi-infer')
+encode_executor = ThreadPoolExecutor(config['ASGI_ENCODE_THREADS'], thread_name_prefix='asgi-encode')
+
+# The page is Flask's template; url_for resolves through Starlette's routes instead
+page_template = jinja2.Environment(autoescape=True).from_string(engine.HTML_TEMPLATE)
+
+
+async def run_blocking(func, *args, executor=None):
+    return await asyncio.get_running_loop().run_in_executor(executor or inference_executor, func, *args)
+
+
+def viewer_tier(request):
+    def arg(name):
+        value = request.query_params.get(name)
+        return int(value) if value and value.isdigit() else None
+    return engine.snap_tier(arg('quality'), arg('width'))
+
+
+def mjpeg(chunks):
+    return StreamingResponse(chunks, media_type=MJPEG)
+
+
+async def single_chunk(func, *args):
+    yield await run_blocking(func, *args)
+
+
+def rejection_response(rejected):
+    """JSON 503 for an engine.admit_feed() rejection, with its Retry-After header"""
+    body, status = rejected
+    return JSONResponse(body, status_code=status, headers=engine.retry_after_headers(body))
+
+
+async def index(request):
+    """Render the main page"""
+    return HTMLResponse(page_template.render(url_for=lambda name, **params: request.url_for(name, **params).path))
+
+
+async def video_feed(request):
+    """Video streaming route for the main feed"""
+    return mjpeg(single_chunk(engine.gen_empty_frame))
+
+
+async def start_camera(request):
+    """Start camera streaming (or join the running camera feed)"""
+    # Admission only reads counters, so it runs on the loop
+    rejected = engine.admit_feed(engine.LIVE, 'camera')
+    if rejected is not None:
+        return rejection_response(rejected)
+    hub = engine.camera_hub()
+    return mjpeg(hub.subscribe_async(*viewer_tier(request), executor=encode_executor))
+
+
+async def process_video(request):
+    """Process and stream a video file (or join its running feed)"""
+    file_path = request.query_params.get('file_path')
+    if not file_path or not os.path.exists(file_path):
+        return mjpeg(single_chunk(engine.gen_empty_frame))
+
+    rejected = engine.admit_feed(engine.OFFLINE, f"video:{file_path}")
+    if rejected is not None:
+        return rejection_response(rejected)
+    engine.touch_upload(file_path)
+    hub = engine.video_hub(file_path)
+    return mjpeg(hub.subscribe_async(*viewer_tier(request), executor=encode_executor))
+
+
+async def process_image(request):
+    """Process and stream a single image"""
+    file_path = request.query_params.get('file_path')
+    if not file_path or not os.path.exists(file_path):
+        return mjpeg(single_chunk(engine.gen_empty_frame))
+    rejected = engine.admit_feed(engine.PREVIEW)
+    if rejected is not None:
+        return rejection_response(rejected)
+    engine.touch_upload(file_path)
+    return mjpeg(single_chunk(engine.gen_image_frame, file_path))
+
+
+def save_upload(upload, file_path):
+    with open(file_path, 'wb') as f:
+        while True:
+            chunk = upload.file.read(1024 * 1024)
+            if not chunk:
+                break
+            f.write(chunk)
+
+
+async def upload_file(request):
+    """Handle file uploads (images or videos)"""
+    length = request.headers.get('content-length')
+    if length and length.isdigit() and int(length) > config['MAX_CONTENT_LENGTH']:
+        return JSONResponse({'status': 'error', 'message': 'File too large'}, status_code=413)
+
+    form = await request.form()
+    file = form.get('file')
+    if file is None or isinstance(file, str):
+        return JSONResponse({'status': 'error', 'message': 'No file part'})
+    if file.filename == '':
+        return JSONResponse({'status': 'error', 'message': 'No selected file'})
+    if not engine.allowed_file(file.filename):
+        return JSONResponse({'status': 'error', 'message': 'File type not allowed'})
+
+    filename = secure_filename(file.filename)
+    part_path = engine.get_upload_store().new_part_path()
+    await run_blocking(save_upload, file, part_path)
+    file_path = await run_blocking(engine.store_upload, filename, part_path)
+    return JSONResponse(await run_blocking(engine.describe_upload, filename, file_path))
+
+
+async def create_upload(request):
+    """Start a chunked upload: {"filename": ..., "size": bytes, "sha256": optional}"""
+    if request.headers.get('content-type', '').startswith('application/json'):
+        data = await request.json()
+    else:
+        data = await request.form()
+    body, status = await run_blocking(engine.start_upload, data)
+    return JSONResponse(body, status_code=status)
+
+
+async def upload_progress(request):
+    """Where an upload stands; resume it from the returned offset"""
+    session = engine.get_upload_store().get(request.path_params['upload_id'])
+    if session is None:
+        return JSONResponse({'status': 'error', 'message': 'Unknown upload'}, status_code=404)
+    return JSONResponse(await run_blocking(engine.upload_status, session))
+
+
+async def upload_chunk(request):
+    """Append the request body at ?offset=; the upload finishes at its size or with &final=1"""
+    length = request.headers.get('content-length')
+    if length and length.isdigit() and int(length) > config['MAX_CONTENT_LENGTH']:
+        return JSONResponse({'status': 'error', 'message': 'Chunk too large'}, status_code=413)
+    # A chunk is at most MAX_CONTENT_LENGTH, so it is read whole and written off the loop
+    chunk = await request.body()
+    body, status = await run_blocking(engine.append_upload, request.path_params['upload_id'],
+                                      dict(request.query_params), io.BytesIO(chunk))
+    return JSONResponse(body, status_code=status)
+
+
+async def cancel_upload(request):
+    """Abandon an upload and delete what was received"""
+    session = engine.get_upload_store().get(request.path_params['upload_id'])
+    if session is None:
+        return JSONResponse({'status': 'error', 'message': 'Unknown upload'}, status_code=404)
+    await run_blocking(engine.get_upload_store().abort, session)
+    return JSONResponse({'status': 'success', 'message': 'Upload cancelled'})
+
+
+async def upload_detections(request):
+    """Detections streamed as JSON lines while the upload is still arriving"""
+    session = engine.get_upload_store().get(request.path_params['upload_id'])
+    if session is None:
+        return JSONResponse({'status': 'error', 'message': 'Unknown upload'}, status_code=404)
+    rejected = engine.admit_feed(engine.OFFLINE)
+    if rejected is not None:
+        return rejection_response(rejected)
+    # Starlette iterates the blocking generator on its thread pool
+    return StreamingResponse(engine.progressive_detections(session), media_type='application/x-ndjson')
+
+
+async def detect(request):
+    """Boxes, confidences and classes of one or more images as JSON; nothing is drawn or encoded"""
+    length = request.headers.get('content-length')
+    if length and length.isdigit() and int(length) > config['MAX_CONTENT_LENGTH']:
+        return JSONResponse({'status': 'error', 'message': 'Request too large'}, status_code=413)
+    rejected = engine.admit_detect()
+    if rejected is not None:
+        return rejection_response(rejected)
+
+    content_type = request.headers.get('content-type', '')
+    if content_type.startswith(('multipart/form-data', 'application/x-www-form-urlencoded')):
+        form = await request.form()
+        uploads = [(value.filename or field, await value.read())
+                   for field, value in form.multi_items() if not isinstance(value, str)]
+    else:
+        data = await request.body()
+        uploads = [('image', data)] if data else []
+    try:
+        queued = await run_blocking(engine.queue_detections, uploads)
+    except ValueError as e:
+        return JSONResponse({'status': 'error', 'message': str(e)}, status_code=400)
+    # The batcher's threads run the forward pass; the loop only waits on the futures
+    try:
+        results = await asyncio.gather(*(asyncio.wrap_future(future) if future is not None
+                                         else asyncio.sleep(0, None) for _, _, future in queued))
+    except Exception as e:
+        print(f"[ERROR] Detection failed: {e}")
+        return JSONResponse({'status': 'error', 'message': 'Detection failed'}, status_code=500)
+    body, status = engine.detect_response(queued, results)
+    return JSONResponse(body, status_code=status)
+
+
+async def stop_detection(request):
+    """Stop one feed (?source=camera, ?source=video:<path>) or, without a source, all of them"""
+    # Joins the feed's producing thread, which can take a frame's time
+    body, status = await run_blocking(engine.stop_feeds, request.query_params.get('source'))
+    return JSONResponse(body, status_code=status)
+
+
+async def get_stats(request):
+    """Get current threat detection stats; ?source= adds the stats of that feed"""
+    # Only reads counters, so it is cheap enough to answer on the loop
+    return JSONResponse(engine.collect_stats(request.query_params.get('source')))
+
+
+async def ready(request):
+    """Readiness probe: 200 once the model is loaded and warmed up, 503 before"""
+    body, status = engine.readiness()
+    return JSONResponse(body, status_code=status)
+
+
+async def metrics(request):
+    """Stage latencies, FPS, drops, queue depths and skips in Prometheus format"""
+    return Response(REGISTRY.render(), headers={'Content-Type': CONTENT_TYPE})
+
+
+async def trace(request):
+    """Record per-frame spans for ?seconds= and download them as Chrome trace JSON"""
+    try:
+        seconds = engine.parse_trace_seconds(request.query_params.get('seconds'))
+    except ValueError as e:
+        return JSONResponse({'status': 'error', 'message': str(e)}, status_code=400)
+    seconds = engine.start_trace(seconds)
+    if seconds is None:
+        return JSONResponse({'status': 'error', 'message': 'A trace is already being recorded'}, status_code=409)
+    # The window closes by itself; waiting here keeps the executors free
+    await asyncio.sleep(seconds)
+    body = await run_blocking(lambda: json.dumps(engine.TRACER.stop()))
+    return Response(body, media_type='application/json',
+                    headers={'Content-Disposition': 'attachment; filename=trace.json'})
+
+
+async def events(request):
+    """Detection events, newest first (same parameters as the Flask route)"""
+    body, status = await run_blocking(engine.query_events, dict(request.query_params))
+    return JSONResponse(body, status_code=status)
+
+
+async def events_summary(request):
+    """Event counts per stream and time bucket"""
+    body, status = await run_blocking(engine.query_events, dict(request.query_params, summary=True))
+    return JSONResponse(body, status_code=status)
+
+
+async def list_streams(request):
+    """List registered streams and scheduler stats"""
+    return JSONResponse(engine.stream_registry.stats())
+
+
+async def add_stream(request):
+    """Register a camera index, video file or RTSP URL as a new stream"""
+    if request.headers.get('content-type', '').startswith('application/json'):
+        data = await request.json()
+    else:
+        data = await request.form()
+    # Opening the source (camera, RTSP) can block for seconds
+    body, status = await run_blocking(engine.register_stream, data)
+    return JSONResponse(body, status_code=status, headers=engine.retry_after_headers(body))
+
+
+async def remove_stream(request):
+    """Stop a stream and release its source"""
+    if not await run_blocking(engine.unregister_stream, request.path_params['stream_id']):
+        return JSONResponse({'status': 'error', 'message': 'Unknown stream'}, status_code=404)
+    return JSONResponse({'status': 'success', 'message': 'Stream stopped'})
+
+
+async def update_stream_zones(request):
+    """Replace a stream's ROI zones: {"zones": [...]}; an empty list watches the whole frame"""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    body, status = engine.set_stream_zones(request.path_params['stream_id'], data or {})
+    return JSONResponse(body, status_code=status)
+
+
+async def stream_feed(request):
+    """MJPEG feed of a registered stream"""
+    stream = engine.stream_registry.get(request.path_params['stream_id'])
+    if stream is None:
+        return mjpeg(single_chunk(engine.gen_empty_frame))
+    hub = engine.stream_hub(stream)
+    return mjpeg(hub.subscribe_async(*viewer_tier(request), executor=encode_executor))
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    if config['WARMUP_ON_START']:
+        engine.start_warmup()
+    yield
+    engine.stop_live_feeds()
+    engine.stream_registry.shutdown()
+    inference_executor.shutdown(wait=False)
+    encode_executor.shutdown(wait=False)
+
+
+asgi_app = Starlette(routes=[
+    Route('/', index),
+    Route('/video_feed', video_feed),
+    Route('/start_camera', start_camera),
+    Route('/upload_file', upload_file, methods=['POST']),
+    Route('/uploads', create_upload, methods=['POST']),
+    Route('/uploads/{upload_id}', upload_progress),
+    Route('/uploads/{upload_id}', upload_chunk, methods=['PUT']),
+    Route('/uploads/{upload_id}', cancel_upload, methods=['DELETE']),
+    Route('/uploads/{upload_id}/detections', upload_detections),
+    Route('/detect', detect, methods=['POST']),
+    Route('/process_image', process_image),
+    Route('/process_video', process_video),
+    Route('/stop_detection', stop_detection),
+    Route('/get_stats', get_stats),
+    Route('/metrics', metrics),
+    Route('/trace', trace),
+    Route('/ready', ready),
+    Route('/events', events),
+    Route('/events/summary', events_summary),
+    Route('/streams', list_streams),
+    Route('/streams', add_stream, methods=['POST']),
+    Route('/streams/{stream_id}', remove_stream, methods=['DELETE']),
+    Route('/streams/{stream_id}/zones', update_stream_zones, methods=['PUT']),
+    Route('/streams/{stream_id}/feed', stream_feed),
+], lifespan=lifespan)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(asgi_app, host='0.0.0.0', port=5000)
@@ -0,0 +1,222 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+
+# =========== INFERENCE BACKENDS ===========
+# Every backend takes an NCHW float32 blob (as built by preprocess.BlobBuilder)
+# and returns the YOLO output layers in the layout cv2.dnn produces for the
+# darknet model: one (rows, 5 + classes) array per output scale, or
+# (N, rows, 5 + classes) for a batch. Anything downstream (decoding, NMS,
+# tracking, rendering) is backend-agnostic.
+#
+# ONNX models are expected to be exports of the same darknet network that
+# end in the YOLO region decode, i.e. they output the same rows as OpenCV.
+
+DNN_BACKENDS = {
+    'default': cv2.dnn.DNN_BACKEND_DEFAULT,
+    'opencv': cv2.dnn.DNN_BACKEND_OPENCV,
+    'openvino': cv2.dnn.DNN_BACKEND_INFERENCE_ENGINE,
+    'cuda': cv2.dnn.DNN_BACKEND_CUDA,
+}
+
+DNN_TARGETS = {
+    'cpu': cv2.dnn.DNN_TARGET_CPU,
+    'opencl': cv2.dnn.DNN_TARGET_OPENCL,
+    'opencl_fp16': cv2.dnn.DNN_TARGET_OPENCL_FP16,
+    'cuda': cv2.dnn.DNN_TARGET_CUDA,
+    'cuda_fp16': cv2.dnn.DNN_TARGET_CUDA_FP16,
+}
+# FP16 on CPU only exists in newer OpenCV builds
+if hasattr(cv2.dnn, 'DNN_TARGET_CPU_FP16'):
+    DNN_TARGETS['cpu_fp16'] = cv2.dnn.DNN_TARGET_CPU_FP16
+
+
+class InferenceBackend:
+    """Base class: forward(blob) -> tuple of YOLO output arrays"""
+
+    name = 'base'
+
+    def forward(self, blob):
+        raise NotImplementedError
+
+    def describe(self):
+        return {'backend': self.name}
+
+
+class OpenCVBackend(InferenceBackend):
+    """cv2.dnn darknet model with a selectable DNN backend / target and thread count"""
+
+    name = 'opencv'
+
+    def __init__(self, config_path, weights_path, dnn_backend='default', dnn_target='cpu', threads=0):
+        if dnn_backend not in DNN_BACKENDS:
+            raise ValueError(f"Unknown DNN backend '{dnn_backend}'")
+        if dnn_target not in DNN_TARGETS:
+            raise ValueError(f"Unknown DNN target '{dnn_target}'")
+        if threads:
+            cv2.setNumThreads(int(threads))
+        self.net = cv2.dnn.readNetFromDarknet(config_path, weights_path)
+        self.net.setPreferableBackend(DNN_BACKENDS[dnn_backend])
+        self.net.setPreferableTarget(DNN_TARGETS[dnn_target])
+        self.output_layer_names = self.net.getUnconnectedOutLayersNames()
+        self.dnn_backend = dnn_backend
+        self.dnn_target = dnn_target
+        self.threads = threads
+        # A cv2.dnn Net is not safe to run from several threads at once
+        self.lock = threading.Lock()
+
+    def forward(self, blob):
+        with self.lock:
+            self.net.setInput(blob)
+            return self.net.forward(self.output_layer_names)
+
+    def describe(self):
+        return {'backend': self.name, 'dnn_backend': self.dnn_backend,
+                'dnn_target': self.dnn_target, 'threads': self.threads}
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """ONNX Runtime CPU session over an exported model"""
+
+    name = 'onnxruntime'
+
+    def __init__(self, model_path, threads=0):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise RuntimeError("The onnxruntime backend needs 'pip install onnxruntime'")
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"ONNX model not found: {model_path}")
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = int(threads)
+        self.session = onnxruntime.InferenceSession(model_path, options,
+                                                    providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.model_path = model_path
+        self.threads = threads
+
+    def forward(self, blob):
+        # InferenceSession.run is thread-safe, so no lock here
+        outs = self.session.run(None, {self.input_name: blob})
+        if len(blob) == 1:
+            outs = [out.reshape(-1, out.shape[-1]) for out in outs]
+        return tuple(outs)
+
+    def describe(self):
+        return {'backend': self.name, 'model': self.model_path, 'threads': self.threads}
+
+
+class QuantizedOnnxBackend(OnnxRuntimeBackend):
+    """INT8 ONNX Runtime path; quantizes the FP32 export on first use if needed
+
+    With calibration_images, static (QDQ) quantization is calibrated on those
+    frames; otherwise weights are quantized dynamically.
+    """
+
+    name = 'onnx_int8'
+
+    def __init__(self, model_path, int8_model_path, threads=0, calibration_images=None, input_size=416):
+        if not os.path.exists(int8_model_path):
+            quantize_model(model_path, int8_model_path, calibration_images, input_size)
+        super().__init__(int8_model_path, threads)
+
+
+def quantize_model(model_path, int8_model_path, calibration_images=None, input_size=416):
+    """Write an INT8 copy of an FP32 ONNX model"""
+    try:
+        from onnxruntime import quantization
+    except ImportError:
+        raise RuntimeError("INT8 quantization needs 'pip install onnxruntime'")
+    if not calibration_images:
+        quantization.quantize_dynamic(model_path, int8_model_path,
+                                      weight_type=quantization.QuantType.QInt8)
+        return int8_model_path
+
+    from preprocess import BlobBuilder
+
+    class FrameReader(quantization.CalibrationDataReader):
+        def __init__(self):
+            import onnxruntime
+            session = onnxruntime.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+            self.input_name = session.get_inputs()[0].name
+            self.paths = iter(calibration_images)
+            self.builder = BlobBuilder()
+
+        def get_next(self):
+            for path in self.paths:
+                image = cv2.imread(path)
+                if image is not None:
+                    blob, _ = self.builder.build([image], input_size)
+                    return {self.input_name: blob.copy()}
+            return None
+
+    quantization.quantize_static(model_path, int8_model_path, FrameReader(),
+                                 quant_format=quantization.QuantFormat.QDQ,
+                                 weight_type=quantization.QuantType.QInt8,
+                                 activation_type=quantization.QuantType.QUInt8)
+    return int8_model_path
+
+
+class StubBackend(InferenceBackend):
+    """Returns canned YOLO outputs without loading any model
+
+    Lets the web layer, pipelines and benchmarks run without the weights.
+    detections is a list of (cx, cy, w, h, confidence) in frame-relative
+    units; each one is placed in the row a real network would use for it.
+    """
+
+    name = 'stub'
+
+    def __init__(self, detections=((0.5, 0.5, 0.3, 0.4, 0.9),), num_classes=1, strides=(32, 16, 8)):
+        self.detections = [tuple(d) for d in detections]
+        self.num_classes = num_classes
+        self.strides = strides
+        self.cache = {}
+
+    def _outputs(self, size):
+        outs = self.cache.get(size)
+        if outs is None:
+            outs = []
+            for stride in self.strides:
+                grid = size // stride
+                out = np.zeros((grid * grid * 3, 5 + self.num_classes), dtype=np.float32)
+                for cx, cy, w, h, confidence in self.detections:
+                    row = (min(int(cy * grid), grid - 1) * grid + min(int(cx * grid), grid - 1)) * 3
+                    out[row, :5] = (cx, cy, w, h, confidence)
+                    out[row, 5] = confidence
+                outs.append(out)
+            outs = self.cache[size] = tuple(outs)
+        return outs
+
+    def forward(self, blob):
+        outs = self._outputs(blob.shape[-1])
+        if len(blob) == 1:
+            return tuple(out.copy() for out in outs)
+        return tuple(np.repeat(out[None], len(blob), axis=0) for out in outs)
+
+    def describe(self):
+        return {'backend': self.name, 'detections': len(self.detections)}
+
+
+BACKENDS = ('opencv', 'onnxruntime', 'onnx_int8', 'stub')
+
+
+def create_backend(name, config_path=None, weights_path=None, onnx_model_path=None,
+                   int8_model_path=None, dnn_backend='default', dnn_target='cpu',
+                   threads=0, calibration_images=None):
+    """Build the inference backend selected by name"""
+    if name == 'opencv':
+        return OpenCVBackend(config_path, weights_path, dnn_backend, dnn_target, threads)
+    if name == 'onnxruntime':
+        return OnnxRuntimeBackend(onnx_model_path, threads)
+    if name == 'onnx_int8':
+        if int8_model_path is None and onnx_model_path:
+            int8_model_path = os.path.splitext(onnx_model_path)[0] + '.int8.onnx'
+        return QuantizedOnnxBackend(onnx_model_path, int8_model_path, threads, calibration_images)
+    if name == 'stub':
+        return StubBackend()
+    raise ValueError(f"Unknown inference backend '{name}' (expected one of {', '.join(BACKENDS)})")
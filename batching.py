@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from metrics import DETECT_BATCH_SIZE, DETECT_WAIT_SECONDS
+
+# =========== REQUEST COALESCING ===========
+# /detect requests arrive one or a few images at a time from many request
+# threads (or coroutines). Run one by one, each pays a whole forward pass.
+# A MicroBatcher holds the oldest waiting image for at most max_wait seconds
+# to see what else turns up, then runs everything waiting, up to max_batch
+# images, through a single batched blob and forward pass. Under light load
+# that adds at most max_wait of latency; under heavy load batches fill
+# before the wait is up, and the extra requests become throughput instead of
+# queueing.
+
+
+class MicroBatcher:
+    """Coalesces images submitted by concurrent requests into batched inference calls
+
+    infer_batch(images) returns one result per image. Up to concurrency
+    batches run at once: one per inference worker process, or a single one
+    for the in-process net, which only runs one pass at a time anyway.
+    """
+
+    def __init__(self, infer_batch, max_batch=8, max_wait=0.005, concurrency=1):
+        self.infer_batch = infer_batch
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait))
+        self.pending = deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.images_done = 0
+        self.batches_done = 0
+        self.largest_batch = 0
+        self.threads = [threading.Thread(target=self._run, name=f"detect-batcher-{i}", daemon=True)
+                        for i in range(max(1, int(concurrency)))]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, image):
+        """Queue one image; returns a Future of its inference result"""
+        future = Future()
+        with self.cond:
+            if self.closed:
+                raise RuntimeError('Batcher is closed')
+            self.pending.append((time.perf_counter(), image, future))
+            self.cond.notify_all()
+        return future
+
+    def _next_batch(self):
+        """Wait for images and take up to max_batch of them; None once closed and drained"""
+        with self.cond:
+            while not self.pending and not self.closed:
+                self.cond.wait()
+            # The oldest image bounds the wait; a full batch goes at once
+            while self.pending and len(self.pending) < self.max_batch and not self.closed:
+                remaining = self.pending[0][0] + self.max_wait - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            if not self.pending:
+                return None if self.closed else []
+            return [self.pending.popleft() for _ in range(min(len(self.pending), self.max_batch))]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            if not batch:
+                # Another thread took the images this one was waiting on
+                continue
+            started = time.perf_counter()
+            for queued, _, _ in batch:
+                DETECT_WAIT_SECONDS.observe(started - queued)
+            DETECT_BATCH_SIZE.observe(len(batch))
+            try:
+                results = self.infer_batch([image for _, image, _ in batch])
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, _, future), result in zip(batch, results):
+                future.set_result(result)
+            with self.cond:
+                self.images_done += len(batch)
+                self.batches_done += 1
+                self.largest_batch = max(self.largest_batch, len(batch))
+
+    def close(self, timeout=5.0):
+        """Run what is already queued, then stop the threads"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def stats(self):
+        with self.cond:
+            return {
+                'images': self.images_done,
+                'batches': self.batches_done,
+                'mean_batch': round(self.images_done / self.batches_done, 2) if self.batches_done else 0.0,
+                'largest_batch': self.largest_batch,
+                'queue_depth': len(self.pending),
+                'max_batch': self.max_batch,
+                'max_wait': self.max_wait,
+            }
@@ -0,0 +1,287 @@
+"""Benchmark suite: every detection stage and the end-to-end paths on the sample media
+
+Runs the real network on stand-in weights generated from
+data/yolov3_testing.cfg (see stand_in_weights.py), over data/ak47.mp4 and
+data/cam.png. Each case reports frames/sec, p50/p99 latency and the peak
+RSS of the process so far, and the whole run is saved as JSON so results
+can be compared across commits:
+
+    python benchmarks/bench_pipeline.py --frames 30 --output before.json
+    python benchmarks/bench_pipeline.py --frames 30 --compare before.json
+
+With --compare the run exits non-zero when a case lost more than
+--max-regression of its throughput.
+
+The decode_* cases read the whole sample video under one sampling policy
+each (see sampling.py); their fps is sampled frames per second, and
+video_seconds_per_second says how fast the policy gets through footage.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(REPO_DIR, 'data')
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sampling import VideoSource
+from stand_in_weights import VERSION as WEIGHTS_VERSION, generate_weights
+
+CFG_NAME = 'yolov3_testing.cfg'
+WEIGHTS_NAME = 'yolov3_training_2000.weights'
+VIDEO_PATH = os.path.join(DATA_DIR, 'ak47.mp4')
+IMAGE_PATH = os.path.join(DATA_DIR, 'cam.png')
+
+SAMPLING_CASES = {
+    'decode_all': 'all',
+    'decode_every5': 'every=5',
+    'decode_hz2': 'hz=2',
+    'decode_keyframes': 'keyframes',
+}
+CASES = ('capture', 'preprocess', 'forward', 'postprocess', 'render', 'encode',
+         'detect_image', 'detect_video', 'stream_image', 'stream_video') + tuple(SAMPLING_CASES)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def summarize(latencies, elapsed):
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'frames': len(latencies),
+        'fps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': round(float(latencies_ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(latencies_ms, 50)), 3),
+        'p99_ms': round(float(np.percentile(latencies_ms, 99)), 3),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def measure(step, frames, warmup):
+    """Time step(i) for warmup + frames iterations; only the last frames count"""
+    for i in range(warmup):
+        step(i)
+    latencies = []
+    started = time.perf_counter()
+    for i in range(frames):
+        t = time.perf_counter()
+        step(warmup + i)
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def measure_sampling(policy):
+    """Read all of the sample video under one sampling policy, keyframe scan included"""
+    latencies = []
+    started = last = time.perf_counter()
+    source = VideoSource(VIDEO_PATH, policy)
+    for _ in source:
+        now = time.perf_counter()
+        latencies.append(now - last)
+        last = now
+    elapsed = time.perf_counter() - started
+    source.release()
+    result = summarize(latencies, elapsed)
+    result['video_seconds_per_second'] = round(source.frame_count / source.fps / elapsed, 2)
+    result.update({key: source.stats()[key] for key in ('frames_grabbed', 'frames_seeked_over', 'seeks')})
+    return result
+
+
+def read_frames(path, count):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < count:
+        success, frame = cap.read()
+        if not success:
+            if not frames:
+                sys.exit(f"[ERROR] Cannot read frames from {path}")
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            continue
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def prepare_work_dir(work_dir, seed):
+    """Model files the app expects in its working directory, with stand-in weights"""
+    os.makedirs(work_dir, exist_ok=True)
+    shutil.copy(os.path.join(DATA_DIR, CFG_NAME), os.path.join(work_dir, CFG_NAME))
+    weights_path = os.path.join(work_dir, WEIGHTS_NAME)
+    stamp_path = weights_path + '.version'
+    stamp = f"{WEIGHTS_VERSION} {seed}"
+    if not os.path.exists(weights_path) or not os.path.exists(stamp_path) or open(stamp_path).read() != stamp:
+        print(f"[INFO] Generating stand-in weights in {work_dir}")
+        generate_weights(os.path.join(work_dir, CFG_NAME), weights_path, seed)
+        with open(stamp_path, 'w') as f:
+            f.write(stamp)
+    return work_dir
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_cases(engine, cases, frames, warmup):
+    from decoding import decode_batch
+
+    total = frames + warmup
+    video_frames = read_frames(VIDEO_PATH, total)
+    image = cv2.imread(IMAGE_PATH)
+    if image is None:
+        sys.exit(f"[ERROR] Cannot read {IMAGE_PATH}")
+    size = engine.app.config['INPUT_SIZE']
+    builder = engine.blob_builder
+    backend = engine.get_backend()
+    display_frames = [engine.to_display(frame) for frame in video_frames]
+    target_size = (display_frames[0].shape[1], display_frames[0].shape[0])
+
+    # Inputs of the later stages come from one untimed pass of the earlier ones
+    outs = [tuple(out.copy() for out in backend.forward(builder.build([frame], size)[0]))
+            for frame in video_frames[:2]]
+    layouts = builder.build([video_frames[0]], size)[1]
+    detections = decode_batch(outs[0], layouts, size, [target_size])[0]
+
+    def capture():
+        cap = cv2.VideoCapture(VIDEO_PATH)
+        def step(i):
+            success, _ = cap.read()
+            if not success:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                cap.read()
+        return step
+
+    def forward():
+        blob = builder.build([video_frames[0]], size)[0].copy()
+        return lambda i: backend.forward(blob)
+
+    def detect_video():
+        infer = engine.make_infer(engine.new_motion_gate(), engine.new_resolution_controller())
+        tracker = engine.new_tracker()
+        return lambda i: engine.detect_objects(video_frames[i], infer, tracker)
+
+    def stream_video():
+        chunks = engine.gen_video_frames(VIDEO_PATH)
+        return lambda i: next(chunks)
+
+    steps = {
+        'capture': capture,
+        'preprocess': lambda: lambda i: builder.build([video_frames[i]], size),
+        'forward': forward,
+        'postprocess': lambda: lambda i: decode_batch(outs[i % 2], layouts, size, [target_size]),
+        'render': lambda: lambda i: engine.render_detections(display_frames[i].copy(), detections[0], detections[1]),
+        'encode': lambda: lambda i: engine.encode_frame(display_frames[i]),
+        'detect_image': lambda: lambda i: engine.detect_objects(image),
+        'detect_video': detect_video,
+        'stream_image': lambda: lambda i: engine.gen_image_frame(IMAGE_PATH),
+        'stream_video': stream_video,
+    }
+
+    results = {}
+    for name in cases:
+        print(f"[INFO] Running {name} ...", flush=True)
+        if name in SAMPLING_CASES:
+            results[name] = measure_sampling(SAMPLING_CASES[name])
+            continue
+        results[name] = measure(steps[name](), frames, warmup)
+        if name == 'stream_video':
+            engine.stop_live_feeds()
+    return results
+
+
+def compare(results, baseline_path, max_regression):
+    """Print throughput deltas against a previous run; returns the regressed case names"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressed = []
+    print(f"\n{'case':<18}{'before fps':>12}{'after fps':>12}{'change':>10}")
+    for name, result in results.items():
+        before = baseline.get('cases', {}).get(name)
+        if not before or not before['fps']:
+            continue
+        change = result['fps'] / before['fps'] - 1
+        flag = ''
+        if change < -max_regression:
+            regressed.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<18}{before['fps']:>12.2f}{result['fps']:>12.2f}{change:>+10.1%}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', type=int, default=20, help='timed frames per case')
+    parser.add_argument('--warmup', type=int, default=2, help='untimed frames per case')
+    parser.add_argument('--input-size', type=int, default=416)
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=list(CASES))
+    parser.add_argument('--seed', type=int, default=0, help='seed of the stand-in weights')
+    parser.add_argument('--work-dir', default=None,
+                        help='where to keep the stand-in model (reused between runs); default: a temp dir')
+    parser.add_argument('--output', default=None, help='JSON results file (default: benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', default=None, help='previous JSON results to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='allowed throughput loss per case with --compare (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    work_dir = prepare_work_dir(args.work_dir or tempfile.mkdtemp(prefix='nexus-bench-'), args.seed)
+    output = os.path.abspath(args.output or os.path.join(REPO_DIR, 'benchmarks', 'results',
+                                                          f"{git_commit() or 'local'}.json"))
+    baseline = os.path.abspath(args.compare) if args.compare else None
+
+    # The app loads its model from the working directory at import
+    os.environ.setdefault('INFERENCE_WORKERS', '0')
+    os.chdir(work_dir)
+    import app as engine
+
+    engine.app.config['INPUT_SIZE'] = args.input_size
+    # Measure detection work, not result-cache hits
+    engine.result_cache = None
+
+    results = run_cases(engine, args.cases, args.frames, args.warmup)
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'seed': args.seed,
+        'config': {key: engine.app.config[key] for key in (
+            'INPUT_SIZE', 'INFERENCE_BACKEND', 'DNN_BACKEND', 'DNN_TARGET', 'INFERENCE_THREADS',
+            'LETTERBOX', 'DISPLAY_RESIZE', 'MOTION_GATE', 'KEYFRAME_TRACKING', 'ADAPTIVE_RESOLUTION')},
+        'cases': results,
+    }
+
+    print(f"\n{'case':<18}{'fps':>10}{'p50 ms':>10}{'p99 ms':>10}{'rss MB':>10}")
+    for name, result in results.items():
+        print(f"{name:<18}{result['fps']:>10.2f}{result['p50_ms']:>10.2f}"
+              f"{result['p99_ms']:>10.2f}{result['peak_rss_mb']:>10.1f}")
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n[INFO] Results saved to {output}")
+
+    if baseline and compare(results, baseline, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Generate random darknet weights that fit a YOLOv3 cfg
+
+The trained weights are not in the repo, so benchmarks run the full network
+on a stand-in: same layers, same shapes, same cost per frame, random values.
+Weights are scaled so activations stay finite through all 106 layers. The
+YOLO heads are biased so objectness clears the decoder's pre-filter on a
+few percent of rows (decoding does real work), while class scores stay
+under the 0.5 threshold: the sample video yields no boxes and data/cam.png
+about one, so alerts and event logging don't end up in the timings.
+
+    python benchmarks/stand_in_weights.py data/yolov3_testing.cfg stand_in.weights
+"""
+import argparse
+
+import numpy as np
+
+# Bumped whenever the generated values change, so cached copies get rebuilt
+VERSION = 2
+
+
+def read_cfg(path):
+    """[(section name, {key: value}), ...] of a darknet cfg"""
+    sections = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            if line.startswith('['):
+                sections.append((line[1:-1].strip(), {}))
+            else:
+                key, value = line.split('=', 1)
+                sections[-1][1][key.strip()] = value.strip()
+    return sections
+
+
+def generate_weights(cfg_path, weights_path, seed=0, objectness_bias=-2.5, class_bias=-6.0):
+    """Write darknet weights for every conv layer of cfg_path; returns the byte count"""
+    rng = np.random.default_rng(seed)
+    sections = read_cfg(cfg_path)
+    channels = int(sections[0][1].get('channels', 3))
+    layers = sections[1:]
+    layer_channels = []
+
+    # Header: major, minor, revision, then a 64-bit "images seen" counter
+    parts = [np.array([0, 2, 0], dtype=np.int32).tobytes(), np.array([0], dtype=np.int64).tobytes()]
+    for index, (name, options) in enumerate(layers):
+        if name == 'convolutional':
+            filters = int(options['filters'])
+            size = int(options['size'])
+            batch_normalize = int(options.get('batch_normalize', 0))
+            if batch_normalize:
+                # biases, scales, rolling mean, rolling variance
+                parts += [rng.normal(0, 0.01, filters).astype(np.float32).tobytes(),
+                          np.ones(filters, dtype=np.float32).tobytes(),
+                          np.zeros(filters, dtype=np.float32).tobytes(),
+                          np.ones(filters, dtype=np.float32).tobytes()]
+            else:
+                # Detection head: some objectness, class scores mostly below threshold
+                biases = np.zeros(filters, dtype=np.float32).reshape(3, -1)
+                biases[:, 4] = objectness_bias
+                biases[:, 5:] = class_bias
+                parts.append(biases.tobytes())
+            # He init; damp residual branches so the shortcuts don't blow up
+            scale = np.sqrt(2.0 / (channels * size * size)) * (1.0 if batch_normalize else 3.0)
+            if index + 1 < len(layers) and layers[index + 1][0] == 'shortcut':
+                scale *= 0.1
+            weights = rng.normal(0, 1, (filters, channels, size, size)) * scale
+            parts.append(weights.astype(np.float32).tobytes())
+            channels = filters
+        elif name == 'route':
+            sources = [int(layer) for layer in options['layers'].split(',')]
+            channels = sum(layer_channels[s if s >= 0 else len(layer_channels) + s] for s in sources)
+        layer_channels.append(channels)
+
+    data = b''.join(parts)
+    with open(weights_path, 'wb') as f:
+        f.write(data)
+    return len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('cfg')
+    parser.add_argument('output')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    size = generate_weights(args.cfg, args.output, args.seed)
+    print(f"[INFO] Wrote {size / 1e6:.1f} MB of stand-in weights to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
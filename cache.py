@@ -0,0 +1,292 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# =========== DETECTION RESULT CACHE ===========
+# Detection results are keyed by the SHA-256 of the uploaded file, so the same
+# evidence file re-submitted under any name skips the network entirely. Only
+# the raw detections are stored; the overlay is re-rendered from them.
+# Images also carry a 64-bit difference hash so re-encoded or resized copies
+# of a known image can be matched as near-duplicates.
+#
+# Keys are opaque to the cache: callers append a fingerprint of whatever the
+# detections depend on (model, input size, thresholds, display size), so a
+# result is never replayed under different settings. The disk tier outlives
+# the process and is pruned by age and total size, oldest first.
+
+
+def pack_detections(boxes, confidences, class_ids):
+    """Detection arrays -> JSON-friendly dict"""
+    return {
+        'boxes': np.asarray(boxes).tolist(),
+        'confidences': np.asarray(confidences).tolist(),
+        'class_ids': np.asarray(class_ids).tolist(),
+    }
+
+
+def unpack_detections(packed):
+    """JSON-friendly dict -> (boxes, confidences, class_ids) arrays"""
+    return (np.asarray(packed['boxes'], dtype=np.int32).reshape(-1, 4),
+            np.asarray(packed['confidences'], dtype=np.float32),
+            np.asarray(packed['class_ids'], dtype=np.int32))
+
+
+_digest_memo = {}
+_digest_lock = threading.Lock()
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file, memoized on (path, size, mtime) so re-checks are free"""
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        if memo_key in _digest_memo:
+            return _digest_memo[memo_key]
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+
+    with _digest_lock:
+        if len(_digest_memo) > 4096:
+            _digest_memo.clear()
+        _digest_memo[memo_key] = digest
+    return digest
+
+
+def remember_digest(path, digest):
+    """Seed file_digest with a hash computed elsewhere (e.g. while the file was uploaded)"""
+    stat = os.stat(path)
+    with _digest_lock:
+        _digest_memo[(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)] = digest
+
+
+def perceptual_hash(image):
+    """64-bit difference hash (dHash) of a BGR image"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class ResultCache:
+    """Size-bounded LRU of detection results with an optional, size- and age-bounded on-disk tier"""
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024, disk_dir=None,
+                 max_disk_bytes=None, max_age=None, prune_interval=60.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age = max_age
+        self.prune_interval = prune_interval
+        self.disk_bytes = None  # unknown until the first prune walks the folder
+        self.pruned_at = 0.0
+        self.disk_pruned = 0
+        self.prune_lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.total_bytes = 0
+        self.phashes = {}
+        self.phash_index_loaded = False
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.near_hits = 0
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + '.json')
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        entry = self._read_disk(key)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            self._store(key, entry)
+        if self.disk_dir:
+            size = self._write_disk(key, entry)
+            if size is None:
+                return
+            with self.lock:
+                if self.disk_bytes is not None:
+                    self.disk_bytes += size
+                over = (self.max_disk_bytes and self.disk_bytes is not None
+                        and self.disk_bytes > self.max_disk_bytes)
+            if over or time.time() - self.pruned_at >= self.prune_interval:
+                self.prune()
+
+    def find_similar(self, phash, max_distance=4, suffix=''):
+        """Return (key, entry) of the closest cached image within max_distance bits
+
+        Only keys ending with suffix (the caller's settings fingerprint) are candidates.
+        """
+        self._load_phash_index()
+        with self.lock:
+            candidates = [(key, other) for key, other in self.phashes.items() if key.endswith(suffix)]
+        best = None
+        for key, other in candidates:
+            distance = hamming_distance(phash, other)
+            if distance <= max_distance and (best is None or distance < best[0]):
+                best = (distance, key)
+        if best is None:
+            return None, None
+        entry = self.get(best[1])
+        if entry is not None:
+            with self.lock:
+                self.near_hits += 1
+        return best[1], entry
+
+    def _store(self, key, entry):
+        size = len(json.dumps(entry))
+        if key in self.entries:
+            self.total_bytes -= self.sizes[key]
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        self.sizes[key] = size
+        self.total_bytes += size
+        if entry.get('phash') is not None:
+            self.phashes[key] = entry['phash']
+        # Evict from memory only; the disk tier is pruned on its own by prune()
+        while self.entries and (len(self.entries) > self.max_entries
+                                or self.total_bytes > self.max_bytes):
+            old_key, _ = self.entries.popitem(last=False)
+            self.total_bytes -= self.sizes.pop(old_key)
+            if not self.disk_dir:
+                self.phashes.pop(old_key, None)
+
+    def _write_disk(self, key, entry):
+        """Write an entry through its own temp file; returns its size, or None if the write failed"""
+        path = self._disk_path(key)
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Concurrent puts of one key each get a temp file; the last replace wins
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # The memory tier still has the entry; a failed write must not fail the request
+            print(f"[WARNING] Could not write cache entry {key[:16]}: {e}")
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            return None
+        return size
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            # A hit counts as a use, so age pruning keeps it
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def prune(self):
+        """Drop on-disk entries older than max_age, then the oldest while over max_disk_bytes"""
+        if not self.disk_dir or not self.prune_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.time()
+            files = []
+            for root, _, names in os.walk(self.disk_dir):
+                for name in names:
+                    if not name.endswith('.json'):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+            files.sort()
+            total = sum(size for _, size, _ in files)
+            removed = []
+            for mtime, size, path in files:
+                too_old = self.max_age and now - mtime > self.max_age
+                too_big = self.max_disk_bytes and total > self.max_disk_bytes
+                if not (too_old or too_big):
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed.append(os.path.basename(path)[:-5])
+            with self.lock:
+                for key in removed:
+                    if key not in self.entries:
+                        self.phashes.pop(key, None)
+                self.disk_pruned += len(removed)
+                self.disk_bytes = total
+                self.pruned_at = now
+        finally:
+            self.prune_lock.release()
+
+    def _load_phash_index(self):
+        """Pull the perceptual hashes of on-disk entries in once, on first use"""
+        if self.phash_index_loaded or not self.disk_dir:
+            return
+        index = {}
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(root, name)) as f:
+                        phash = json.load(f).get('phash')
+                except (OSError, ValueError):
+                    continue
+                if phash is not None:
+                    index[name[:-5]] = phash
+        with self.lock:
+            index.update(self.phashes)
+            self.phashes = index
+            self.phash_index_loaded = True
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'near_duplicate_hits': self.near_hits,
+                'disk_bytes': self.disk_bytes,
+                'disk_pruned': self.disk_pruned,
+            }
@@ -0,0 +1,173 @@
+import json
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+
+# =========== ALERT CLIPS ===========
+# Each running source keeps a short, memory-bounded ring of the JPEG frames
+# its hub already encoded for viewers, so recording costs no extra encode or
+# inference. An alert freezes the last pre_seconds of the ring into a clip,
+# keeps appending frames until post_seconds after the last alert, then hands
+# the clip to a background writer. Clips are written as MJPEG (the JPEG
+# frames back to back, playable by ffplay / VLC) with a JSON sidecar holding
+# the frame timestamps.
+#
+# Memory per source is bounded twice: the ring by max_bytes, and the clip
+# being captured by max_clip_bytes (a clip that reaches it is cut there, and
+# a later alert starts the next one). Finished clips wait for the writer
+# within max_pending_bytes; past that a clip is dropped rather than let a
+# slow disk grow the queue without limit.
+
+
+class ClipWriter:
+    """Background thread that writes finished clips to disk, holding at most max_pending_bytes of them"""
+
+    def __init__(self, max_pending_bytes=256 * 1024 * 1024):
+        self.queue = queue.Queue()
+        self.max_pending_bytes = max_pending_bytes
+        self.pending_bytes = 0
+        self.lock = threading.Lock()
+        self.clips_written = 0
+        self.clips_dropped = 0
+        self.bytes_written = 0
+        self.thread = threading.Thread(target=self._write_loop, name='clip-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, clip):
+        """Queue a clip for writing; False (and the clip is dropped) when the queue is full"""
+        with self.lock:
+            if self.pending_bytes and self.pending_bytes + clip['bytes'] > self.max_pending_bytes:
+                self.clips_dropped += 1
+                print(f"[ERROR] Clip writer is behind; dropped clip {clip['path']}")
+                return False
+            self.pending_bytes += clip['bytes']
+        self.queue.put(clip)
+        return True
+
+    def _write_loop(self):
+        while True:
+            clip = self.queue.get()
+            if clip is None:
+                break
+            try:
+                self.write(clip)
+            except OSError as e:
+                print(f"[ERROR] Could not write clip {clip['path']}: {e}")
+            finally:
+                with self.lock:
+                    self.pending_bytes -= clip['bytes']
+
+    def write(self, clip):
+        os.makedirs(os.path.dirname(clip['path']), exist_ok=True)
+        size = 0
+        with open(clip['path'], 'wb') as f:
+            for _, jpeg in clip['frames']:
+                f.write(jpeg)
+                size += len(jpeg)
+        timestamps = [ts for ts, _ in clip['frames']]
+        duration = timestamps[-1] - timestamps[0] if len(timestamps) > 1 else 0.0
+        with open(os.path.splitext(clip['path'])[0] + '.json', 'w') as f:
+            json.dump({
+                'source': clip['source'],
+                'alert_times': clip['alert_times'],
+                'frames': len(timestamps),
+                'fps': round((len(timestamps) - 1) / duration, 2) if duration else 0.0,
+                'timestamps': timestamps,
+            }, f)
+        self.clips_written += 1
+        self.bytes_written += size
+
+    def close(self, timeout=5.0):
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+
+class ClipBuffer:
+    """Ring of recent encoded frames for one source, and the clip being captured from it
+
+    add() takes the JPEG bytes the hub already encoded for a frame; the ring
+    holds at most pre_seconds of frames and at most max_bytes of JPEG data.
+    A clip being captured also holds its frames until it is handed to the
+    writer, up to max_clip_seconds and max_clip_bytes of them.
+    """
+
+    def __init__(self, source_id, clip_dir, writer, pre_seconds=5.0, post_seconds=5.0,
+                 max_bytes=32 * 1024 * 1024, max_clip_seconds=60.0, max_clip_bytes=64 * 1024 * 1024):
+        self.source_id = source_id
+        self.clip_dir = clip_dir
+        self.writer = writer
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.max_bytes = max_bytes
+        self.max_clip_seconds = max_clip_seconds
+        self.max_clip_bytes = max_clip_bytes
+        self.frames = deque()
+        self.buffered_bytes = 0
+        self.active = None
+        self.clips_started = 0
+        self.lock = threading.Lock()
+
+    def add(self, jpeg, ts=None):
+        ts = time.time() if ts is None else ts
+        finished = None
+        with self.lock:
+            self.frames.append((ts, jpeg))
+            self.buffered_bytes += len(jpeg)
+            while self.frames and (self.buffered_bytes > self.max_bytes
+                                   or self.frames[0][0] < ts - self.pre_seconds):
+                self.buffered_bytes -= len(self.frames.popleft()[1])
+            if self.active is not None:
+                self.active['frames'].append((ts, jpeg))
+                self.active['bytes'] += len(jpeg)
+                if (ts >= self.active['until'] or ts - self.active['started'] >= self.max_clip_seconds
+                        or self.active['bytes'] >= self.max_clip_bytes):
+                    finished, self.active = self.active, None
+        if finished is not None:
+            self.writer.submit(finished)
+
+    def trigger(self, ts=None):
+        """Start a clip (or extend the one being captured); returns the clip's path"""
+        ts = time.time() if ts is None else ts
+        with self.lock:
+            if self.active is not None:
+                self.active['until'] = max(self.active['until'], ts + self.post_seconds)
+                self.active['alert_times'].append(ts)
+                return self.active['path']
+            name = re.sub(r'[^A-Za-z0-9_.-]+', '_', str(self.source_id)).strip('_') or 'source'
+            stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(ts)) + f"-{int(ts * 1000) % 1000:03d}"
+            self.active = {
+                'source': self.source_id,
+                'path': os.path.join(self.clip_dir, f"{name}_{stamp}.mjpeg"),
+                'started': ts,
+                'until': ts + self.post_seconds,
+                'alert_times': [ts],
+                'frames': list(self.frames),
+                'bytes': self.buffered_bytes,
+            }
+            self.clips_started += 1
+            return self.active['path']
+
+    def close(self):
+        """Write out a clip that is still being captured and drop the ring"""
+        with self.lock:
+            finished, self.active = self.active, None
+            self.frames.clear()
+            self.buffered_bytes = 0
+        if finished is not None and finished['frames']:
+            self.writer.submit(finished)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'buffered_frames': len(self.frames),
+                'buffered_bytes': self.buffered_bytes,
+                'buffered_seconds': round(self.frames[-1][0] - self.frames[0][0], 2) if self.frames else 0.0,
+                'max_bytes': self.max_bytes,
+                'max_clip_bytes': self.max_clip_bytes,
+                'recording': self.active is not None,
+                'recording_bytes': self.active['bytes'] if self.active is not None else 0,
+                'clips_started': self.clips_started,
+            }
@@ -0,0 +1,108 @@
+import time
+
+import cv2
+import numpy as np
+
+from preprocess import unletterbox
+from tracing import TRACER
+
+# =========== YOLO OUTPUT DECODING ===========
+# Each YOLO output row is [cx, cy, w, h, objectness, class scores...] with the
+# box in image-relative units. Darknet already multiplies the class scores by
+# the objectness, so a row can only pass the class threshold if its
+# objectness passes it too - that lets us drop most rows on one column before
+# touching the class scores at all.
+
+CONFIDENCE_THRESHOLD = 0.5
+NMS_THRESHOLD = 0.4
+
+EMPTY_BOXES = np.zeros((0, 4), dtype=np.int32)
+EMPTY_CONFIDENCES = np.zeros((0,), dtype=np.float32)
+EMPTY_CLASS_IDS = np.zeros((0,), dtype=np.int32)
+EMPTY_INDEXES = np.zeros((0,), dtype=np.int32)
+
+
+def decode_outputs(outs, width, height, conf_threshold=CONFIDENCE_THRESHOLD):
+    """Turn raw YOLO output layers into (boxes, confidences, class_ids) arrays
+
+    boxes is an int32 (N, 4) array of [x, y, w, h] in pixels of a width x height
+    image, confidences is float32 (N,) and class_ids is int32 (N,).
+    """
+    if isinstance(outs, np.ndarray):
+        rows = outs.reshape(-1, outs.shape[-1])
+    else:
+        rows = np.concatenate([out.reshape(-1, out.shape[-1]) for out in outs])
+
+    # Cheap pre-filter on objectness, then the real class-score test
+    rows = rows[rows[:, 4] > conf_threshold]
+    if len(rows) == 0:
+        return EMPTY_BOXES, EMPTY_CONFIDENCES, EMPTY_CLASS_IDS
+
+    scores = rows[:, 5:]
+    class_ids = np.argmax(scores, axis=1)
+    confidences = scores[np.arange(len(rows)), class_ids]
+    keep = confidences > conf_threshold
+    if not keep.any():
+        return EMPTY_BOXES, EMPTY_CONFIDENCES, EMPTY_CLASS_IDS
+    rows = rows[keep]
+
+    # Same truncation as int() in the original per-row loop
+    center_x = np.trunc(rows[:, 0] * width)
+    center_y = np.trunc(rows[:, 1] * height)
+    w = np.trunc(rows[:, 2] * width)
+    h = np.trunc(rows[:, 3] * height)
+    boxes = np.stack([np.trunc(center_x - w / 2),
+                      np.trunc(center_y - h / 2),
+                      w, h], axis=1).astype(np.int32)
+
+    return (boxes,
+            confidences[keep].astype(np.float32),
+            class_ids[keep].astype(np.int32))
+
+
+def apply_nms(boxes, confidences, score_threshold=CONFIDENCE_THRESHOLD,
+              nms_threshold=NMS_THRESHOLD):
+    """Run non-maximum suppression and return the kept indexes as an int32 array"""
+    if len(boxes) == 0:
+        return EMPTY_INDEXES
+    indexes = cv2.dnn.NMSBoxes(boxes.tolist(), confidences.tolist(),
+                               score_threshold, nms_threshold)
+    # Older OpenCV builds return an (N, 1) array, newer ones a flat one
+    return np.asarray(indexes, dtype=np.int32).reshape(-1)
+
+
+def detect_boxes(outs, width, height, conf_threshold=CONFIDENCE_THRESHOLD,
+                 nms_threshold=NMS_THRESHOLD):
+    """Decode the output layers and keep only the boxes that survive NMS"""
+    started = time.perf_counter()
+    boxes, confidences, class_ids = decode_outputs(outs, width, height, conf_threshold)
+    decoded = time.perf_counter()
+    indexes = apply_nms(boxes, confidences, conf_threshold, nms_threshold)
+    TRACER.record('decode', started, decoded, candidates=len(boxes))
+    TRACER.record('nms', decoded, kept=len(indexes))
+    return boxes[indexes], confidences[indexes], class_ids[indexes]
+
+
+def split_batch_outputs(outs, batch_size):
+    """Split the output layers of a batched forward pass into one tuple per image"""
+    if batch_size == 1 and outs[0].ndim == 2:
+        return [tuple(outs)]
+    # Batched YOLO outputs are (N, rows, 5 + classes); flatten (N * rows, ...) too
+    per_layer = [out.reshape(batch_size, -1, out.shape[-1]) for out in outs]
+    return [tuple(layer[i] for layer in per_layer) for i in range(batch_size)]
+
+
+def decode_batch(outs, layouts, input_size, target_sizes,
+                 conf_threshold=CONFIDENCE_THRESHOLD, nms_threshold=NMS_THRESHOLD):
+    """Per-image (boxes, confidences, class_ids) of a batched forward pass
+
+    layouts come from BlobBuilder.build and target_sizes are the (width,
+    height) each image's boxes should be expressed in.
+    """
+    results = []
+    for layout, target_size, image_outs in zip(layouts, target_sizes,
+                                               split_batch_outputs(outs, len(layouts))):
+        unletterbox(image_outs, layout, input_size)
+        results.append(detect_boxes(image_outs, target_size[0], target_size[1],
+                                    conf_threshold, nms_threshold))
+    return results
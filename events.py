@@ -0,0 +1,196 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+# =========== DETECTION EVENT STORE ===========
+# Every frame with detections becomes one row in SQLite (WAL mode, so
+# readers never wait on the writer). The frame loop only does a non-blocking
+# put onto a bounded queue; a writer thread drains it and commits in batches,
+# either when batch_size events are waiting or every flush_interval seconds.
+# If the disk can't keep up, the queue fills and new events are counted as
+# dropped rather than stalling detection.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    stream TEXT NOT NULL,
+    frame_index INTEGER,
+    num_boxes INTEGER NOT NULL,
+    max_confidence REAL NOT NULL,
+    boxes TEXT NOT NULL,
+    confidences TEXT NOT NULL,
+    class_ids TEXT NOT NULL,
+    snapshot TEXT
+);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+CREATE INDEX IF NOT EXISTS events_stream_ts ON events (stream, ts);
+"""
+
+INSERT = ("INSERT INTO events (ts, stream, frame_index, num_boxes, max_confidence, "
+          "boxes, confidences, class_ids, snapshot) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+
+
+def connect(path):
+    connection = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    # WAL + NORMAL only fsyncs at checkpoints; a crash can lose the last batch, not corrupt the db
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def event_filters(stream=None, start=None, end=None, min_confidence=None):
+    clauses, params = [], []
+    if stream is not None:
+        clauses.append('stream = ?')
+        params.append(stream)
+    if start is not None:
+        clauses.append('ts >= ?')
+        params.append(float(start))
+    if end is not None:
+        clauses.append('ts < ?')
+        params.append(float(end))
+    if min_confidence is not None:
+        clauses.append('max_confidence >= ?')
+        params.append(float(min_confidence))
+    return clauses, params
+
+
+def event_row(ts, stream, frame_index, boxes, confidences, class_ids, snapshot):
+    return (ts, str(stream), frame_index, len(boxes),
+            float(max(confidences)) if len(confidences) else 0.0,
+            json.dumps([[int(v) for v in box] for box in boxes]),
+            json.dumps([round(float(c), 4) for c in confidences]),
+            json.dumps([int(c) for c in class_ids]), snapshot)
+
+
+class EventStore:
+    """Batched, asynchronous SQLite log of detections with paginated queries"""
+
+    def __init__(self, path, batch_size=200, flush_interval=0.5, max_queue=10000):
+        self.path = path
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.local = threading.local()
+        self.events_written = 0
+        self.events_dropped = 0
+        self.batches_written = 0
+        self.closed = False
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.writer = threading.Thread(target=self._write_loop, name='event-writer', daemon=True)
+        self.writer.start()
+
+    def record(self, stream, boxes, confidences, class_ids, frame_index=None, snapshot=None, ts=None):
+        """Queue one frame's detections; never blocks. Returns False if it was dropped
+
+        The arrays are serialized later on the writer thread, so callers must
+        not modify them afterwards (decoding returns fresh arrays per frame).
+        """
+        if self.closed:
+            return False
+        event = (time.time() if ts is None else ts, stream, frame_index, boxes, confidences, class_ids, snapshot)
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            self.events_dropped += 1
+            return False
+
+    def _write_loop(self):
+        connection = connect(self.path)
+        stop = False
+        while not stop:
+            batch = []
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    row = self.queue.get(timeout=max(0.0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                if row is None:
+                    stop = True
+                    break
+                batch.append(event_row(*row))
+            if not batch:
+                continue
+            try:
+                with connection:
+                    connection.executemany(INSERT, batch)
+                self.events_written += len(batch)
+                self.batches_written += 1
+            except sqlite3.Error as e:
+                self.events_dropped += len(batch)
+                print(f"[ERROR] Could not write {len(batch)} detection events: {e}")
+        connection.close()
+
+    def _reader(self):
+        # One read connection per request thread; WAL lets them read while the writer commits
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = connect(self.path)
+            connection.row_factory = sqlite3.Row
+        return connection
+
+    def query(self, stream=None, start=None, end=None, min_confidence=None, limit=100, cursor=None):
+        """Newest-first events matching the filters, plus the cursor of the next page
+
+        Pages are keyed on (ts, id) rather than an offset, so a deep page costs
+        the same as the first one and walks the (stream, ts) / (ts) indexes.
+        """
+        clauses, params = event_filters(stream, start, end, min_confidence)
+        if cursor:
+            cursor_ts, cursor_id = cursor.split(':')
+            clauses.append('(ts, id) < (?, ?)')
+            params += [float(cursor_ts), int(cursor_id)]
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        limit = max(1, min(int(limit), 1000))
+        rows = self._reader().execute(
+            f"SELECT * FROM events {where} ORDER BY ts DESC, id DESC LIMIT ?", params + [limit + 1]).fetchall()
+        events = [{
+            'id': row['id'],
+            'ts': row['ts'],
+            'stream': row['stream'],
+            'frame_index': row['frame_index'],
+            'num_boxes': row['num_boxes'],
+            'max_confidence': row['max_confidence'],
+            'boxes': json.loads(row['boxes']),
+            'confidences': json.loads(row['confidences']),
+            'class_ids': json.loads(row['class_ids']),
+            'snapshot': row['snapshot'],
+        } for row in rows[:limit]]
+        next_cursor = f"{events[-1]['ts']!r}:{events[-1]['id']}" if len(rows) > limit else None
+        return {'events': events, 'next_cursor': next_cursor}
+
+    def aggregate(self, bucket=3600, stream=None, start=None, end=None, min_confidence=None):
+        """Event counts per stream and time bucket (bucket in seconds)"""
+        clauses, params = event_filters(stream, start, end, min_confidence)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        bucket = max(1, int(bucket))
+        rows = self._reader().execute(
+            f"SELECT stream, CAST(ts / ? AS INTEGER) * ? AS bucket_start, COUNT(*) AS events, "
+            f"SUM(num_boxes) AS boxes, MAX(max_confidence) AS max_confidence "
+            f"FROM events {where} GROUP BY stream, bucket_start ORDER BY bucket_start, stream",
+            [bucket, bucket] + params).fetchall()
+        return {'bucket_seconds': bucket, 'buckets': [dict(row) for row in rows]}
+
+    def stats(self):
+        return {
+            'events_written': self.events_written,
+            'events_dropped': self.events_dropped,
+            'event_batches': self.batches_written,
+            'event_queue_depth': self.queue.qsize(),
+        }
+
+    def close(self, timeout=5.0):
+        """Flush what's queued and stop the writer"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.writer.join(timeout)
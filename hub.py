@@ -0,0 +1,299 @@
+import asyncio
+import threading
+import time
+
+import cv2
+
+from metrics import STAGE_SECONDS
+from tracing import TRACER
+
+# =========== BROADCAST HUB ===========
+# One hub per source. The source is read, inferred and rendered once, then
+# every MJPEG viewer of that source gets the same encoded bytes. Each viewer
+# just waits for "a newer frame than the one I sent", so a slow client skips
+# frames and never holds up the producer or the other viewers. JPEG encoding
+# happens lazily, once per frame per (quality, width) tier, and only for
+# tiers someone is actually watching.
+#
+# subscribe() is a blocking generator for WSGI servers (one thread per
+# viewer); subscribe_async() is the same feed for asyncio servers, where a
+# viewer is just a coroutine woken by the producer thread.
+#
+# A hub can also feed a clip recorder (see clips.py): then one tier is
+# encoded for every published frame, on the producer thread, and the
+# recorder keeps a view of the same bytes viewers of that tier are sent.
+
+MULTIPART_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+
+
+def multipart_chunk(jpeg_bytes):
+    return MULTIPART_HEADER + jpeg_bytes + b'\r\n'
+
+
+def chunk_jpeg(chunk):
+    """The JPEG inside a multipart chunk, as a view (no copy)"""
+    return memoryview(chunk)[len(MULTIPART_HEADER):len(chunk) - 2]
+
+
+class BroadcastHub:
+    """Publishes rendered frames of one source to any number of MJPEG subscribers
+
+    producer is an optional zero-argument callable returning an iterator of
+    rendered BGR frames; the hub runs it on its own thread while anyone is
+    subscribed. Without one, frames are pushed in with publish(). An
+    idle_timeout of None keeps the producer running with no subscribers.
+    """
+
+    def __init__(self, source_id, producer=None, idle_timeout=5.0, recorder=None, record_tier=(None, None)):
+        self.source_id = source_id
+        self.producer = producer
+        self.idle_timeout = idle_timeout
+        self.recorder = recorder
+        self.record_tier = record_tier
+        self.cond = threading.Condition()
+        self.frame = None
+        self.seq = 0
+        self.encoded = {}
+        self.waiters = []
+        self.subscribers = 0
+        self.closed = False
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.frames_published = 0
+        self.frames_encoded = 0
+        self.frames_sent = 0
+        self.frames_skipped = 0
+
+    def start(self):
+        if self.producer is not None:
+            self.thread = threading.Thread(target=self._run_producer,
+                                           name=f"hub-{self.source_id}", daemon=True)
+            self.thread.start()
+        return self
+
+    @property
+    def running(self):
+        return not self.closed
+
+    def _run_producer(self):
+        TRACER.set_source(self.source_id)
+        frames = self.producer()
+        idle_since = None
+        try:
+            started = time.perf_counter()
+            for image in frames:
+                self.publish(image)
+                # One span per produced frame: capture, inference and drawing, then publishing
+                TRACER.record('frame', started, frame=self.seq)
+                started = time.perf_counter()
+                if self.stop_event.is_set():
+                    break
+                # Nobody watching for a while: stop reading the source
+                if self.subscribers == 0 and self.idle_timeout is not None:
+                    idle_since = idle_since or time.time()
+                    if time.time() - idle_since > self.idle_timeout:
+                        break
+                else:
+                    idle_since = None
+        finally:
+            close = getattr(frames, 'close', None)
+            if close is not None:
+                close()
+            self.close()
+
+    def publish(self, image):
+        """Make image the current frame; encodings of the previous one are dropped"""
+        with self.cond:
+            self.frame = image
+            self.seq += 1
+            self.encoded = {}
+            self.frames_published += 1
+            seq = self.seq
+            self.cond.notify_all()
+            self._wake_waiters()
+        if self.recorder is not None:
+            # Cached under its tier, so viewers at the recording tier reuse this encode
+            self.recorder.add(chunk_jpeg(self.chunk_for(seq, image, *self.record_tier)))
+
+    def close(self):
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify_all()
+            self._wake_waiters()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def _wake_waiters(self):
+        # Called with self.cond held, from whichever thread published
+        for loop, waiter in self.waiters:
+            loop.call_soon_threadsafe(_resolve, waiter)
+        self.waiters = []
+
+    def stop(self, timeout=2.0):
+        self.stop_event.set()
+        self.close()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+    def cached_chunk(self, seq, quality=None, width=None):
+        with self.cond:
+            if seq == self.seq:
+                return self.encoded.get((quality, width))
+        return None
+
+    def chunk_for(self, seq, frame, quality=None, width=None):
+        """Multipart chunk of one frame at one tier, encoded at most once"""
+        tier = (quality, width)
+        chunk = self.cached_chunk(seq, quality, width)
+        if chunk is not None:
+            return chunk
+
+        started = time.perf_counter()
+        image = frame
+        if width and width < frame.shape[1]:
+            height = max(1, int(frame.shape[0] * width / frame.shape[1]))
+            image = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+            TRACER.record('resize', started, source=self.source_id, width=width)
+        encoding = time.perf_counter()
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)] if quality else []
+        ret, buffer = cv2.imencode('.jpg', image, params)
+        chunk = multipart_chunk(buffer.tobytes())
+        STAGE_SECONDS.observe(time.perf_counter() - started, 'encode')
+        TRACER.record('imencode', encoding, source=self.source_id, frame=seq, quality=quality, width=width)
+
+        with self.cond:
+            self.frames_encoded += 1
+            if seq == self.seq:
+                # Another viewer of this tier may have beaten us to it; keep one copy
+                chunk = self.encoded.setdefault(tier, chunk)
+        return chunk
+
+    def subscribe(self, quality=None, width=None):
+        """Generator of multipart chunks; always sends the newest frame available"""
+        with self.cond:
+            self.subscribers += 1
+        last_seq = 0
+        try:
+            while True:
+                with self.cond:
+                    while self.seq == last_seq and not self.closed:
+                        self.cond.wait(1.0)
+                    if self.seq == last_seq:
+                        return
+                    if last_seq:
+                        self.frames_skipped += self.seq - last_seq - 1
+                    seq, frame = self.seq, self.frame
+                last_seq = seq
+                self.frames_sent += 1
+                chunk = self.chunk_for(seq, frame, quality, width)
+                # The server writes the chunk to the socket before asking for the next one
+                sent = time.perf_counter()
+                yield chunk
+                TRACER.record('yield', sent, source=self.source_id, frame=seq, bytes=len(chunk))
+        finally:
+            with self.cond:
+                self.subscribers -= 1
+
+    async def subscribe_async(self, quality=None, width=None, executor=None):
+        """Async generator of multipart chunks; encoding runs on executor"""
+        loop = asyncio.get_running_loop()
+        with self.cond:
+            self.subscribers += 1
+        last_seq = 0
+        try:
+            while True:
+                with self.cond:
+                    if self.seq == last_seq:
+                        if self.closed:
+                            return
+                        waiter = loop.create_future()
+                        self.waiters.append((loop, waiter))
+                    else:
+                        waiter = None
+                        if last_seq:
+                            self.frames_skipped += self.seq - last_seq - 1
+                        seq, frame = self.seq, self.frame
+                if waiter is not None:
+                    await waiter
+                    continue
+                last_seq = seq
+                self.frames_sent += 1
+                chunk = self.cached_chunk(seq, quality, width)
+                if chunk is None:
+                    chunk = await loop.run_in_executor(executor, self.chunk_for, seq, frame, quality, width)
+                sent = time.perf_counter()
+                yield chunk
+                TRACER.record('yield', sent, source=self.source_id, frame=seq, bytes=len(chunk))
+        finally:
+            with self.cond:
+                self.subscribers -= 1
+
+    def stats(self):
+        stats = {
+            'source': self.source_id,
+            'running': self.running,
+            'subscribers': self.subscribers,
+            'frames_published': self.frames_published,
+            'frames_encoded': self.frames_encoded,
+            'frames_sent': self.frames_sent,
+            'frames_skipped': self.frames_skipped,
+        }
+        if self.recorder is not None:
+            stats['clip_buffer'] = self.recorder.stats()
+        return stats
+
+
+def _resolve(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class HubRegistry:
+    """Keeps one live hub per source id"""
+
+    def __init__(self, idle_timeout=5.0, recorder_factory=None, record_tier=(None, None)):
+        self.idle_timeout = idle_timeout
+        # recorder_factory(source_id) -> clip recorder for a new hub, or None
+        self.recorder_factory = recorder_factory
+        self.record_tier = record_tier
+        self.hubs = {}
+        self.lock = threading.Lock()
+
+    def get_or_start(self, source_id, producer=None, keep_alive=False):
+        """Join the running hub of a source, or start one with this producer
+
+        keep_alive starts it without an idle timeout, so the source keeps
+        running (and recording) with nobody watching.
+        """
+        with self.lock:
+            hub = self.hubs.get(source_id)
+            if hub is None or not hub.running:
+                recorder = self.recorder_factory(source_id) if self.recorder_factory else None
+                idle_timeout = None if keep_alive else self.idle_timeout
+                hub = BroadcastHub(source_id, producer, idle_timeout, recorder, self.record_tier).start()
+                self.hubs[source_id] = hub
+            return hub
+
+    def get(self, source_id):
+        with self.lock:
+            hub = self.hubs.get(source_id)
+        return hub if hub is not None and hub.running else None
+
+    def stop(self, source_id):
+        with self.lock:
+            hub = self.hubs.pop(source_id, None)
+        if hub is not None:
+            hub.stop()
+
+    def stop_all(self):
+        with self.lock:
+            hubs = list(self.hubs.values())
+            self.hubs.clear()
+        for hub in hubs:
+            hub.stop()
+
+    def stats(self):
+        with self.lock:
+            return [hub.stats() for hub in self.hubs.values() if hub.running]
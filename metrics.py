@@ -0,0 +1,169 @@
+import threading
+from bisect import bisect_left
+
+# =========== METRICS ===========
+# Hot-path instrumentation in Prometheus text format. Stage timings are
+# observed straight into fixed-bucket histograms: one bisect and one
+# uncontended lock per observation, so it can stay on in production.
+# Everything that already has a counter somewhere (stream stats, queue
+# drops, motion gate skips, hub viewers) is read by collectors at scrape
+# time instead of being double-counted on the hot path.
+
+# Seconds; spans a cheap JPEG encode up to a slow CPU forward pass
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{key}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricFamily:
+    """One metric name with its samples; what collectors return at scrape time"""
+
+    def __init__(self, name, kind, help_text):
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.samples = []
+
+    def add(self, value, **labels):
+        self.samples.append((self.name, labels, value))
+        return self
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples:
+            lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter, optionally split by label values"""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, *labelvalues):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def collect(self):
+        family = MetricFamily(self.name, 'counter', self.help_text)
+        with self.lock:
+            values = list(self.values.items())
+        for labelvalues, value in values:
+            family.add(value, **dict(zip(self.labelnames, labelvalues)))
+        return [family]
+
+
+class Histogram:
+    """Fixed-bucket latency histogram, optionally split by label values"""
+
+    def __init__(self, name, help_text, buckets=STAGE_BUCKETS, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labelvalues)
+            if series is None:
+                # Per-bucket counts (last one is +Inf), then sum
+                series = self.series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def collect(self):
+        family = MetricFamily(self.name, 'histogram', self.help_text)
+        with self.lock:
+            series = [(labelvalues, list(counts), total) for labelvalues, (counts, total) in self.series.items()]
+        for labelvalues, counts, total in series:
+            labels = dict(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                family.samples.append((self.name + '_bucket', dict(labels, le=format_value(float(bound))), cumulative))
+            family.samples.append((self.name + '_sum', labels, total))
+            family.samples.append((self.name + '_count', labels, cumulative))
+        return [family]
+
+
+class MetricsRegistry:
+    """Registered metrics plus scrape-time collectors, rendered as Prometheus text"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """collector() returns a list of MetricFamily, called on every scrape"""
+        self.collectors.append(collector)
+        return collector
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            for family in metric.collect():
+                lines.extend(family.render())
+        for collector in self.collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"[ERROR] Metrics collector failed: {e}")
+                continue
+            for family in families:
+                if family.samples:
+                    lines.extend(family.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'nexus_stage_seconds', 'Time spent in each stage of the detection pipeline', labelnames=('stage',)))
+BATCH_SIZE = REGISTRY.register(Histogram(
+    'nexus_inference_batch_size', 'Frames per forward pass', buckets=(1, 2, 4, 8, 16, 32)))
+ALERTS = REGISTRY.register(Counter('nexus_alerts_total', 'Frames that raised a threat alert'))
+DECODE_SECONDS = REGISTRY.register(Histogram(
+    'nexus_decode_seconds', 'Time to reach and decode one sampled video frame, per sampling policy',
+    labelnames=('policy',)))
+DECODE_FRAMES = REGISTRY.register(Counter(
+    'nexus_decode_frames_total', 'Video frames decoded, grabbed without retrieve, or seeks made, per sampling policy',
+    labelnames=('policy', 'op')))
+DETECT_BATCH_SIZE = REGISTRY.register(Histogram(
+    'nexus_detect_batch_size', 'Images from concurrent /detect requests coalesced into one forward pass',
+    buckets=(1, 2, 4, 8, 16, 32)))
+DETECT_WAIT_SECONDS = REGISTRY.register(Histogram(
+    'nexus_detect_wait_seconds', 'Time a /detect image waited for its batch to start'))
+ADMISSION_WAIT_SECONDS = REGISTRY.register(Histogram(
+    'nexus_admission_wait_seconds', 'Time an inference call waited for a slot, per priority class',
+    labelnames=('priority',)))
+ADMISSION_REJECTED = REGISTRY.register(Counter(
+    'nexus_admission_rejected_total', 'Requests turned away with 503 under load, per priority class',
+    labelnames=('priority',)))
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
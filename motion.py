@@ -0,0 +1,95 @@
+import time
+
+import cv2
+import numpy as np
+
+# =========== MOTION GATE ===========
+# A downscaled grayscale copy of each frame is compared against the frame the
+# network last ran on. If not enough of it changed, the previous detections
+# are reused and the forward pass is skipped. Comparing against the last
+# *inferred* frame (not the previous frame) means slow drift still adds up
+# to a re-check eventually, and max_interval forces one regardless.
+
+
+class MotionGate:
+    """Decides per frame whether the scene changed enough to re-run detection
+
+    method is 'diff' (frame differencing) or 'mog2' (background subtraction).
+    A frame counts as changed when more than min_changed_ratio of its pixels
+    differ by more than pixel_threshold grey levels (or are foreground).
+    """
+
+    def __init__(self, method='diff', pixel_threshold=25, min_changed_ratio=0.005,
+                 max_interval=2.0, downscale=(160, 120)):
+        if method not in ('diff', 'mog2'):
+            raise ValueError(f"Unknown motion method '{method}'")
+        self.method = method
+        self.pixel_threshold = pixel_threshold
+        self.min_changed_ratio = min_changed_ratio
+        self.max_interval = max_interval
+        self.downscale = downscale
+        self.reference = None
+        self.pending = None
+        self.subtractor = None
+        if method == 'mog2':
+            self.subtractor = cv2.createBackgroundSubtractorMOG2(history=200, detectShadows=False)
+        self.last_inference_time = 0.0
+        self.last_detections = None
+        self.last_changed_ratio = 0.0
+        self.inferences_run = 0
+        self.inferences_skipped = 0
+
+    def _small_gray(self, frame):
+        small = cv2.resize(frame, self.downscale, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def changed_ratio(self, gray):
+        if self.method == 'mog2':
+            mask = self.subtractor.apply(gray)
+            return np.count_nonzero(mask) / mask.size
+        if self.reference is None:
+            return 1.0
+        diff = cv2.absdiff(gray, self.reference)
+        return np.count_nonzero(diff > self.pixel_threshold) / diff.size
+
+    def should_infer(self, frame, now=None):
+        """True when the frame differs enough (or it's been too long) to run the net
+
+        The frame only becomes the new reference once record() is called
+        with its detections, so an inference that fails leaves the gate as
+        it was and the next frame is compared against the old reference.
+        """
+        now = time.time() if now is None else now
+        gray = self._small_gray(frame)
+        self.last_changed_ratio = self.changed_ratio(gray)
+        if (self.last_detections is None
+                or self.last_changed_ratio > self.min_changed_ratio
+                or now - self.last_inference_time >= self.max_interval):
+            self.pending = gray
+            return True
+        return False
+
+    def detect(self, frame, infer, now=None):
+        """Return infer(frame), or the last detections if the scene is static"""
+        if self.should_infer(frame, now):
+            self.record(infer(frame), now)
+            return self.last_detections
+        self.inferences_skipped += 1
+        return self.last_detections
+
+    def record(self, detections, now=None):
+        """Remember detections from an inference the caller ran itself"""
+        if self.pending is not None:
+            self.reference, self.pending = self.pending, None
+        self.last_detections = detections
+        self.last_inference_time = time.time() if now is None else now
+        self.inferences_run += 1
+
+    def stats(self):
+        total = self.inferences_run + self.inferences_skipped
+        return {
+            'inferences_run': self.inferences_run,
+            'inferences_skipped': self.inferences_skipped,
+            'skip_ratio': round(self.inferences_skipped / total, 3) if total else 0.0,
+        }
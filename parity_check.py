@@ -0,0 +1,130 @@
+"""Compare inference backends on the sample media in data/
+
+Runs every backend on the same preprocessed frames (the bundled images plus
+frames sampled from data/ak47.mp4) and reports how closely the outputs and
+the final boxes agree with the first backend, plus per-frame latency.
+
+    python parity_check.py --backends opencv onnxruntime onnx_int8 --onnx-model yolov3.onnx
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from backends import BACKENDS, create_backend
+from decoding import detect_boxes, split_batch_outputs
+from preprocess import BlobBuilder
+from tracker import iou_matrix
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def sample_frames(data_dir, video_frames):
+    """The bundled images plus evenly spaced frames of the bundled videos"""
+    frames = []
+    for pattern in ('*.png', '*.jpg', '*.jpeg', '*.webp'):
+        for path in sorted(glob.glob(os.path.join(data_dir, pattern))):
+            image = cv2.imread(path)
+            if image is not None:
+                frames.append((os.path.basename(path), image))
+    for path in sorted(glob.glob(os.path.join(data_dir, '*.mp4'))):
+        cap = cv2.VideoCapture(path)
+        count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        for index in np.linspace(0, max(count - 1, 0), video_frames).astype(int):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+            success, frame = cap.read()
+            if success:
+                frames.append((f"{os.path.basename(path)}#{index}", frame))
+        cap.release()
+    return frames
+
+
+def run_backend(backend, frames, input_size):
+    builder = BlobBuilder()
+    outputs, detections, latencies = [], [], []
+    for _, frame in frames:
+        blob, _ = builder.build([frame], input_size)
+        start = time.perf_counter()
+        outs = backend.forward(blob)
+        latencies.append(time.perf_counter() - start)
+        outs = split_batch_outputs(outs, 1)[0]
+        height, width = frame.shape[:2]
+        outputs.append(np.concatenate([out.reshape(-1, out.shape[-1]) for out in outs]))
+        detections.append(detect_boxes(outs, width, height))
+    return outputs, detections, latencies
+
+
+def compare(reference, candidate):
+    """(max abs output diff, box match ratio, mean confidence diff of matched boxes)"""
+    ref_outputs, ref_detections, _ = reference
+    outputs, detections, _ = candidate
+    max_diff = max(float(np.abs(a[:, 4:] - b[:, 4:]).max()) if a.shape == b.shape else float('inf')
+                   for a, b in zip(ref_outputs, outputs))
+    matched = total = 0
+    confidence_diffs = []
+    for (ref_boxes, ref_conf, _), (boxes, conf, _) in zip(ref_detections, detections):
+        total += len(ref_boxes)
+        if len(ref_boxes) == 0 or len(boxes) == 0:
+            continue
+        ious = iou_matrix(ref_boxes, boxes)
+        best = ious.argmax(axis=1)
+        # Identical boxes count even when degenerate (zero area -> IoU 0)
+        identical = (ref_boxes[:, None] == boxes[None]).all(axis=2)
+        best = np.where(identical.any(axis=1), identical.argmax(axis=1), best)
+        hits = (ious[np.arange(len(ref_boxes)), best] >= 0.5) | identical.any(axis=1)
+        matched += int(hits.sum())
+        confidence_diffs.extend(np.abs(ref_conf[hits] - conf[best[hits]]).tolist())
+    match_ratio = matched / total if total else 1.0
+    mean_conf_diff = float(np.mean(confidence_diffs)) if confidence_diffs else 0.0
+    return max_diff, match_ratio, mean_conf_diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=['opencv', 'onnxruntime'],
+                        help="Backends to compare; the first one is the reference")
+    parser.add_argument('--config', default="yolov3_testing.cfg")
+    parser.add_argument('--weights', default="yolov3_training_2000.weights")
+    parser.add_argument('--onnx-model', default="yolov3_training_2000.onnx")
+    parser.add_argument('--int8-model', default=None)
+    parser.add_argument('--input-size', type=int, default=416)
+    parser.add_argument('--video-frames', type=int, default=8, help="Frames sampled per video")
+    parser.add_argument('--min-match', type=float, default=0.9,
+                        help="Fail if a backend matches fewer reference boxes than this")
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    args = parser.parse_args()
+
+    frames = sample_frames(args.data_dir, args.video_frames)
+    if not frames:
+        sys.exit(f"[ERROR] No sample media found in {args.data_dir}")
+    print(f"[PARITY] {len(frames)} frames from {args.data_dir} at {args.input_size}x{args.input_size}")
+
+    results = {}
+    for name in args.backends:
+        backend = create_backend(name, config_path=args.config, weights_path=args.weights,
+                                 onnx_model_path=args.onnx_model, int8_model_path=args.int8_model)
+        backend.forward(BlobBuilder().build([frames[0][1]], args.input_size)[0])  # warm up
+        results[name] = run_backend(backend, frames, args.input_size)
+
+    reference = args.backends[0]
+    failed = False
+    print(f"{'backend':<14}{'ms/frame':>10}{'boxes':>8}{'max diff':>10}{'matched':>9}{'conf diff':>11}")
+    for name in args.backends:
+        _, detections, latencies = results[name]
+        boxes = sum(len(d[0]) for d in detections)
+        max_diff, match_ratio, conf_diff = compare(results[reference], results[name])
+        print(f"{name:<14}{np.mean(latencies) * 1000:>10.1f}{boxes:>8}{max_diff:>10.4f}"
+              f"{match_ratio:>9.1%}{conf_diff:>11.4f}")
+        if match_ratio < args.min_match:
+            failed = True
+
+    if failed:
+        sys.exit(f"[FAIL] A backend matched fewer than {args.min_match:.0%} of the {reference} boxes")
+
+
+if __name__ == '__main__':
+    main()
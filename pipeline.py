@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import deque
+
+from metrics import STAGE_SECONDS
+from tracing import TRACER
+
+# =========== PIPELINED LIVE MODE ===========
+# Capture, inference and encoding each run on their own thread and hand work
+# over through small bounded queues. When a stage falls behind, the queue in
+# front of it drops its oldest item instead of growing, so the stream always
+# shows the most recent frame and latency stays flat under load.
+
+
+class DropOldestQueue:
+    """Bounded FIFO that discards the oldest item when a new one doesn't fit"""
+
+    def __init__(self, maxsize=1):
+        self.maxsize = max(1, int(maxsize))
+        self.items = deque()
+        self.dropped = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def put(self, item):
+        with self.cond:
+            if len(self.items) >= self.maxsize:
+                self.items.popleft()
+                self.dropped += 1
+            self.items.append(item)
+            self.cond.notify()
+
+    def get(self, timeout=None):
+        """Return the oldest item, or None on timeout or once the queue is closed"""
+        with self.cond:
+            if not self.items and not self.closed:
+                self.cond.wait(timeout)
+            if not self.items:
+                return None
+            return self.items.popleft()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def __len__(self):
+        return len(self.items)
+
+
+class LivePipeline:
+    """Capture -> inference -> encode stages for a single live source
+
+    process(frame) returns the annotated frame and encode(frame) returns the
+    bytes to hand to the client. Each stage only ever works on the newest
+    item it can get, so a slow stage costs frames, not latency.
+    """
+
+    def __init__(self, cap, process, encode, capture_queue_size=1,
+                 encode_queue_size=1, output_queue_size=2, source_id=None):
+        self.cap = cap
+        self.source_id = source_id
+        self.process = process
+        self.encode = encode
+        self.capture_queue = DropOldestQueue(capture_queue_size)
+        self.encode_queue = DropOldestQueue(encode_queue_size)
+        self.output_queue = DropOldestQueue(output_queue_size)
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.frames_captured = 0
+        self.frames_processed = 0
+        self.frames_encoded = 0
+
+    def start(self):
+        for name, target in (('capture', self._capture_loop),
+                             ('inference', self._inference_loop),
+                             ('encode', self._encode_loop)):
+            thread = threading.Thread(target=target, name=f"pipeline-{name}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self, timeout=2.0):
+        self.stop_event.set()
+        for q in (self.capture_queue, self.encode_queue, self.output_queue):
+            q.close()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+        self.threads = []
+
+    @property
+    def running(self):
+        return not self.stop_event.is_set()
+
+    def _capture_loop(self):
+        TRACER.set_source(self.source_id)
+        while not self.stop_event.is_set():
+            started = time.perf_counter()
+            success, frame = self.cap.read()
+            if not success:
+                break
+            STAGE_SECONDS.observe(time.perf_counter() - started, 'capture')
+            TRACER.record('capture', started)
+            self.frames_captured += 1
+            # Tag each frame with its capture time so latency can be measured
+            self.capture_queue.put((time.time(), frame))
+        self.stop_event.set()
+        self.capture_queue.close()
+
+    def _inference_loop(self):
+        TRACER.set_source(self.source_id)
+        while not self.stop_event.is_set() or len(self.capture_queue):
+            item = self.capture_queue.get(timeout=0.5)
+            if item is None:
+                if self.capture_queue.closed:
+                    break
+                continue
+            captured_at, frame = item
+            self.encode_queue.put((captured_at, self.process(frame)))
+            self.frames_processed += 1
+        self.encode_queue.close()
+
+    def _encode_loop(self):
+        TRACER.set_source(self.source_id)
+        while True:
+            item = self.encode_queue.get(timeout=0.5)
+            if item is None:
+                if self.encode_queue.closed:
+                    break
+                continue
+            captured_at, frame = item
+            self.output_queue.put((captured_at, self.encode(frame)))
+            self.frames_encoded += 1
+        self.output_queue.close()
+
+    def frames(self):
+        """Yield encoded frames as they become available until the pipeline stops"""
+        while True:
+            item = self.output_queue.get(timeout=0.5)
+            if item is None:
+                if self.output_queue.closed:
+                    return
+                continue
+            yield item[1]
+
+    def stats(self):
+        return {
+            'frames_captured': self.frames_captured,
+            'frames_processed': self.frames_processed,
+            'frames_encoded': self.frames_encoded,
+            'dropped_capture': self.capture_queue.dropped,
+            'dropped_encode': self.encode_queue.dropped,
+            'dropped_output': self.output_queue.dropped,
+            'capture_queue_depth': len(self.capture_queue),
+            'encode_queue_depth': len(self.encode_queue),
+            'output_queue_depth': len(self.output_queue),
+        }
@@ -0,0 +1,105 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from tracing import TRACER
+
+# =========== PREPROCESSING ===========
+# Frames go from their native decoded size to the network blob in a single
+# resize, written into float32 buffers that are allocated once per
+# (batch size, input size) and reused on every call. Buffers are kept per
+# thread, so concurrent request threads never write into a blob that another
+# thread has handed to the net.
+
+BLOB_SCALE = 0.00392  # same scale factor the original blobFromImage call used
+
+
+class BlobBuilder:
+    """Builds NCHW RGB float32 blobs from BGR frames into reused buffers
+
+    By default frames are stretched to the square input, like
+    blobFromImage(crop=False). With letterbox=True the aspect ratio is kept
+    and the borders are filled with pad_value; unletterbox() maps the
+    network outputs back so decoding works on the original frame.
+    """
+
+    def __init__(self, letterbox=False, pad_value=0.5):
+        self.letterbox = letterbox
+        self.pad_value = pad_value
+        self.local = threading.local()
+
+    def _blob_buffer(self, count, size):
+        buffers = getattr(self.local, 'blobs', None)
+        if buffers is None:
+            buffers = self.local.blobs = {}
+        blob = buffers.get((count, size))
+        if blob is None:
+            blob = buffers[(count, size)] = np.empty((count, 3, size, size), dtype=np.float32)
+        return blob
+
+    def _resize_buffer(self, width, height):
+        buffers = getattr(self.local, 'resized', None)
+        if buffers is None:
+            buffers = self.local.resized = {}
+        resized = buffers.get((width, height))
+        if resized is None:
+            # A stream's frames all have one size, so this settles after the first frame
+            if len(buffers) > 16:
+                buffers.clear()
+            resized = buffers[(width, height)] = np.empty((height, width, 3), dtype=np.uint8)
+        return resized
+
+    def layout(self, width, height, size):
+        """(pad_x, pad_y, content_width, content_height) of a frame inside the blob"""
+        if not self.letterbox:
+            return 0, 0, size, size
+        scale = min(size / width, size / height)
+        content_width = max(1, int(round(width * scale)))
+        content_height = max(1, int(round(height * scale)))
+        return (size - content_width) // 2, (size - content_height) // 2, content_width, content_height
+
+    def build(self, images, size):
+        """Return (blob, layouts) for a list of BGR frames at a square input size"""
+        blob = self._blob_buffer(len(images), size)
+        layouts = []
+        for i, image in enumerate(images):
+            height, width = image.shape[:2]
+            pad_x, pad_y, content_width, content_height = self.layout(width, height, size)
+            if self.letterbox:
+                blob[i].fill(self.pad_value)
+            resized = self._resize_buffer(content_width, content_height)
+            resizing = time.perf_counter()
+            cv2.resize(image, (content_width, content_height), dst=resized,
+                       interpolation=cv2.INTER_LINEAR)
+            TRACER.record('resize', resizing, size=size)
+            # BGR -> RGB and scaling in one pass per channel, straight into the blob
+            for channel in range(3):
+                np.multiply(resized[:, :, 2 - channel], BLOB_SCALE,
+                            out=blob[i, channel, pad_y:pad_y + content_height, pad_x:pad_x + content_width],
+                            casting='unsafe')
+            layouts.append((pad_x, pad_y, content_width, content_height))
+        return blob, layouts
+
+
+def unletterbox(outs, layout, size):
+    """Rewrite YOLO output boxes (in place) from blob-relative to frame-relative units"""
+    pad_x, pad_y, content_width, content_height = layout
+    if content_width == size and content_height == size:
+        return outs
+    for out in outs:
+        out[:, 0] = (out[:, 0] * size - pad_x) / content_width
+        out[:, 1] = (out[:, 1] * size - pad_y) / content_height
+        out[:, 2] *= size / content_width
+        out[:, 3] *= size / content_height
+    return outs
+
+
+def scale_boxes(boxes, from_size, to_size):
+    """Map int [x, y, w, h] boxes from one frame resolution to another"""
+    if tuple(from_size) == tuple(to_size) or len(boxes) == 0:
+        return boxes
+    sx = to_size[0] / from_size[0]
+    sy = to_size[1] / from_size[1]
+    return np.trunc(boxes * np.array([sx, sy, sx, sy], dtype=np.float32)).astype(np.int32)
@@ -0,0 +1,104 @@
+import threading
+
+# =========== ADAPTIVE INPUT RESOLUTION ===========
+# YOLOv3 accepts any input size that is a multiple of 32, and forward cost
+# grows roughly with the input area. The controller keeps a smoothed latency
+# per input size and steps down a level when the current one is over budget,
+# or up a level when the next size (measured, or scaled from this one by
+# area) still fits with room to spare. Separate down/up thresholds plus a
+# cooldown keep it from flapping. Latencies should be forward-pass time
+# only: time spent queuing for the net says nothing about the input size.
+# Estimates of other sizes go stale (the load may have changed since), so
+# past max_age frames the scaled prediction is used again.
+
+
+class ResolutionController:
+    """Moves the network input size between levels to meet a latency budget
+
+    Give either target_latency (seconds per frame) or target_fps. A step
+    down happens when the smoothed latency exceeds high_water * budget; a
+    step up when the latency predicted for the next level is below
+    low_water * budget. At least cooldown frames pass between changes.
+    """
+
+    def __init__(self, levels=(256, 320, 416, 608), initial=416, target_latency=None,
+                 target_fps=None, high_water=1.0, low_water=0.7, smoothing=0.2, cooldown=10, max_age=300):
+        self.levels = sorted(int(level) for level in levels)
+        for level in self.levels:
+            if level % 32 != 0:
+                raise ValueError(f"Input size {level} is not a multiple of 32")
+        if target_latency is None:
+            target_latency = 1.0 / target_fps if target_fps else 0.2
+        self.budget = float(target_latency)
+        self.high_water = high_water
+        self.low_water = low_water
+        self.smoothing = smoothing
+        self.cooldown = cooldown
+        self.max_age = max_age
+        self.index = min(range(len(self.levels)), key=lambda i: abs(self.levels[i] - initial))
+        self.latencies = {}
+        self.measured_at = {}
+        self.frames = 0
+        self.frames_since_change = 0
+        self.changes = 0
+        self.lock = threading.Lock()
+
+    @property
+    def input_size(self):
+        return self.levels[self.index]
+
+    @property
+    def latency(self):
+        """Smoothed latency at the current input size, or None before the first measurement"""
+        return self.latencies.get(self.input_size)
+
+    def record(self, latency, input_size=None):
+        """Feed one measured forward-pass latency (seconds) at input_size and maybe change level
+
+        input_size defaults to the current level. A measurement at another
+        size only updates that size's estimate.
+        """
+        with self.lock:
+            size = self.input_size if input_size is None else int(input_size)
+            previous = self.latencies.get(size)
+            self.latencies[size] = latency if previous is None else previous + self.smoothing * (latency - previous)
+            self.frames += 1
+            self.measured_at[size] = self.frames
+            if size != self.input_size:
+                return self.input_size
+            self.frames_since_change += 1
+            if self.frames_since_change < self.cooldown:
+                return self.input_size
+
+            current = self.latencies[size]
+            if current > self.high_water * self.budget and self.index > 0:
+                self._move(-1)
+            elif self.index < len(self.levels) - 1:
+                if self._predict(self.index + 1) < self.low_water * self.budget:
+                    self._move(1)
+            return self.input_size
+
+    def _predict(self, index):
+        """Latency expected at levels[index]: its own recent estimate, else the current one scaled by area"""
+        size = self.levels[index]
+        if size in self.latencies and self.frames - self.measured_at[size] <= self.max_age:
+            return self.latencies[size]
+        return self.latencies[self.input_size] * (size / self.input_size) ** 2
+
+    def _move(self, step):
+        # Seed the new size's estimate instead of waiting for it to converge
+        size = self.levels[self.index + step]
+        self.latencies[size] = self._predict(self.index + step)
+        self.measured_at[size] = self.frames
+        self.index += step
+        self.frames_since_change = 0
+        self.changes += 1
+
+    def stats(self):
+        latency = self.latency
+        return {
+            'input_size': self.input_size,
+            'latency_ms': round(latency * 1000, 1) if latency is not None else None,
+            'latency_budget_ms': round(self.budget * 1000, 1),
+            'resolution_changes': self.changes,
+        }
@@ -1,4 +1,6 @@
-from app import app
+from app import app, start_warmup
 
 if __name__ == '__main__':
+    if app.config['WARMUP_ON_START']:
+        start_warmup()
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
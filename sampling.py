@@ -0,0 +1,256 @@
+import time
+from bisect import bisect_right
+
+import cv2
+
+from metrics import DECODE_FRAMES, DECODE_SECONDS, STAGE_SECONDS
+from tracing import TRACER
+
+# =========== VIDEO SAMPLING ===========
+# Analysis rarely needs every frame of a recording. A VideoSource walks a
+# file according to a sampling policy and gets to each sampled frame the
+# cheapest way it can:
+#
+#   - grab() the frames in between: skips the BGR conversion and copy of
+#     retrieve(), but the codec still decodes them (inter frames need their
+#     references), so it only saves ~10%.
+#   - seek: OpenCV's FFmpeg backend seeks SEEK_PREROLL frames before the
+#     target, jumps back to the keyframe before that, and decodes forward.
+#     That only beats grabbing when the keyframe is past the current
+#     position, i.e. when the jump skips at least one whole GOP.
+#
+# Keyframe positions come from one pass over the container in raw mode
+# (packets only, no decoding), which is what makes the choice exact.
+#
+# Policies, written as comma-separated key=value pairs:
+#   all               every frame (the default)
+#   every=5           every 5th frame
+#   hz=2              2 frames per second of video
+#   keyframes         one frame per GOP, the cheapest one to decode
+#   start=60,end=120  any of the above, limited to a time window (seconds)
+
+SEEK_PREROLL = 16
+# Without keyframe positions, only seek across gaps longer than this (frames)
+BLIND_SEEK_GAP = 250
+
+
+def scan_keyframes(path):
+    """Indices of the keyframes of a video, from its packets alone; None if unavailable"""
+    if not hasattr(cv2, 'CAP_PROP_LRF_HAS_KEY_FRAME'):
+        return None
+    cap = cv2.VideoCapture(path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    if not cap.isOpened():
+        return None
+    keyframes = []
+    index = 0
+    while cap.grab():
+        if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+            keyframes.append(index)
+        index += 1
+    cap.release()
+    return keyframes or None
+
+
+def keyframe_targets(keyframes):
+    """One frame per GOP, picked from the keyframe positions alone so every shard agrees
+
+    That is the keyframe itself when reading on from the previous sample is
+    cheap, else the first frame a seek reaches without decoding the GOP before.
+    """
+    targets = []
+    for i, keyframe in enumerate(keyframes):
+        previous = targets[-1] if targets else -1
+        if keyframe - previous - 1 <= SEEK_PREROLL:
+            targets.append(keyframe)
+        else:
+            # A seek lands SEEK_PREROLL frames early; aim past that so it starts at this keyframe
+            target = keyframe + SEEK_PREROLL
+            if i + 1 < len(keyframes):
+                target = min(target, keyframes[i + 1] - 1)
+            targets.append(target)
+    return targets
+
+
+class SamplingPolicy:
+    """Which frames of a video to analyze"""
+
+    MODES = ('all', 'every', 'hz', 'keyframes')
+
+    def __init__(self, mode='all', every=1, hz=None, start=None, end=None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown sampling mode: {mode}")
+        if mode == 'every' and int(every) < 1:
+            raise ValueError('every must be at least 1')
+        if mode == 'hz' and not (hz and float(hz) > 0):
+            raise ValueError('hz must be positive')
+        self.mode = mode
+        self.every = int(every)
+        self.hz = float(hz) if hz else None
+        self.start = float(start) if start not in (None, '') else None
+        self.end = float(end) if end not in (None, '') else None
+
+    @classmethod
+    def parse(cls, spec):
+        """'hz=2,start=60' -> SamplingPolicy; None or '' means every frame"""
+        if isinstance(spec, cls):
+            return spec
+        options = {'mode': 'all'}
+        for part in (spec or '').split(','):
+            part = part.strip()
+            if not part:
+                continue
+            key, _, value = part.partition('=')
+            key = key.strip().lower()
+            if key in ('all', 'keyframes'):
+                options['mode'] = key
+            elif key in ('every', 'hz'):
+                options['mode'] = key
+                options[key] = value
+            elif key in ('start', 'end'):
+                options[key] = value
+            else:
+                raise ValueError(f"Unknown sampling option: {key}")
+        return cls(**options)
+
+    @property
+    def name(self):
+        """Label of the policy without its time window, for metrics"""
+        if self.mode == 'every':
+            return f"every={self.every}"
+        if self.mode == 'hz':
+            return f"hz={self.hz:g}"
+        return self.mode
+
+    @property
+    def needs_keyframes(self):
+        return self.mode != 'all' or self.start is not None
+
+    def __str__(self):
+        window = ''.join(f",{key}={value:g}" for key, value in (('start', self.start), ('end', self.end))
+                         if value is not None)
+        return self.name + window
+
+
+class VideoSource:
+    """Frames of a video file picked by a sampling policy, decoding as little as it can
+
+    Iterating yields (frame_index, timestamp_seconds, frame). start_frame /
+    end_frame further limit it to a frame range (for sharded analysis).
+    """
+
+    def __init__(self, path, policy=None, start_frame=0, end_frame=None, keyframes=None):
+        self.path = path
+        self.policy = SamplingPolicy.parse(policy)
+        self.cap = cv2.VideoCapture(path)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 25.0
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        # Only the keyframes policy scans here; shards get the index from their
+        # parent, and without one seeks fall back to the BLIND_SEEK_GAP rule
+        if keyframes is None and self.policy.needs_keyframes:
+            keyframes = scan_keyframes(path)
+        self.keyframes = keyframes
+        if self.policy.mode == 'keyframes' and not keyframes:
+            print(f"[WARNING] No keyframe index for {path}; sampling once per second instead")
+            self.policy = SamplingPolicy('hz', hz=1, start=self.policy.start, end=self.policy.end)
+
+        # Strides count from the start of the window, so shards of one video sample in step
+        self.origin = int(round(self.policy.start * self.fps)) if self.policy.start else 0
+        self.first = max(start_frame, self.origin)
+        ends = [end for end in (end_frame, int(round(self.policy.end * self.fps)) if self.policy.end else None)
+                if end is not None]
+        self.last = min(ends) if ends else None
+        self.position = 0
+
+        self.frames_sampled = 0
+        self.frames_decoded = 0
+        self.frames_grabbed = 0
+        self.frames_seeked_over = 0
+        self.seeks = 0
+        self.decode_seconds = 0.0
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def _targets(self):
+        policy = self.policy
+        if policy.mode == 'all':
+            index = self.first
+            while True:
+                yield index
+                index += 1
+        elif policy.mode == 'every':
+            index = self.origin + -(-(self.first - self.origin) // policy.every) * policy.every
+            while True:
+                yield index
+                index += policy.every
+        elif policy.mode == 'hz':
+            step = self.fps / policy.hz
+            n = int((self.first - self.origin) / step)
+            while True:
+                index = self.origin + int(round(n * step))
+                if index >= self.first:
+                    yield index
+                n += 1
+        else:
+            for target in keyframe_targets(self.keyframes):
+                if target >= self.first:
+                    yield target
+
+    def _seek_pays_off(self, target):
+        if self.keyframes is None:
+            return target - self.position > BLIND_SEEK_GAP
+        # The keyframe a seek to target really starts decoding from
+        i = bisect_right(self.keyframes, max(target - SEEK_PREROLL, 0)) - 1
+        return i >= 0 and self.keyframes[i] > self.position
+
+    def __iter__(self):
+        label = self.policy.name
+        for target in self._targets():
+            if self.last is not None and target >= self.last:
+                break
+            if target < self.position:
+                continue
+            started = time.perf_counter()
+            if target > self.position:
+                if self._seek_pays_off(target):
+                    self.cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+                    self.seeks += 1
+                    self.frames_seeked_over += target - self.position
+                    DECODE_FRAMES.inc(1, label, 'seek')
+                else:
+                    skipped = 0
+                    while self.position + skipped < target and self.cap.grab():
+                        skipped += 1
+                    self.frames_grabbed += skipped
+                    DECODE_FRAMES.inc(skipped, label, 'grabbed')
+                    if self.position + skipped < target:
+                        break
+                self.position = target
+            success, frame = self.cap.read()
+            elapsed = time.perf_counter() - started
+            self.decode_seconds += elapsed
+            if not success:
+                break
+            self.position += 1
+            self.frames_decoded += 1
+            self.frames_sampled += 1
+            DECODE_FRAMES.inc(1, label, 'decoded')
+            DECODE_SECONDS.observe(elapsed, label)
+            STAGE_SECONDS.observe(elapsed, 'capture')
+            TRACER.record('capture', started, started + elapsed, frame=target)
+            yield target, target / self.fps, frame
+
+    def release(self):
+        self.cap.release()
+
+    def stats(self):
+        return {
+            'policy': str(self.policy),
+            'frames_sampled': self.frames_sampled,
+            'frames_decoded': self.frames_decoded,
+            'frames_grabbed': self.frames_grabbed,
+            'frames_seeked_over': self.frames_seeked_over,
+            'seeks': self.seeks,
+            'decode_seconds': round(self.decode_seconds, 4),
+            'decode_ms_per_sample': round(1000 * self.decode_seconds / max(self.frames_sampled, 1), 3),
+        }
@@ -0,0 +1,168 @@
+import threading
+import time
+
+# =========== DETECTION SESSIONS ===========
+# Every running source (the camera, a video file) is a DetectionSession that
+# owns its capture, its per-source components (motion gate, tracker,
+# resolution controller) and its overlay state, so two feeds never share a
+# threat counter or a scan line and stopping one leaves the others running.
+#
+# The session's frames are produced by run() on its hub's thread. stop()
+# sets an event that loop checks between frames, joins that thread and
+# releases the capture once the loop is out of it; when stop() returns the
+# source is closed (unless a camera read is stuck past the timeout, in which
+# case the loop releases it as soon as the read returns).
+
+
+class Overlay:
+    """Per-source state of the rendered overlay: scan line, threat counter, last alert"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.scan_line_pos = 0
+        self.threat_count = 0
+        self.last_detection_time = 0.0
+
+    def advance_scan_line(self, height, step=5):
+        with self.lock:
+            self.scan_line_pos = (self.scan_line_pos + step) % height
+            return self.scan_line_pos
+
+    def record(self, new_threats, detected, now=None):
+        """Count one rendered frame; returns (threat_count, seconds since the last detection)"""
+        now = time.time() if now is None else now
+        with self.lock:
+            self.threat_count += new_threats
+            if detected:
+                self.last_detection_time = now
+            return self.threat_count, now - self.last_detection_time
+
+
+class DetectionSession:
+    """One running source with its own capture, components, counters and overlay"""
+
+    def __init__(self, source_id, motion_gate=None, tracker=None, controller=None, zones=None,
+                 priority=None):
+        self.source_id = source_id
+        self.motion_gate = motion_gate
+        self.tracker = tracker
+        self.controller = controller
+        self.zones = zones
+        self.priority = priority
+        self.overlay = Overlay()
+        self.capture = None
+        self.pipeline = None
+        self.video_source = None
+        self.stop_event = threading.Event()
+        self.finished = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.frames_processed = 0
+        self.started_at = time.time()
+
+    @property
+    def active(self):
+        return not self.stop_event.is_set()
+
+    def open(self, capture):
+        """Take ownership of a capture; it is released when the session ends"""
+        with self.lock:
+            self.capture = capture
+        return capture
+
+    def run(self, frames):
+        """Yield frames until they run out or stop() is called, then clean up on this thread"""
+        self.thread = threading.current_thread()
+        try:
+            for frame in frames:
+                if self.stop_event.is_set():
+                    break
+                self.frames_processed += 1
+                yield frame
+        finally:
+            close = getattr(frames, 'close', None)
+            if close is not None:
+                close()
+            self.stop_event.set()
+            self.release()
+            self.finished.set()
+
+    def wait(self, seconds):
+        """Sleep between frames; True when the session was stopped meanwhile"""
+        return self.stop_event.wait(seconds)
+
+    def stop(self, timeout=2.0):
+        """Signal the producing loop, wait for it to exit and release the capture"""
+        self.stop_event.set()
+        if self.thread is None:
+            self.release()
+        elif self.thread is not threading.current_thread():
+            self.finished.wait(timeout)
+        return self.finished.is_set() or self.thread is None
+
+    def release(self):
+        with self.lock:
+            capture, self.capture = self.capture, None
+        if capture is not None:
+            capture.release()
+
+    def stats(self):
+        stats = {
+            'source': self.source_id,
+            'priority': self.priority,
+            'detection_active': self.active,
+            'threat_count': self.overlay.threat_count,
+            'frames_processed': self.frames_processed,
+            'uptime': round(time.time() - self.started_at, 1),
+        }
+        if self.motion_gate is not None:
+            stats.update(self.motion_gate.stats())
+        if self.tracker is not None:
+            stats.update(self.tracker.stats())
+        if self.controller is not None:
+            stats.update(self.controller.stats())
+        if self.video_source is not None:
+            stats['video_decode'] = self.video_source.stats()
+        if self.pipeline is not None and self.pipeline.running:
+            stats['pipeline'] = self.pipeline.stats()
+        return stats
+
+
+class SessionRegistry:
+    """The running sessions, by source id"""
+
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def add(self, session):
+        with self.lock:
+            self.sessions[session.source_id] = session
+        return session
+
+    def discard(self, session):
+        """Forget a session that ended, unless a newer one took its source id"""
+        with self.lock:
+            if self.sessions.get(session.source_id) is session:
+                del self.sessions[session.source_id]
+
+    def get(self, source_id):
+        with self.lock:
+            return self.sessions.get(source_id)
+
+    def list(self):
+        with self.lock:
+            return list(self.sessions.values())
+
+    def stop(self, source_id, timeout=2.0):
+        session = self.get(source_id)
+        if session is None:
+            return False
+        session.stop(timeout)
+        self.discard(session)
+        return True
+
+    def stop_all(self, timeout=2.0):
+        for session in self.list():
+            session.stop(timeout)
+            self.discard(session)
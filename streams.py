@@ -0,0 +1,335 @@
+import itertools
+import threading
+import time
+
+import cv2
+
+from metrics import STAGE_SECONDS
+from pipeline import DropOldestQueue
+from session import Overlay
+from tracing import TRACER
+
+# =========== MULTI-STREAM ENGINE ===========
+# Every registered source gets a capture thread that keeps its newest frame.
+# A single scheduler thread gathers due frames from several streams and runs
+# them through the shared net as one batch, so N cameras cost one forward
+# pass per tick instead of N. Each stream then renders its results on its
+# own thread, in frame order, from a short queue that drops the oldest
+# result when rendering falls behind.
+
+
+def is_live_source(source):
+    """Camera indexes and network streams are live; anything else is a file"""
+    if isinstance(source, int) or str(source).isdigit():
+        return True
+    return str(source).startswith(('rtsp://', 'rtmp://', 'http://', 'https://'))
+
+
+def open_source(source):
+    """Open a camera index ("0", 1) or a file path / RTSP URL"""
+    if isinstance(source, int) or str(source).isdigit():
+        return cv2.VideoCapture(int(source)), True
+    return cv2.VideoCapture(str(source)), is_live_source(source)
+
+
+class Stream:
+    """One source registered with the engine, with its own capture thread and output"""
+
+    def __init__(self, stream_id, source, target_fps=10.0, output_queue_size=2, render_queue_size=2,
+                 motion_gate=None, controller=None, zones=None, priority=None):
+        self.stream_id = stream_id
+        self.source = source
+        self.target_fps = float(target_fps)
+        self.motion_gate = motion_gate
+        self.controller = controller
+        self.zones = zones
+        self.priority = priority
+        self.output = DropOldestQueue(output_queue_size)
+        # (frame, frame_index, result) waiting for the render thread
+        self.render_queue = DropOldestQueue(render_queue_size)
+        self.cap = None
+        self.is_live = True
+        self.cond = threading.Condition()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.render_thread = None
+
+        self.latest_frame = None
+        self.frame_seq = 0
+        self.taken_seq = 0
+        self.next_due = 0.0
+        self.last_served = 0.0
+
+        self.frames_captured = 0
+        self.frames_processed = 0
+        self.frames_inferred = 0
+        self.frames_overwritten = 0
+        self.overlay = Overlay()
+        self.started_at = None
+
+    def start(self, on_result):
+        """Start capturing, and rendering results with on_result(stream, frame, result, frame_index)"""
+        self.cap, self.is_live = open_source(self.source)
+        self.started_at = time.time()
+        self.thread = threading.Thread(target=self._capture_loop,
+                                       name=f"stream-{self.stream_id}", daemon=True)
+        self.render_thread = threading.Thread(target=self._render_loop, args=(on_result,),
+                                              name=f"stream-post-{self.stream_id}", daemon=True)
+        self.thread.start()
+        self.render_thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        self.stop_event.set()
+        with self.cond:
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        if self.cap is not None:
+            self.cap.release()
+        # Results already queued are still rendered before the thread exits
+        self.render_queue.close()
+        if self.render_thread is not None:
+            self.render_thread.join(timeout)
+        self.output.close()
+
+    @property
+    def running(self):
+        return not self.stop_event.is_set()
+
+    def _capture_loop(self):
+        TRACER.set_source(self.stream_id)
+        while not self.stop_event.is_set():
+            started = time.perf_counter()
+            success, frame = self.cap.read()
+            if not success:
+                break
+            STAGE_SECONDS.observe(time.perf_counter() - started, 'capture')
+            TRACER.record('capture', started, frame=self.frame_seq)
+            with self.cond:
+                # Files must not lose frames, so wait until the scheduler took the last one.
+                # Live sources just overwrite it and the scheduler sees the newest.
+                while (not self.is_live and self.frame_seq > self.taken_seq
+                       and not self.stop_event.is_set()):
+                    self.cond.wait(0.5)
+                if self.frame_seq > self.taken_seq:
+                    self.frames_overwritten += 1
+                self.latest_frame = frame
+                self.frame_seq += 1
+                self.frames_captured += 1
+        self.stop_event.set()
+
+    def _render_loop(self, on_result):
+        TRACER.set_source(self.stream_id)
+        while True:
+            item = self.render_queue.get()
+            if item is None:
+                break
+            frame, frame_index, result = item
+            try:
+                on_result(self, frame, result, frame_index)
+            except Exception as e:
+                print(f"[ERROR] Stream {self.stream_id} post-processing failed: {e}")
+
+    def is_due(self, now):
+        return self.frame_seq > self.taken_seq and now >= self.next_due
+
+    def take_frame(self, now, slowdown=1.0):
+        """Hand the newest frame to the scheduler and book the next slot, slowdown times later than usual"""
+        with self.cond:
+            frame = self.latest_frame
+            self.taken_seq = self.frame_seq
+            self.cond.notify_all()
+        interval = slowdown / self.target_fps if self.target_fps > 0 else 0.0
+        # Don't bank credit after a stall, or the stream would burst to catch up
+        self.next_due = max(self.next_due + interval, now)
+        self.last_served = now
+        return frame
+
+    def fps(self):
+        if not self.started_at:
+            return 0.0
+        return self.frames_processed / max(time.time() - self.started_at, 1e-6)
+
+    def stats(self):
+        stats = {
+            'stream_id': self.stream_id,
+            'source': str(self.source),
+            'running': self.running,
+            'target_fps': self.target_fps,
+            'priority': self.priority,
+            'fps': round(self.fps(), 2),
+            'frames_captured': self.frames_captured,
+            'frames_processed': self.frames_processed,
+            'frames_inferred': self.frames_inferred,
+            'dropped_capture': self.frames_overwritten,
+            'dropped_render': self.render_queue.dropped,
+            'dropped_output': self.output.dropped,
+            'render_queue_depth': len(self.render_queue),
+            'output_queue_depth': len(self.output),
+            'threat_count': self.overlay.threat_count,
+        }
+        if self.motion_gate is not None:
+            stats['inferences_skipped'] = self.motion_gate.inferences_skipped
+        if self.controller is not None:
+            stats.update(self.controller.stats())
+        if self.zones is not None:
+            stats['zones'] = self.zones.describe()
+        return stats
+
+
+class StreamRegistry:
+    """Runs many streams against one net through a fair batching scheduler
+
+    infer_batch(frames, input_size, zones, priorities, timings) returns one
+    (boxes, confidences, class_ids) per frame; input_size is None unless the
+    streams have resolution controllers, zones and priorities hold each
+    frame's stream ZoneSet and priority class (or None). infer_batch
+    appends the seconds its forward passes took to the timings list, leaving
+    out any wait for the net, which the controllers must not learn from.
+    on_result(stream, frame, result, frame_index) runs on each stream's own
+    render thread after each batch, typically to render the frame into
+    stream.output.
+    pacing(stream), if given, returns how many times longer than
+    1 / target_fps the stream waits for its next frame (admission control
+    backs lower classes off under load).
+    """
+
+    def __init__(self, infer_batch, on_result, max_batch=4, idle_wait=0.005, pacing=None):
+        self.infer_batch = infer_batch
+        self.on_result = on_result
+        self.pacing = pacing
+        self.max_batch = max(1, int(max_batch))
+        self.idle_wait = idle_wait
+        self.streams = {}
+        self.lock = threading.Lock()
+        # Generated ids never repeat, so one can't collide with a stream still running
+        self.id_seq = itertools.count(1)
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.batches_run = 0
+        self.frames_batched = 0
+
+    def add(self, stream_id, source, target_fps=10.0, **kwargs):
+        with self.lock:
+            if stream_id in self.streams:
+                raise ValueError(f"Stream '{stream_id}' already exists")
+            stream = Stream(stream_id, source, target_fps, **kwargs)
+            self.streams[stream_id] = stream
+        stream.start(self.on_result)
+        self._ensure_scheduler()
+        return stream
+
+    def new_id(self):
+        """A stream id that is not in use and was never generated before"""
+        with self.lock:
+            while True:
+                stream_id = f"stream-{next(self.id_seq)}"
+                if stream_id not in self.streams:
+                    return stream_id
+
+    def remove(self, stream_id):
+        with self.lock:
+            stream = self.streams.pop(stream_id, None)
+        if stream is not None:
+            stream.stop()
+        return stream is not None
+
+    def get(self, stream_id):
+        return self.streams.get(stream_id)
+
+    def list(self):
+        with self.lock:
+            return list(self.streams.values())
+
+    def shutdown(self):
+        self.stop_event.set()
+        for stream in self.list():
+            self.remove(stream.stream_id)
+        if self.thread is not None:
+            self.thread.join(2.0)
+
+    def _ensure_scheduler(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._schedule_loop,
+                                           name='stream-scheduler', daemon=True)
+            self.thread.start()
+
+    def next_batch(self, now):
+        """Pick up to max_batch due streams, least recently served first"""
+        ready = [s for s in self.list() if s.is_due(now)]
+        ready.sort(key=lambda s: s.last_served)
+        return ready[:self.max_batch]
+
+    def _schedule_loop(self):
+        while not self.stop_event.is_set():
+            now = time.time()
+            batch = self.next_batch(now)
+            if not batch:
+                # Drop finished file streams so their slots don't linger
+                for stream in self.list():
+                    if not stream.running and stream.frame_seq == stream.taken_seq:
+                        self.remove(stream.stream_id)
+                time.sleep(self.idle_wait)
+                continue
+
+            frames = [stream.take_frame(now, self.pacing(stream) if self.pacing is not None else 1.0)
+                      for stream in batch]
+            frame_indexes = [stream.taken_seq - 1 for stream in batch]
+            # Streams whose scene hasn't changed reuse their last detections
+            # and stay out of the batch entirely
+            results = [None] * len(batch)
+            to_infer = [i for i, (stream, frame) in enumerate(zip(batch, frames))
+                        if stream.motion_gate is None or stream.motion_gate.should_infer(frame, now)]
+            # A forward pass has one input size, so streams are batched with
+            # others at their own controller's level (None = the default size)
+            groups = {}
+            for i in to_infer:
+                controller = batch[i].controller
+                groups.setdefault(controller.input_size if controller is not None else None, []).append(i)
+            failed = set()
+            for input_size, members in groups.items():
+                timings = []
+                started = time.perf_counter()
+                try:
+                    inferred = self.infer_batch([frames[i] for i in members], input_size,
+                                                [batch[i].zones for i in members],
+                                                [batch[i].priority for i in members], timings)
+                except Exception as e:
+                    # The gates keep their reference frames; these frames show the last detections
+                    print(f"[ERROR] Batch inference failed: {e}")
+                    time.sleep(self.idle_wait)
+                    failed.update(members)
+                    continue
+                ended = time.perf_counter()
+                TRACER.record('batch', started, ended, streams=[batch[i].stream_id for i in members],
+                              size=input_size)
+                latency = sum(timings) if timings else ended - started
+                for i in members:
+                    if batch[i].controller is not None:
+                        batch[i].controller.record(latency, input_size)
+                self.batches_run += 1
+                self.frames_batched += len(members)
+                for i, result in zip(members, inferred):
+                    results[i] = result
+                    batch[i].frames_inferred += 1
+                    if batch[i].motion_gate is not None:
+                        batch[i].motion_gate.record(result, now)
+
+            for i, (stream, frame, frame_index, result) in enumerate(zip(batch, frames, frame_indexes, results)):
+                if result is None:
+                    if stream.motion_gate is None or stream.motion_gate.last_detections is None:
+                        # Inference failed with nothing earlier to show
+                        continue
+                    if i not in failed:
+                        stream.motion_gate.inferences_skipped += 1
+                    result = stream.motion_gate.last_detections
+                stream.frames_processed += 1
+                stream.render_queue.put((frame, frame_index, result))
+
+    def stats(self):
+        return {
+            'streams': [stream.stats() for stream in self.list()],
+            'batches_run': self.batches_run,
+            'avg_batch_size': round(self.frames_batched / self.batches_run, 2) if self.batches_run else 0.0,
+        }
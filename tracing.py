@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+
+# =========== FRAME TRACING ===========
+# Metrics say how long each stage takes on average; a trace shows where one
+# particular frame spent its time. While a recording window is open, every
+# stage of every frame (capture, resize, blob, forward, decode, nms, draw,
+# imencode, and the yield that hands a chunk to the client) is kept as a
+# span with its thread and source, and the result is exported in the Chrome
+# trace event format. Open it in https://ui.perfetto.dev or chrome://tracing
+# to see capture stalls, threads waiting on each other (the GIL, a slot of
+# the net) and slow clients on one timeline.
+#
+# Stages report spans they already time with time.perf_counter(). With no
+# window open, record() returns after one attribute check, so tracing costs
+# nothing measurable until it is switched on.
+
+
+class TraceRecorder:
+    """Keeps the spans of a bounded recording window and exports them as Chrome trace JSON"""
+
+    def __init__(self):
+        self.active = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.done = threading.Event()
+        self.events = []
+        self.threads = {}
+        self.origin = 0.0
+        self.deadline = 0.0
+        self.max_events = 0
+        self.truncated = False
+
+    def start(self, seconds=5.0, max_events=200000):
+        """Open a window that closes after seconds or max_events spans; False if one is already open"""
+        with self.lock:
+            if self.active:
+                return False
+            self.events = []
+            self.threads = {}
+            self.truncated = False
+            self.max_events = int(max_events)
+            self.origin = time.perf_counter()
+            self.deadline = self.origin + float(seconds)
+            self.done.clear()
+            self.active = True
+        return True
+
+    def wait(self, timeout=None):
+        """Block until the window closes (its time is up or it is full)"""
+        return self.done.wait(timeout)
+
+    def stop(self):
+        """Close the window and return what it recorded, as a Chrome trace object"""
+        with self.lock:
+            self.active = False
+            self.done.set()
+            events, threads, truncated = self.events, self.threads, self.truncated
+            self.events, self.threads = [], {}
+        pid = os.getpid()
+        metadata = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': 'nexus-77'}}]
+        metadata += [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                     for tid, name in threads.items()]
+        return {
+            'traceEvents': metadata + events,
+            'displayTimeUnit': 'ms',
+            'otherData': {'spans': len(events), 'truncated': truncated},
+        }
+
+    def set_source(self, source_id):
+        """Tag the spans this thread records from now on with a source (stream) id"""
+        self.local.source = source_id
+
+    def record(self, name, started, ended=None, **args):
+        """Add a span timed with time.perf_counter(); ends now unless ended is given"""
+        if not self.active:
+            return
+        ended = time.perf_counter() if ended is None else ended
+        if ended > self.deadline:
+            self.close_window()
+            return
+        # A span already running when the window opened shows from its start
+        started = max(started, self.origin)
+        thread = threading.current_thread()
+        source = getattr(self.local, 'source', None)
+        if source is not None and 'source' not in args:
+            args['source'] = source
+        event = {
+            'name': name,
+            'ph': 'X',
+            'ts': round((started - self.origin) * 1e6, 1),
+            'dur': round((ended - started) * 1e6, 1),
+            'pid': os.getpid(),
+            'tid': thread.ident,
+        }
+        if args:
+            event['args'] = args
+        with self.lock:
+            if not self.active:
+                return
+            self.events.append(event)
+            if thread.ident not in self.threads:
+                self.threads[thread.ident] = thread.name
+            if len(self.events) >= self.max_events:
+                # Full: end the window early rather than keep a partial tail
+                self.truncated = True
+                self.active = False
+                self.done.set()
+
+    def close_window(self):
+        """Stop recording but keep the spans for stop() to collect"""
+        with self.lock:
+            self.active = False
+            self.done.set()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'recording': self.active,
+                'spans': len(self.events),
+                'truncated': self.truncated,
+            }
+
+
+TRACER = TraceRecorder()
@@ -0,0 +1,212 @@
+import cv2
+import numpy as np
+
+from decoding import EMPTY_BOXES, EMPTY_CLASS_IDS, EMPTY_CONFIDENCES
+
+# =========== KEYFRAME TRACKING ===========
+# The network only runs on keyframes. In between, every track's box is
+# carried forward by a constant-velocity Kalman filter, optionally corrected
+# by the median Lucas-Kanade optical flow of points inside the box. On each
+# keyframe, detections are matched to the predicted tracks by IoU, so a
+# weapon that stays in view keeps one track ID and counts as one threat.
+#
+# A track the net did not confirm on the last keyframe coasts: it is kept
+# for up to max_misses keyframes so the object keeps its ID if it comes
+# back, but it is not reported, so nothing is drawn, counted or logged for
+# a box the net just said is gone.
+
+
+def iou_matrix(a, b):
+    """Pairwise IoU between two (N, 4) / (M, 4) arrays of [x, y, w, h] boxes"""
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    ax2, ay2 = a[:, 0] + a[:, 2], a[:, 1] + a[:, 3]
+    bx2, by2 = b[:, 0] + b[:, 2], b[:, 1] + b[:, 3]
+    iw = np.clip(np.minimum(ax2[:, None], bx2[None]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    ih = np.clip(np.minimum(ay2[:, None], by2[None]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    inter = iw * ih
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None] - inter
+    return inter / np.maximum(union, 1e-6)
+
+
+class Track:
+    """One tracked object: a Kalman filter over [cx, cy, w, h] and their velocities"""
+
+    def __init__(self, track_id, box, confidence, class_id):
+        self.track_id = track_id
+        self.confidence = confidence
+        self.class_id = class_id
+        self.misses = 0
+        self.age = 0
+
+        kf = cv2.KalmanFilter(8, 4)
+        kf.transitionMatrix = np.eye(8, dtype=np.float32)
+        for i in range(4):
+            kf.transitionMatrix[i, i + 4] = 1.0
+        kf.measurementMatrix = np.eye(4, 8, dtype=np.float32)
+        kf.processNoiseCov = np.diag([1, 1, 1, 1, 0.1, 0.1, 0.05, 0.05]).astype(np.float32)
+        kf.measurementNoiseCov = np.eye(4, dtype=np.float32) * 4.0
+        kf.errorCovPost = np.diag([10, 10, 10, 10, 100, 100, 100, 100]).astype(np.float32)
+        kf.statePost = np.zeros((8, 1), dtype=np.float32)
+        kf.statePost[:4, 0] = self._to_state(box)
+        self.kf = kf
+        self.box = np.asarray(box, dtype=np.float32)
+
+    @staticmethod
+    def _to_state(box):
+        x, y, w, h = box
+        return np.array([x + w / 2, y + h / 2, w, h], dtype=np.float32)
+
+    @staticmethod
+    def _to_box(state):
+        cx, cy, w, h = state[:4].reshape(-1)
+        w, h = max(w, 1.0), max(h, 1.0)
+        return np.array([cx - w / 2, cy - h / 2, w, h], dtype=np.float32)
+
+    def predict(self):
+        self.box = self._to_box(self.kf.predict())
+        self.age += 1
+        return self.box
+
+    def correct(self, box, confidence=None, class_id=None):
+        self.box = self._to_box(self.kf.correct(self._to_state(box).reshape(4, 1)))
+        if confidence is not None:
+            self.confidence = confidence
+            self.class_id = class_id
+            self.misses = 0
+        return self.box
+
+
+class KeyframeTracker:
+    """Runs detection every few frames and tracks boxes in between
+
+    interval is the number of frames between keyframes. With adaptive=True it
+    drops to min_interval whenever tracks appear or disappear and creeps back
+    up to max_interval while the scene is stable. propagation is 'flow'
+    (optical flow + Kalman) or 'kalman' (prediction only).
+    """
+
+    def __init__(self, interval=5, adaptive=True, min_interval=2, max_interval=15,
+                 iou_threshold=0.3, max_misses=2, propagation='flow'):
+        if propagation not in ('flow', 'kalman'):
+            raise ValueError(f"Unknown propagation '{propagation}'")
+        self.interval = max(1, int(interval))
+        self.adaptive = adaptive
+        self.min_interval = max(1, int(min_interval))
+        self.max_interval = max(self.min_interval, int(max_interval))
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.propagation = propagation
+        self.tracks = []
+        self.next_id = 1
+        self.frames_since_keyframe = None
+        self.prev_gray = None
+        self.keyframes = 0
+        self.tracked_frames = 0
+
+    def update(self, frame, infer):
+        """Advance one frame; infer(frame) is only called on keyframes
+
+        Returns (boxes, confidences, class_ids, track_ids, new_tracks) where
+        new_tracks is the number of tracks started on this frame.
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if self.propagation == 'flow' else None
+        previous_boxes = [track.box.copy() for track in self.tracks]
+        for track in self.tracks:
+            track.predict()
+
+        new_tracks = 0
+        if self.frames_since_keyframe is None or self.frames_since_keyframe + 1 >= self.interval:
+            new_tracks = self._keyframe(*infer(frame))
+            self.frames_since_keyframe = 0
+            self.keyframes += 1
+        else:
+            if gray is not None and self.prev_gray is not None:
+                self._apply_flow(self.prev_gray, gray, previous_boxes)
+            self.frames_since_keyframe += 1
+            self.tracked_frames += 1
+        self.prev_gray = gray
+        return self.current() + (new_tracks,)
+
+    def _keyframe(self, boxes, confidences, class_ids):
+        lost_before = len(self.tracks)
+        matched_tracks = set()
+        matched_detections = set()
+        if self.tracks and len(boxes):
+            ious = iou_matrix([t.box for t in self.tracks], boxes)
+            # Greedy matching, best IoU first - plenty for a handful of objects
+            for flat in np.argsort(-ious, axis=None):
+                ti, di = np.unravel_index(flat, ious.shape)
+                if ious[ti, di] < self.iou_threshold:
+                    break
+                if ti in matched_tracks or di in matched_detections:
+                    continue
+                self.tracks[ti].correct(boxes[di], float(confidences[di]), int(class_ids[di]))
+                matched_tracks.add(ti)
+                matched_detections.add(di)
+
+        survivors = []
+        for i, track in enumerate(self.tracks):
+            if i not in matched_tracks:
+                track.misses += 1
+            if track.misses <= self.max_misses:
+                survivors.append(track)
+
+        new_tracks = 0
+        for di in range(len(boxes)):
+            if di not in matched_detections:
+                survivors.append(Track(self.next_id, boxes[di], float(confidences[di]), int(class_ids[di])))
+                self.next_id += 1
+                new_tracks += 1
+        self.tracks = survivors
+
+        if self.adaptive:
+            changed = new_tracks > 0 or len(survivors) - new_tracks < lost_before
+            if changed:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval + 1, self.max_interval)
+        return new_tracks
+
+    def _apply_flow(self, prev_gray, gray, previous_boxes):
+        height, width = gray.shape[:2]
+        for track, box in zip(self.tracks, previous_boxes):
+            # Flow is measured from where the box was on the previous frame
+            x, y, w, h = box
+            x0, y0 = int(max(x, 0)), int(max(y, 0))
+            x1, y1 = int(min(x + w, width)), int(min(y + h, height))
+            if x1 - x0 < 8 or y1 - y0 < 8:
+                continue
+            points = cv2.goodFeaturesToTrack(prev_gray[y0:y1, x0:x1], 20, 0.01, 3)
+            if points is None:
+                continue
+            points = points.astype(np.float32) + np.float32([x0, y0])
+            moved, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None,
+                                                        winSize=(15, 15), maxLevel=2)
+            ok = status.reshape(-1) == 1
+            if ok.sum() < 3:
+                continue
+            dx, dy = np.median((moved - points).reshape(-1, 2)[ok], axis=0)
+            # Use the flow-shifted box as a measurement so the velocity keeps up
+            track.correct(np.array([x + dx, y + dy, w, h], dtype=np.float32))
+
+    def current(self):
+        """(boxes, confidences, class_ids, track_ids) of the tracks confirmed on the last keyframe"""
+        tracks = [t for t in self.tracks if t.misses == 0]
+        if not tracks:
+            return EMPTY_BOXES, EMPTY_CONFIDENCES, EMPTY_CLASS_IDS, np.zeros((0,), dtype=np.int32)
+        boxes = np.array([t.box for t in tracks]).round().astype(np.int32)
+        confidences = np.array([t.confidence for t in tracks], dtype=np.float32)
+        class_ids = np.array([t.class_id for t in tracks], dtype=np.int32)
+        track_ids = np.array([t.track_id for t in tracks], dtype=np.int32)
+        return boxes, confidences, class_ids, track_ids
+
+    def stats(self):
+        return {
+            'keyframes': self.keyframes,
+            'tracked_frames': self.tracked_frames,
+            'active_tracks': sum(1 for t in self.tracks if t.misses == 0),
+            'coasting_tracks': sum(1 for t in self.tracks if t.misses > 0),
+            'tracks_started': self.next_id - 1,
+            'keyframe_interval': self.interval,
+        }
@@ -0,0 +1,259 @@
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+
+# =========== CHUNKED UPLOADS ===========
+# Large footage is sent as a series of chunks, each one small enough for the
+# per-request size cap. Every chunk says which byte offset it starts at, so
+# an interrupted upload resumes from the offset the server reports instead of
+# starting over. Bytes are hashed as they arrive. Finished files are stored
+# under their SHA-256, so the same evidence uploaded twice (or under another
+# name) is kept once. Readers can wait on a session for new bytes, which is
+# what lets detection start on the received prefix of a video.
+#
+# Retention: files not used for retention_seconds are deleted, oldest first
+# once the folder is over max_total_bytes, and abandoned partial uploads
+# expire after session_timeout.
+
+SHA256_HEX = re.compile(r'^[0-9a-f]{64}$')
+DIGEST_NAME = re.compile(r'^[0-9a-f]{64}\.[A-Za-z0-9]+$')
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class UploadSession:
+    """One upload in progress (or just finished)"""
+
+    def __init__(self, upload_id, filename, part_path, size=None):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.ext = filename.rsplit('.', 1)[1].lower()
+        self.part_path = part_path
+        self.size = size
+        self.received = 0
+        self.sha = hashlib.sha256()
+        self.digest = None
+        self.file_path = None
+        self.complete = False
+        self.closed = False
+        self.deduplicated = False
+        self.updated = time.time()
+        self.cond = threading.Condition()
+        # Held across the offset check and the write, so a retried chunk can't append twice
+        self.writer = threading.Lock()
+
+    @property
+    def path(self):
+        """Where the bytes received so far can be read from"""
+        return self.file_path if self.complete else self.part_path
+
+    def wait_for(self, received, timeout=None):
+        """Block until more than received bytes arrived, the upload finished or was closed"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.received > received or self.complete or self.closed, timeout)
+            return self.received
+
+    def describe(self):
+        return {
+            'upload_id': self.upload_id,
+            'filename': self.filename,
+            'offset': self.received,
+            'size': self.size,
+            'complete': self.complete,
+            'deduplicated': self.deduplicated,
+            'file_path': self.file_path,
+        }
+
+
+class UploadStore:
+    """Resumable chunked uploads into a content-addressed, size-bounded folder"""
+
+    def __init__(self, upload_dir, max_total_bytes=None, retention_seconds=None,
+                 session_timeout=3600.0, max_file_bytes=None, in_use=None):
+        self.upload_dir = upload_dir
+        self.part_dir = os.path.join(upload_dir, '.partial')
+        self.max_total_bytes = max_total_bytes
+        self.retention_seconds = retention_seconds
+        self.session_timeout = session_timeout
+        self.max_file_bytes = max_file_bytes
+        # in_use() -> paths of stored files that are being played and must not be pruned
+        self.in_use = in_use
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.files_deduplicated = 0
+        self.files_pruned = 0
+
+    def digest_path(self, digest, ext):
+        return os.path.join(self.upload_dir, f"{digest}.{ext}")
+
+    def create(self, filename, size=None, digest=None):
+        """Start an upload; with a known digest of a stored file it is complete at once"""
+        if self.max_file_bytes and size and size > self.max_file_bytes:
+            raise UploadTooLarge('File too large')
+        os.makedirs(self.part_dir, exist_ok=True)
+        upload_id = uuid.uuid4().hex
+        session = UploadSession(upload_id, filename, os.path.join(self.part_dir, f"{upload_id}.part"), size)
+        digest = digest.lower() if digest and SHA256_HEX.match(digest.lower()) else None
+        if digest and os.path.exists(self.digest_path(digest, session.ext)):
+            # The client already told us what it is, and we have it: nothing to send
+            self._complete(session, digest, existing=True)
+        else:
+            open(session.part_path, 'wb').close()
+        with self.lock:
+            self.sessions[upload_id] = session
+        self.prune()
+        return session
+
+    def get(self, upload_id):
+        with self.lock:
+            return self.sessions.get(upload_id)
+
+    def append(self, session, offset, stream, final=False, piece_size=1024 * 1024):
+        """Write the chunk read from stream at offset; finishes the upload when final
+
+        Raises ValueError when offset isn't where the upload stands (the
+        caller should resume from session.received) or another request is
+        still writing to it, UploadTooLarge when the file outgrows
+        max_file_bytes.
+        """
+        # One writer at a time: a second PUT (a client retrying a slow chunk)
+        # is turned away rather than left to pass the same offset check
+        if not session.writer.acquire(blocking=False):
+            raise ValueError(f"Another chunk is still being written; resume from {session.received}")
+        try:
+            with session.cond:
+                if session.complete or session.closed:
+                    raise ValueError('Upload already finished')
+                if offset != session.received:
+                    raise ValueError(f"Expected offset {session.received}")
+            # Only the writer touches the part file; readers follow session.received
+            with open(session.part_path, 'ab') as f:
+                while True:
+                    piece = stream.read(piece_size)
+                    if not piece:
+                        break
+                    if self.max_file_bytes and session.received + len(piece) > self.max_file_bytes:
+                        raise UploadTooLarge('File too large')
+                    f.write(piece)
+                    f.flush()
+                    session.sha.update(piece)
+                    with session.cond:
+                        if session.closed:
+                            raise ValueError('Upload aborted')
+                        session.received += len(piece)
+                        session.updated = time.time()
+                        session.cond.notify_all()
+            if final or (session.size is not None and session.received >= session.size):
+                self._complete(session, session.sha.hexdigest())
+                self.prune()
+        finally:
+            session.writer.release()
+        return session
+
+    def _complete(self, session, digest, existing=False):
+        file_path = self.digest_path(digest, session.ext)
+        if os.path.exists(file_path):
+            # Same content is already stored: keep that copy and mark it as used
+            session.deduplicated = True
+            self.files_deduplicated += 1
+            os.utime(file_path)
+            if not existing and os.path.exists(session.part_path):
+                os.remove(session.part_path)
+        else:
+            os.replace(session.part_path, file_path)
+        with session.cond:
+            session.digest = digest
+            session.file_path = file_path
+            if existing:
+                session.received = session.size or os.path.getsize(file_path)
+            session.complete = True
+            session.updated = time.time()
+            session.cond.notify_all()
+
+    def store_file(self, path, ext, digest):
+        """Move an already saved file into the store; returns its stored path"""
+        os.makedirs(self.upload_dir, exist_ok=True)
+        file_path = self.digest_path(digest, ext)
+        if os.path.exists(file_path):
+            self.files_deduplicated += 1
+            os.utime(file_path)
+            os.remove(path)
+        else:
+            os.replace(path, file_path)
+        self.prune()
+        return file_path
+
+    def new_part_path(self):
+        """A fresh path in the partial folder, for uploads saved in one request"""
+        os.makedirs(self.part_dir, exist_ok=True)
+        return os.path.join(self.part_dir, f"{uuid.uuid4().hex}.part")
+
+    def abort(self, session):
+        with session.cond:
+            session.closed = True
+            session.cond.notify_all()
+        with self.lock:
+            self.sessions.pop(session.upload_id, None)
+        if not session.complete and os.path.exists(session.part_path):
+            os.remove(session.part_path)
+
+    def touch(self, path):
+        """Mark a stored file as just used, so retention keeps it; returns its digest, or None"""
+        name = os.path.basename(path)
+        if (not DIGEST_NAME.match(name) or not os.path.exists(path)
+                or os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.upload_dir)):
+            return None
+        os.utime(path)
+        return name.split('.', 1)[0]
+
+    def prune(self):
+        """Expire idle sessions and drop stored files past retention or over the size budget"""
+        now = time.time()
+        with self.lock:
+            expired = [s for s in self.sessions.values() if now - s.updated > self.session_timeout]
+        for session in expired:
+            self.abort(session)
+
+        if not os.path.isdir(self.upload_dir):
+            return
+        keep = {os.path.abspath(path) for path in (self.in_use() if self.in_use else ())}
+        with self.lock:
+            keep.update(os.path.abspath(s.file_path) for s in self.sessions.values() if s.file_path)
+        files = []
+        for name in os.listdir(self.upload_dir):
+            path = os.path.join(self.upload_dir, name)
+            if DIGEST_NAME.match(name) and os.path.abspath(path) not in keep:
+                stat = os.stat(path)
+                files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in files:
+            too_old = self.retention_seconds and now - mtime > self.retention_seconds
+            too_big = self.max_total_bytes and total > self.max_total_bytes
+            if not (too_old or too_big):
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.files_pruned += 1
+
+    def stats(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+        stored = 0
+        if os.path.isdir(self.upload_dir):
+            stored = sum(entry.stat().st_size for entry in os.scandir(self.upload_dir)
+                         if entry.is_file() and DIGEST_NAME.match(entry.name))
+        return {
+            'uploads_in_progress': sum(1 for s in sessions if not s.complete),
+            'upload_bytes_stored': stored,
+            'uploads_deduplicated': self.files_deduplicated,
+            'uploads_pruned': self.files_pruned,
+        }
@@ -0,0 +1,399 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+import cv2
+import numpy as np
+
+from metrics import BATCH_SIZE, STAGE_SECONDS
+
+# =========== INFERENCE WORKER POOL ===========
+# Each worker process loads its own backend and gets its own thread budget
+# (and, on Linux, its own group of cores). Frames never go through pickle:
+# the web process copies each frame once into a slot of a shared-memory ring
+# and only sends the slot number to a worker. Workers read the frame in place
+# and send back the small detection arrays.
+#
+# Every worker has its own pipe, and the parent picks the worker with the
+# fewest tasks outstanding. A worker that dies (a crash in the backend, the
+# OOM killer) can then only take its own pipe down with it: the collector
+# sees its process exit, fails the tasks that were sent to it, gives their
+# ring slots back and starts a replacement. A worker that hangs instead
+# (alive, but sitting on a task past task_timeout) is killed and goes the
+# same way. A queue shared by all workers could be left locked by a process
+# killed halfway through a read.
+
+
+def core_groups(workers, threads_per_worker=0):
+    """Split the cores this process may use into one group per worker"""
+    if hasattr(os, 'sched_getaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+    if not threads_per_worker:
+        threads_per_worker = max(1, len(cores) // workers)
+    groups = []
+    for i in range(workers):
+        start = (i * threads_per_worker) % len(cores)
+        groups.append([cores[(start + j) % len(cores)] for j in range(threads_per_worker)])
+    return groups
+
+
+def worker_main(index, shm_name, ring_shape, conn, backend_options, cores, letterbox):
+    """Entry point of one worker process"""
+    # Imported here so the parent only pays for them once it starts a pool
+    from backends import create_backend
+    from decoding import decode_batch
+    from preprocess import BlobBuilder
+
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    cv2.setNumThreads(len(cores) if cores else 1)
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    ring = np.ndarray(ring_shape, dtype=np.uint8, buffer=shm.buf)
+    try:
+        backend = create_backend(**backend_options)
+    except Exception as e:
+        conn.send(('failed', index, repr(e)))
+        return
+    builder = BlobBuilder(letterbox=letterbox)
+    conn.send(('ready', index, None))
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        task_id, frames, input_size, target_sizes = task
+        try:
+            # Stage timings go back with the results; metrics live in the parent
+            started = time.perf_counter()
+            images = [ring[slot, :height, :width] for slot, height, width in frames]
+            blob, layouts = builder.build(images, input_size)
+            preprocessed = time.perf_counter()
+            outs = backend.forward(blob)
+            forwarded = time.perf_counter()
+            results = decode_batch(outs, layouts, input_size, target_sizes)
+            timings = (('preprocess', preprocessed - started), ('forward', forwarded - preprocessed),
+                       ('postprocess', time.perf_counter() - forwarded))
+            conn.send((task_id, results, None, timings))
+        except Exception as e:
+            conn.send((task_id, None, repr(e), ()))
+
+    del ring
+    shm.close()
+
+
+class InferencePool:
+    """Process pool that runs batches of frames through per-process backends
+
+    backend_options are the keyword arguments of backends.create_backend.
+    Frames larger than max_frame (height, width) are downscaled into their
+    slot; boxes still come back in each frame's own (or requested) size.
+    """
+
+    def __init__(self, backend_options, workers=2, threads_per_worker=0, slots=0,
+                 max_frame=(1080, 1920), letterbox=False, start_timeout=120, check_interval=1.0,
+                 task_timeout=30.0, slot_timeout=30.0):
+        self.workers = max(1, int(workers))
+        self.slots = int(slots) or self.workers * 4
+        self.max_frame = tuple(max_frame)
+        self.ring_shape = (self.slots, self.max_frame[0], self.max_frame[1], 3)
+        self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(self.ring_shape)))
+        self.ring = np.ndarray(self.ring_shape, dtype=np.uint8, buffer=self.shm.buf)
+        self.backend_options = backend_options
+        self.letterbox = letterbox
+        self.start_timeout = start_timeout
+        self.check_interval = check_interval
+        # Seconds a worker may sit on a task, and a submit may wait for ring slots
+        self.task_timeout = task_timeout
+        self.slot_timeout = slot_timeout
+
+        self.free_slots = list(range(self.slots))
+        self.slot_cond = threading.Condition()
+        # task id -> (future, ring slots, worker index, the pipe it was sent on, deadline)
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.next_task_id = 0
+        self.tasks_done = 0
+        self.tasks_failed = 0
+        self.restarts = 0
+        self.timeouts = 0
+        self.closed = False
+        self.error = None
+
+        self.ctx = multiprocessing.get_context('spawn')
+        self.cores = core_groups(self.workers, threads_per_worker)
+        self.processes = [None] * self.workers
+        self.conns = [None] * self.workers
+        self.send_locks = [threading.Lock() for _ in range(self.workers)]
+        self.outstanding = [0] * self.workers
+        self.spawned_at = [0.0] * self.workers
+        # When each worker reported its model loaded; None while it is loading
+        self.ready_at = [None] * self.workers
+        # Workers that could not load their backend; they are not restarted
+        self.retired = set()
+        for index in range(self.workers):
+            self._spawn(index)
+
+        # Wait until every worker has its model loaded
+        waiting = set(range(self.workers))
+        deadline = time.time() + start_timeout
+        while waiting:
+            ready = wait([self.conns[i] for i in waiting] + [self.processes[i].sentinel for i in waiting], 1.0)
+            for index in list(waiting):
+                if self.conns[index] in ready and self.conns[index].poll():
+                    kind, _, error = self.conns[index].recv()
+                    if kind == 'failed':
+                        self.close()
+                        raise RuntimeError(f"Inference worker {index} failed to start: {error}")
+                    self.ready_at[index] = time.monotonic()
+                    waiting.discard(index)
+                elif self.processes[index].exitcode is not None:
+                    self.close()
+                    raise RuntimeError(f"Inference workers failed to start: {self.processes[index].name}")
+            if waiting and time.time() > deadline:
+                self.close()
+                raise RuntimeError('Inference workers failed to start: timeout')
+
+        self.collector = threading.Thread(target=self._collect, name='inference-results', daemon=True)
+        self.collector.start()
+
+    def _spawn(self, index):
+        conn, child_conn = self.ctx.Pipe()
+        process = self.ctx.Process(target=worker_main, name=f"inference-worker-{index}", daemon=True,
+                                   args=(index, self.shm.name, self.ring_shape, child_conn,
+                                         self.backend_options, self.cores[index], self.letterbox))
+        process.start()
+        # Only the worker holds the other end, so its exit shows up as EOF here
+        child_conn.close()
+        self.processes[index] = process
+        self.conns[index] = conn
+        self.spawned_at[index] = time.monotonic()
+        self.ready_at[index] = None
+
+    def _acquire_slots(self, count):
+        with self.slot_cond:
+            # Backpressure: wait for the workers to hand slots back
+            if not self.slot_cond.wait_for(lambda: len(self.free_slots) >= count, self.slot_timeout):
+                raise RuntimeError(f"No free ring slots within {self.slot_timeout:g}s")
+            taken = self.free_slots[:count]
+            del self.free_slots[:count]
+            return taken
+
+    def _release_slots(self, slots):
+        with self.slot_cond:
+            self.free_slots.extend(slots)
+            self.slot_cond.notify_all()
+
+    def submit(self, images, input_size=416, target_sizes=None):
+        """Queue a batch; the Future resolves to one (boxes, confidences, class_ids) per image"""
+        if len(images) > self.slots:
+            raise ValueError(f"Batch of {len(images)} is larger than the ring ({self.slots} slots)")
+        if self.closed or self.error is not None:
+            raise RuntimeError(self.error or 'Inference pool is closed')
+        if target_sizes is None:
+            target_sizes = [(image.shape[1], image.shape[0]) for image in images]
+        slots = self._acquire_slots(len(images))
+        frames = []
+        for slot, image in zip(slots, images):
+            height, width = image.shape[:2]
+            if height > self.max_frame[0] or width > self.max_frame[1]:
+                scale = min(self.max_frame[0] / height, self.max_frame[1] / width)
+                width, height = max(1, int(width * scale)), max(1, int(height * scale))
+                cv2.resize(image, (width, height), dst=self.ring[slot, :height, :width])
+            else:
+                self.ring[slot, :height, :width] = image
+            frames.append((slot, height, width))
+
+        future = Future()
+        deadline = time.monotonic() + self.task_timeout if self.task_timeout else None
+        with self.pending_lock:
+            task_id = self.next_task_id
+            self.next_task_id += 1
+            # A worker still loading (a replacement) takes tasks too; they wait in its pipe
+            candidates = [i for i in range(self.workers) if i not in self.retired]
+            index = min(candidates, key=lambda i: self.outstanding[i]) if candidates else None
+            conn = self.conns[index] if index is not None else None
+            if index is not None:
+                self.outstanding[index] += 1
+            self.pending[task_id] = (future, slots, index, conn, deadline)
+        if index is None:
+            self._fail(task_id, 'No inference workers left')
+            return future
+        with self.send_locks[index]:
+            try:
+                conn.send((task_id, frames, input_size, list(target_sizes)))
+            except (OSError, ValueError):
+                # The worker died between picking it and sending; the collector replaces it
+                self._fail(task_id, f"Inference worker {index} is gone")
+        return future
+
+    def infer(self, images, input_size=416, target_sizes=None, timeout=None):
+        return self.submit(images, input_size, target_sizes).result(timeout)
+
+    def _collect(self):
+        while not self.closed:
+            live = [i for i in range(self.workers) if self.conns[i] is not None]
+            try:
+                ready = wait([self.conns[i] for i in live] + [self.processes[i].sentinel for i in live],
+                             self.check_interval)
+            except (OSError, ValueError):
+                # A pipe closed under us: the pool is closing, or a worker was just replaced
+                continue
+            for index in live:
+                conn, process = self.conns[index], self.processes[index]
+                if conn in ready or process.sentinel in ready:
+                    if not self._drain(index, conn):
+                        self._replace(index, conn)
+                elif process.exitcode is not None:
+                    self._replace(index, conn)
+            self._expire()
+
+    def _drain(self, index, conn):
+        """Handle every message waiting on a worker's pipe; False once the worker is gone"""
+        try:
+            while conn.poll():
+                self._handle(index, conn.recv())
+        except (EOFError, OSError):
+            return False
+        return self.processes[index].exitcode is None
+
+    def _expire(self):
+        """Kill workers that hang on a task or on loading their model; _replace cleans up after them"""
+        now = time.monotonic()
+        for index in range(self.workers):
+            conn = self.conns[index]
+            if conn is None or self.processes[index].exitcode is not None:
+                continue
+            if self.ready_at[index] is None:
+                if now - self.spawned_at[index] > self.start_timeout:
+                    self._kill(index, conn, f"did not load its model within {self.start_timeout:g}s")
+                continue
+            if not self.task_timeout:
+                continue
+            # Tasks sent while a replacement loaded only start counting once it is ready
+            started = self.ready_at[index] + self.task_timeout
+            with self.pending_lock:
+                late = any(sent_on is conn and max(deadline, started) < now
+                           for _, _, _, sent_on, deadline in self.pending.values())
+            if late:
+                self.timeouts += 1
+                self._kill(index, conn, f"did not answer within {self.task_timeout:g}s")
+
+    def _kill(self, index, conn, reason):
+        self.processes[index].kill()
+        self._replace(index, conn, reason)
+
+    def _handle(self, index, message):
+        if len(message) == 3:
+            # A replacement worker reporting in
+            kind, _, error = message
+            if kind == 'failed':
+                print(f"[ERROR] Inference worker {index} failed to restart: {error}")
+                self.retired.add(index)
+            else:
+                self.ready_at[index] = time.monotonic()
+            return
+        task_id, results, error, timings = message
+        with self.pending_lock:
+            future, slots, _, _, _ = self.pending.pop(task_id, (None, [], None, None, None))
+            if future is not None:
+                self.outstanding[index] -= 1
+        self._release_slots(slots)
+        self.tasks_done += 1
+        for stage, seconds in timings:
+            STAGE_SECONDS.observe(seconds, stage)
+        if results is not None:
+            BATCH_SIZE.observe(len(results))
+        if future is None:
+            return
+        if error is not None:
+            future.set_exception(RuntimeError(f"Inference worker error: {error}"))
+        else:
+            future.set_result(results)
+
+    def _replace(self, index, conn, reason=None):
+        """Fail the tasks sent to a dead worker and start another in its place"""
+        if self.closed:
+            return
+        process = self.processes[index]
+        process.join(1.0)
+        reason = reason or f"died (exit code {process.exitcode})"
+        with self.send_locks[index]:
+            conn.close()
+            if index in self.retired:
+                self.conns[index] = None
+            else:
+                print(f"[ERROR] Inference worker {index} {reason}; restarting it")
+                self._spawn(index)
+                self.restarts += 1
+        with self.pending_lock:
+            lost = [task_id for task_id, (_, _, _, sent_on, _) in self.pending.items() if sent_on is conn]
+        for task_id in lost:
+            self._fail(task_id, f"Inference worker {index} {reason}")
+        if len(self.retired) == self.workers:
+            # Nobody is left to run anything
+            self.error = 'No inference workers left'
+
+    def _fail(self, task_id, message):
+        with self.pending_lock:
+            future, slots, index, _, _ = self.pending.pop(task_id, (None, [], None, None, None))
+            if future is not None and index is not None:
+                self.outstanding[index] -= 1
+        self._release_slots(slots)
+        if future is None:
+            return
+        self.tasks_failed += 1
+        future.set_exception(RuntimeError(message))
+
+    def stats(self):
+        with self.slot_cond:
+            free = len(self.free_slots)
+        return {
+            'workers': self.workers,
+            'workers_alive': sum(1 for p in self.processes if p is not None and p.is_alive()),
+            'ring_slots': self.slots,
+            'ring_slots_in_use': self.slots - free,
+            'tasks_done': self.tasks_done,
+            'tasks_failed': self.tasks_failed,
+            'worker_restarts': self.restarts,
+            'worker_timeouts': self.timeouts,
+        }
+
+    def close(self):
+        """Stop the workers and free the ring; calling it again does nothing"""
+        if self.closed:
+            return
+        self.closed = True
+        for index, conn in enumerate(self.conns):
+            if conn is None:
+                continue
+            with self.send_locks[index]:
+                try:
+                    conn.send(None)
+                except (OSError, ValueError):
+                    pass
+        for process in self.processes:
+            if process is None:
+                continue
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        with self.pending_lock:
+            task_ids = list(self.pending)
+        for task_id in task_ids:
+            self._fail(task_id, 'Inference pool is closed')
+        for conn in self.conns:
+            if conn is not None:
+                conn.close()
+        del self.ring
+        self.shm.close()
+        self.shm.unlink()
@@ -0,0 +1,193 @@
+import json
+
+import cv2
+import numpy as np
+
+from decoding import EMPTY_BOXES, EMPTY_CLASS_IDS, EMPTY_CONFIDENCES, apply_nms
+from preprocess import scale_boxes
+
+# =========== ROI ZONES ===========
+# Most of a fixed camera's view (sky, walls, ceiling) can never hold a threat
+# worth reporting. A ZoneSet lists the regions that can, and inference only
+# sees crops around them:
+#
+#   union   one crop around all the zones (the default)
+#   zones   one crop per zone (overlapping ones merged), all in the same batch
+#
+# At the same input size a crop gets the whole blob, so small or distant
+# objects in the zones get more of the network's pixels. Alternatively the
+# input size can shrink with the crop (scaled_input_size), which keeps the
+# detail of a full-frame pass and makes the blob and forward pass smaller.
+# Boxes are mapped back to frame coordinates, and detections whose centre
+# is outside every zone are dropped.
+#
+# Zones are given in fractions of the frame (0..1), so they hold at any
+# capture or display resolution:
+#   [0.1, 0.5, 0.4, 0.5]                           rectangle x, y, w, h
+#   [[0.2, 1.0], [0.45, 0.4], [0.6, 0.4], [0.8, 1.0]]   polygon
+#   {"name": "door", "rect": [...]} / {"name": ..., "polygon": [...]}
+
+CROP_MODES = ('union', 'zones')
+
+
+def parse_zone(spec):
+    """One zone spec -> (name, float32 polygon in frame fractions)"""
+    name = None
+    if isinstance(spec, dict):
+        name = spec.get('name')
+        if 'rect' in spec:
+            spec = spec['rect']
+        elif 'polygon' in spec:
+            spec = spec['polygon']
+        else:
+            raise ValueError('A zone needs a rect or a polygon')
+    points = np.array(spec, dtype=np.float32)
+    if points.shape == (4,):
+        x, y, w, h = points
+        if w <= 0 or h <= 0:
+            raise ValueError('A zone rect needs a positive width and height')
+        points = np.array([[x, y], [x + w, y], [x + w, y + h], [x, y + h]], dtype=np.float32)
+    elif points.ndim != 2 or points.shape[1] != 2 or len(points) < 3:
+        raise ValueError('A zone is a rect [x, y, w, h] or a polygon of at least 3 [x, y] points')
+    if points.min() < 0 or points.max() > 1:
+        raise ValueError('Zone coordinates are fractions of the frame, between 0 and 1')
+    return name, points
+
+
+class ZoneSet:
+    """Regions of a source's frame to run detection on"""
+
+    def __init__(self, zones, crop_mode='union', margin=0.05):
+        if crop_mode not in CROP_MODES:
+            raise ValueError(f"Unknown ROI crop mode: {crop_mode}")
+        self.zones = [parse_zone(zone) for zone in zones]
+        if not self.zones:
+            raise ValueError('No zones given')
+        self.crop_mode = crop_mode
+        # Context kept around each crop, as a fraction of the frame
+        self.margin = float(margin)
+        self.crop_cache = {}
+
+    @classmethod
+    def parse(cls, spec, crop_mode='union', margin=0.05):
+        """A list of zones (or its JSON) -> ZoneSet; None or empty means the whole frame"""
+        if spec is None or isinstance(spec, cls):
+            return spec
+        if isinstance(spec, str):
+            spec = json.loads(spec) if spec.strip() else None
+        if not spec:
+            return None
+        return cls(spec, crop_mode, margin)
+
+    def crops(self, width, height):
+        """Pixel rects (x, y, w, h) of a width x height frame to run the net on"""
+        key = (width, height)
+        if key not in self.crop_cache:
+            rects = [self._bounds(points, width, height) for _, points in self.zones]
+            if self.crop_mode == 'union':
+                rects = [union(rects)]
+            else:
+                rects = merge_overlapping(rects)
+            self.crop_cache[key] = [(x0, y0, x1 - x0, y1 - y0) for x0, y0, x1, y1 in rects
+                                    if x1 > x0 and y1 > y0]
+        return self.crop_cache[key]
+
+    def _bounds(self, points, width, height):
+        x0, y0 = points.min(axis=0) - self.margin
+        x1, y1 = points.max(axis=0) + self.margin
+        return (max(0, int(np.floor(x0 * width))), max(0, int(np.floor(y0 * height))),
+                min(width, int(np.ceil(x1 * width))), min(height, int(np.ceil(y1 * height))))
+
+    def scaled_input_size(self, width, height, input_size, multiple=32):
+        """Input size giving the crops the pixel density input_size gives the whole frame"""
+        fraction = max(max(w / width, h / height) for _, _, w, h in self.crops(width, height))
+        scaled = int(np.ceil(input_size * fraction / multiple)) * multiple
+        return max(multiple, min(input_size, scaled))
+
+    def contains(self, boxes, frame_size):
+        """Boolean mask of the [x, y, w, h] boxes whose centre is inside a zone"""
+        width, height = frame_size
+        inside = np.zeros(len(boxes), dtype=bool)
+        for i, (x, y, w, h) in enumerate(boxes):
+            centre = (float((x + w / 2) / width), float((y + h / 2) / height))
+            inside[i] = any(cv2.pointPolygonTest(points, centre, False) >= 0 for _, points in self.zones)
+        return inside
+
+    def describe(self):
+        return {
+            'zones': [{'name': name, 'polygon': points.round(4).tolist()} for name, points in self.zones],
+            'crop_mode': self.crop_mode,
+            'margin': self.margin,
+        }
+
+
+def union(rects):
+    return (min(r[0] for r in rects), min(r[1] for r in rects),
+            max(r[2] for r in rects), max(r[3] for r in rects))
+
+
+def merge_overlapping(rects):
+    """Merge (x0, y0, x1, y1) rects until none overlap, so no pixel is inferred twice"""
+    rects = list(rects)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                a, b = rects[i], rects[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    rects[i] = union([a, b])
+                    del rects[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return rects
+
+
+def infer_in_zones(infer_batch, frames, zone_sets, target_sizes=None):
+    """Detections per frame, running only the zone crops of frames that have zones
+
+    infer_batch(images, target_sizes) is run once over every crop of every
+    frame (the whole frame where its ZoneSet is None). Results are in pixels
+    of target_sizes[i], or of the frame itself.
+    """
+    target_sizes = target_sizes or [None] * len(frames)
+    images, sizes, spans = [], [], []
+    for frame, zones, target_size in zip(frames, zone_sets, target_sizes):
+        height, width = frame.shape[:2]
+        target_size = target_size or (width, height)
+        crops = zones.crops(width, height) if zones is not None else None
+        spans.append((len(images), crops, (width, height), target_size, zones))
+        if crops is None:
+            images.append(frame)
+            sizes.append(target_size)
+            continue
+        for x, y, w, h in crops:
+            images.append(frame[y:y + h, x:x + w])
+            # Boxes in crop pixels, moved to the frame and scaled once all crops are in
+            sizes.append((w, h))
+    results = infer_batch(images, sizes) if images else []
+
+    detections = []
+    for start, crops, frame_size, target_size, zones in spans:
+        if crops is None:
+            detections.append(results[start])
+            continue
+        parts = [(boxes + np.array([x, y, 0, 0], dtype=np.int32), confidences, class_ids)
+                 for (x, y, _, _), (boxes, confidences, class_ids)
+                 in zip(crops, results[start:start + len(crops)]) if len(boxes)]
+        if not parts:
+            detections.append((EMPTY_BOXES, EMPTY_CONFIDENCES, EMPTY_CLASS_IDS))
+            continue
+        boxes = np.concatenate([part[0] for part in parts])
+        confidences = np.concatenate([part[1] for part in parts])
+        class_ids = np.concatenate([part[2] for part in parts])
+        if len(parts) > 1:
+            # Margins overlap, so an object on a crop edge can show up in two crops
+            keep = apply_nms(boxes, confidences)
+            boxes, confidences, class_ids = boxes[keep], confidences[keep], class_ids[keep]
+        keep = zones.contains(boxes, frame_size)
+        detections.append((scale_boxes(boxes[keep], frame_size, target_size),
+                           confidences[keep], class_ids[keep]))
+    return detections